@@ -0,0 +1,132 @@
+"""
+Vectorised as-of joins of patient spells.
+
+Registrations, addresses and deaths are spells: rows with a patient, a start
+date and an optional end date.  An as-of lookup finds, for a patient and a
+date, the spell that is active on that date (started on or before it, and
+not ended on or before it).  When several spells are active, as with
+overlapping registrations, the one that started last is used, then the one
+that ends last.
+
+The spells are sorted by (patient, start, end) once.  Every (patient, date)
+pair is then resolved with a single binary search over combined
+(patient, start) keys.  A spell found this way has the latest start on or
+before the date; if it has ended, the search steps back to the patient's
+earlier spells, which only happens for overlapping spells.
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+# End day of open spells
+OPEN = np.iinfo(np.int64).max
+
+
+class SpellIndex(NamedTuple):
+    # Combined (patient, start) keys, sorted
+    keys: np.ndarray
+    ends: np.ndarray
+    # Row of the spell table of each sorted spell
+    rows: np.ndarray
+    offsets: np.ndarray
+    base: int
+    span: int
+
+
+def build_spell_index(spell_patient_ids, starts, ends, patient_ids):
+    """Sorts the spells of the given patients once.
+
+    Args:
+        spell_patient_ids: patient id of each spell
+        starts: day number of the first day of each spell; spells with a
+            missing (-1) start are dropped
+        ends: day number of the day each spell ends, on which it is no
+            longer active; -1 or None for open spells
+        patient_ids: sorted array of all patient ids
+
+    Returns:
+        `SpellIndex`
+    """
+    spell_patient_ids = np.asarray(spell_patient_ids)
+    starts = np.asarray(starts, dtype=np.int64)
+    if ends is None:
+        ends = np.full(len(starts), OPEN)
+    ends = np.where(np.asarray(ends) < 0, OPEN, ends).astype(np.int64)
+    patient_index = np.searchsorted(patient_ids, spell_patient_ids)
+    found = patient_index < len(patient_ids)
+    found[found] = patient_ids[patient_index[found]] == spell_patient_ids[found]
+    rows = np.flatnonzero(found & (starts >= 0))
+
+    order = np.lexsort((ends[rows], starts[rows], patient_index[rows]))
+    rows = rows[order]
+    patient_index = patient_index[rows]
+    starts = starts[rows]
+    offsets = np.searchsorted(patient_index, np.arange(len(patient_ids) + 1))
+
+    # Each patient's starts take up `span` consecutive keys
+    base = int(starts.min(initial=0))
+    span = int(starts.max(initial=0)) - base + 1
+    return SpellIndex(
+        patient_index.astype(np.int64) * span + (starts - base),
+        ends[rows],
+        rows,
+        offsets,
+        base,
+        span,
+    )
+
+
+def spells_as_of(index, days):
+    """Finds the spell active on each day for every patient.
+
+    Args:
+        index: `SpellIndex`
+        days: sorted day numbers to look up
+
+    Returns:
+        Array of shape (patients, days) of rows of the spell table, or -1
+        where no spell is active
+    """
+    days = np.asarray(days, dtype=np.int64)
+    n_patients = len(index.offsets) - 1
+    # Days after the last start fall in the last start's key, and days
+    # before the first start come before every key of the patient
+    offsets_in_span = np.clip(days - index.base, -1, index.span - 1)
+    queries = np.arange(n_patients, dtype=np.int64)[:, None] * index.span
+    position = np.searchsorted(
+        index.keys, queries + offsets_in_span, side="right"
+    ).ravel() - 1
+    patient = np.repeat(np.arange(n_patients), len(days))
+    day = np.tile(days, n_patients)
+
+    found = np.full(n_patients * len(days), -1, dtype=np.int64)
+    pending = np.flatnonzero(position >= index.offsets[patient])
+    position = position[pending]
+    while len(pending):
+        active = index.ends[position] > day[pending]
+        found[pending[active]] = index.rows[position[active]]
+        # Step back to an earlier spell that may still be active
+        position = position[~active] - 1
+        pending = pending[~active]
+        earlier = position >= index.offsets[patient[pending]]
+        position = position[earlier]
+        pending = pending[earlier]
+    return found.reshape(n_patients, len(days))
+
+
+def values_as_of(values, index, days, missing=None):
+    """Gets a value of the spell active on each day for every patient.
+
+    Args:
+        values: array with a value for each row of the spell table
+        index: `SpellIndex`
+        days: sorted day numbers to look up
+        missing: value where no spell is active
+
+    Returns:
+        Array of shape (patients, days)
+    """
+    rows = spells_as_of(index, days)
+    values = np.asarray(values)
+    taken = values[np.maximum(rows, 0)] if len(values) else np.empty(rows.shape)
+    return np.where(rows >= 0, taken, missing)
@@ -0,0 +1,224 @@
+"""
+Change-point store of the slowly changing patient attributes.
+
+The demographic attributes of a patient rarely change from one month to the
+next, but every monthly cohort repeats them in full.  Here each attribute is
+stored once per patient, as the value from the month the patient first
+appears, plus a change point for every month in which it changes.  Which
+patients are in each month's cohort is kept as a packed bitset.
+
+Any month's attributes are rebuilt on demand: the value of a patient in a
+month is their last change point on or before that month, found for every
+patient at once with a binary search.
+"""
+import argparse
+import pathlib
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from cohort_store import (
+    FORMATS,
+    get_cohort_columns,
+    list_index_dates,
+    read_cohort,
+)
+
+BASE_DIR = pathlib.Path(__file__).parents[1]
+OUTPUT_DIR = BASE_DIR / "output"
+
+STORE_NAME = "attributes_ast_reg.npz"
+
+ATTRIBUTES = [
+    "sex",
+    "ethnicity",
+    "region",
+    "imd",
+    "practice",
+    "learning_disability",
+    "care_home",
+]
+
+# Code of a missing value
+MISSING = -1
+# Last code of a patient who has not appeared yet
+UNSEEN = -2
+
+
+class Attribute(NamedTuple):
+    # Sorted patient index * months + month of each change point
+    keys: np.ndarray
+    codes: np.ndarray
+    categories: np.ndarray
+
+
+class AttributeStore(NamedTuple):
+    patient_ids: np.ndarray
+    dates: pd.DatetimeIndex
+    # Shape (months, ceil(patients / 8)); bit i of a month is patient i
+    present: np.ndarray
+    attributes: dict
+
+
+def _encode(values, lookup):
+    """Codes values against a lookup of value to code that grows with any
+    new values."""
+    codes, uniques = pd.factorize(values)
+    for value in uniques:
+        lookup.setdefault(value, len(lookup))
+    mapping = np.array([lookup[value] for value in uniques], dtype=np.int32)
+    return np.where(codes < 0, MISSING, mapping[codes] if len(mapping) else 0)
+
+
+def build_attribute_store(input_dir, input_format="csv", attributes=ATTRIBUTES):
+    """Builds an `AttributeStore` from the monthly cohorts.
+
+    The cohorts are read twice, once for the patient ids of every month and
+    once for the attributes, so that only one month is held in memory at a
+    time.
+    """
+    index_dates = list_index_dates(input_dir, input_format)
+    patient_ids = np.array([], dtype=np.int64)
+    for index_date in index_dates:
+        cohort = read_cohort(input_dir, index_date, input_format, ["patient_id"])
+        patient_ids = np.union1d(patient_ids, cohort.patient_id.values)
+
+    months = len(index_dates)
+    present = np.zeros((months, (len(patient_ids) + 7) // 8), dtype=np.uint8)
+    last = {}
+    lookups = {}
+    changes = {}
+    for month, index_date in enumerate(index_dates):
+        available = get_cohort_columns(input_dir, index_date, input_format)
+        columns = [column for column in attributes if column in available]
+        cohort = read_cohort(
+            input_dir, index_date, input_format, ["patient_id", *columns]
+        )
+        position = np.searchsorted(patient_ids, cohort.patient_id.values)
+        in_month = np.zeros(len(patient_ids), dtype=bool)
+        in_month[position] = True
+        present[month] = np.packbits(in_month)
+
+        for column in columns:
+            if column not in last:
+                last[column] = np.full(len(patient_ids), UNSEEN, dtype=np.int32)
+                lookups[column] = {}
+                changes[column] = ([], [])
+            codes = _encode(cohort[column].values, lookups[column])
+            changed = codes != last[column][position]
+            last[column][position[changed]] = codes[changed]
+            changes[column][0].append(position[changed] * months + month)
+            changes[column][1].append(codes[changed])
+
+    store = {}
+    for column, (keys, codes) in changes.items():
+        keys = np.concatenate(keys).astype(np.int64)
+        codes = np.concatenate(codes).astype(np.int32)
+        order = np.argsort(keys, kind="stable")
+        store[column] = Attribute(
+            keys[order], codes[order], np.asarray(list(lookups[column]))
+        )
+    return AttributeStore(patient_ids, index_dates, present, store)
+
+
+def get_month_view(store, index_date, columns=None):
+    """Rebuilds one month's patient attributes.
+
+    Args:
+        store: `AttributeStore`
+        index_date: index date of the month
+        columns: optional attributes to rebuild; defaults to all of them
+
+    Returns:
+        Dataframe of `patient_id` and one categorical column per attribute,
+        with a row for each patient in the month's cohort
+    """
+    month = store.dates.get_loc(pd.Timestamp(index_date))
+    patients = np.flatnonzero(
+        np.unpackbits(store.present[month], count=len(store.patient_ids))
+    )
+    view = pd.DataFrame({"patient_id": store.patient_ids[patients]})
+    months = len(store.dates)
+    for column in columns or store.attributes:
+        attribute = store.attributes[column]
+        position = np.searchsorted(
+            attribute.keys, patients * months + month, side="right"
+        )
+        # Every patient has a change point in the first month they appear
+        codes = attribute.codes[position - 1]
+        view[column] = pd.Categorical.from_codes(codes, attribute.categories)
+    return view
+
+
+def iter_month_views(store, columns=None):
+    """Rebuilds the patient attributes of every month, one at a time.
+
+    Yields:
+        Tuples of (index date, dataframe from `get_month_view`)
+    """
+    for index_date in store.dates:
+        yield index_date, get_month_view(store, index_date, columns)
+
+
+def write_attribute_store(store, path):
+    arrays = {
+        "patient_ids": store.patient_ids,
+        "dates": store.dates.values.astype("datetime64[D]"),
+        "present": store.present,
+    }
+    for column, attribute in store.attributes.items():
+        for field, values in attribute._asdict().items():
+            arrays[f"{column}.{field}"] = values
+    np.savez_compressed(path, **arrays)
+
+
+def read_attribute_store(path):
+    with np.load(path) as data:
+        columns = [
+            name.split(".")[0] for name in data.files if name.endswith(".keys")
+        ]
+        return AttributeStore(
+            data["patient_ids"],
+            pd.DatetimeIndex(data["dates"]),
+            data["present"],
+            {
+                column: Attribute(
+                    *(data[f"{column}.{field}"] for field in Attribute._fields)
+                )
+                for column in columns
+            },
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input-dir",
+        default=OUTPUT_DIR / "joined",
+        type=pathlib.Path,
+        help="Directory holding the joined monthly cohorts",
+    )
+    parser.add_argument(
+        "--input-format",
+        default="csv",
+        choices=FORMATS,
+        help="Format of the monthly cohort files",
+    )
+    parser.add_argument(
+        "--output",
+        default=OUTPUT_DIR / "joined" / STORE_NAME,
+        type=pathlib.Path,
+        help="Path to write the attribute store to",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    store = build_attribute_store(args.input_dir, args.input_format)
+    write_attribute_store(store, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Benchmarks for the Python actions in project.yaml.
+
+For each size, synthetic cohorts are generated with `synthetic_data` and the
+core functions of each action are run against them in order, each stage in
+a fresh process so that its peak RSS is its own.  Wall time, peak RSS and
+rows per second are appended to a JSON history, and the run fails if a stage
+is slower, or uses more memory, than the stored baseline by more than a
+threshold.
+
+    python analysis/benchmark.py --patients 10000 1000000 --practices 1000
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import pathlib
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+BASE_DIR = pathlib.Path(__file__).parents[1]
+LOGS_DIR = BASE_DIR / "logs"
+
+HISTORY_NAME = "benchmarks.json"
+
+# Differences in time below this are noise rather than regressions
+NOISE_FLOOR_SECONDS = 0.5
+
+
+def _measure_files(joined_dir, practice=False):
+    paths = sorted(joined_dir.glob("measure_ast_reg_*_rate.csv"))
+    return [path for path in paths if ("_practice_" in path.name) == practice]
+
+
+def stage_generate(workdir, patients, practices, months):
+    import synthetic_data
+    from register_engine import get_index_dates
+
+    index_dates = get_index_dates()[:months]
+    synthetic_data.generate_cohorts(
+        patients, index_dates, workdir, processes=1, practices=practices
+    )
+    synthetic_data.generate_ethnicity(patients, workdir)
+    return patients * months
+
+
+def stage_join_ethnicity(workdir, patients, practices, months):
+    from cohort_store import list_index_dates
+    from join_ethnicity import build_lookup, join_cohorts
+
+    index_dates = list_index_dates(workdir)
+    lookup = build_lookup(workdir / "input_ethnicity.csv")
+    join_cohorts(index_dates, lookup, workdir, workdir / "joined", processes=1)
+    return patients * months
+
+
+def stage_generate_measures(workdir, patients, practices, months):
+    from measure_registry import measures
+    from measures_engine import generate_measures, write_measures
+
+    measure_tables = generate_measures(measures, workdir / "joined")
+    write_measures(measure_tables, workdir / "joined")
+    return patients * months
+
+
+def stage_join_and_round(workdir, patients, practices, months):
+    from join_and_round import (
+        _join_tables,
+        _reshape_data,
+        _round_table,
+        get_measure_tables,
+        write_table,
+    )
+
+    tables = [
+        _round_table(_reshape_data(table), 10)
+        for table in get_measure_tables(_measure_files(workdir / "joined"))
+    ]
+    output = _join_tables(tables)
+    write_table(output, workdir / "joined" / "summary", "measure_register.csv")
+    return len(output)
+
+
+def stage_rate_calculations(workdir, patients, practices, months):
+    import rate_calculations
+
+    rate_calculations.main(workdir / "joined", workdir)
+    return sum(
+        len(path.read_text().splitlines()) - 1
+        for path in workdir.glob("rate_table_*.csv")
+    )
+
+
+def stage_group_charts(workdir, patients, practices, months):
+    from group_charts import render_group_chart
+
+    paths = _measure_files(workdir / "joined")
+    for path in paths:
+        render_group_chart(path, workdir, scale="percentage")
+    return len(paths)
+
+
+def stage_panel_plots(workdir, patients, practices, months):
+    import pandas as pd
+    from panel_plots import get_group_chart, write_group_chart
+
+    measure_table = pd.read_csv(
+        workdir / "joined" / "summary" / "measure_register.csv",
+        parse_dates=["date"],
+    )
+    chart = get_group_chart(measure_table, scale="percentage")
+    write_group_chart(chart, workdir / "panel.png", "Benchmark")
+    chart.close()
+    return len(measure_table)
+
+
+STAGES = {
+    "generate": stage_generate,
+    "join_ethnicity": stage_join_ethnicity,
+    "generate_measures": stage_generate_measures,
+    "join_and_round": stage_join_and_round,
+    "rate_calculations": stage_rate_calculations,
+    "group_charts": stage_group_charts,
+    "panel_plots": stage_panel_plots,
+}
+
+
+def _run_stage(name, *args):
+    start = time.perf_counter()
+    rows = STAGES[name](*args)
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux; stages such as rate_calculations
+    # render charts in worker processes of their own
+    peak_rss = max(
+        resource.getrusage(who).ru_maxrss
+        for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]
+    ) / 1024
+    return rows, seconds, peak_rss
+
+
+def run_stage(name, workdir, patients, practices, months):
+    """Runs one stage in a fresh process.
+
+    Returns:
+        Dictionary of the stage's measurements
+    """
+    # Pool workers are daemonic and cannot start the chart workers
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        rows, seconds, peak_rss = executor.submit(
+            _run_stage, name, workdir, patients, practices, months
+        ).result()
+    return {
+        "stage": name,
+        "patients": patients,
+        "practices": practices,
+        "months": months,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "peak_rss_mb": round(peak_rss, 1),
+        "rows_per_second": round(rows / seconds, 1) if seconds else None,
+    }
+
+
+def get_key(result):
+    return (
+        f"{result['stage']}/{result['patients']}/{result['practices']}"
+        f"/{result['months']}"
+    )
+
+
+def compare_results(results, baseline, threshold):
+    """Compares results with the baseline.
+
+    Returns:
+        List of messages describing each regression
+    """
+    regressions = []
+    for result in results:
+        base = baseline.get(get_key(result))
+        if base is None:
+            continue
+        if (
+            result["seconds"] > base["seconds"] * (1 + threshold)
+            and result["seconds"] - base["seconds"] > NOISE_FLOOR_SECONDS
+        ):
+            regressions.append(
+                f"{get_key(result)}: {result['seconds']:.2f}s"
+                f" (baseline {base['seconds']:.2f}s)"
+            )
+        if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + threshold):
+            regressions.append(
+                f"{get_key(result)}: {result['peak_rss_mb']:.0f}MB"
+                f" (baseline {base['peak_rss_mb']:.0f}MB)"
+            )
+    return regressions
+
+
+def read_history(path):
+    path = pathlib.Path(path)
+    if not path.exists():
+        return {"baseline": {}, "runs": []}
+    return json.loads(path.read_text())
+
+
+def write_history(history, path):
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(json.dumps(history, indent=2))
+    tmp_path.replace(path)
+
+
+def run_benchmarks(patient_counts, practice_counts, months, stages=None):
+    results = []
+    for patients in patient_counts:
+        for practices in practice_counts:
+            with tempfile.TemporaryDirectory() as workdir:
+                for name in stages or STAGES:
+                    result = run_stage(
+                        name, pathlib.Path(workdir), patients, practices, months
+                    )
+                    print(json.dumps(result))
+                    results.append(result)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--patients",
+        nargs="+",
+        default=[10_000, 1_000_000, 10_000_000],
+        type=int,
+        help="Numbers of patients to benchmark",
+    )
+    parser.add_argument(
+        "--practices",
+        nargs="+",
+        default=[1_000, 7_000],
+        type=int,
+        help="Numbers of practices to benchmark",
+    )
+    parser.add_argument(
+        "--months",
+        default=12,
+        type=int,
+        help="Number of monthly cohorts to generate",
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        help="Stages to run (default: all); later stages need earlier ones",
+    )
+    parser.add_argument(
+        "--history",
+        default=LOGS_DIR / HISTORY_NAME,
+        type=pathlib.Path,
+        help="Path to the JSON history",
+    )
+    parser.add_argument(
+        "--threshold",
+        default=0.2,
+        type=float,
+        help="Allowed slowdown or memory growth over the baseline (0.2 is 20%%)",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store this run's results as the baseline",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = run_benchmarks(args.patients, args.practices, args.months, args.stages)
+
+    history = read_history(args.history)
+    regressions = compare_results(results, history["baseline"], args.threshold)
+    history["runs"].append(
+        {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "results": results,
+        }
+    )
+    for result in results:
+        if args.update_baseline or get_key(result) not in history["baseline"]:
+            history["baseline"][get_key(result)] = result
+    write_history(history, args.history)
+
+    if regressions:
+        print("Regressions against the baseline:", *regressions, sep="\n  ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Content-addressed cache of rendered charts.
+
+A chart's key is a hash of the data it is drawn from, its rendering
+parameters and the charting code.  A chart whose key is in the cache is
+copied from the cache instead of being drawn again, so a refresh only redraws
+the charts whose data or parameters changed.  The cache is kept in a
+`.chart_cache` directory next to the charts.
+"""
+import functools
+import hashlib
+import json
+import pathlib
+import shutil
+
+import pandas as pd
+
+from instrument import log
+from utilities import hash_files
+
+ANALYSIS_DIR = pathlib.Path(__file__).parent
+CACHE_NAME = ".chart_cache"
+
+# Changes to these modules change how charts look
+CHART_FILES = [
+    ANALYSIS_DIR / name
+    for name in [
+        "chart_core.py",
+        "deciles.py",
+        "group_charts.py",
+        "panel_plots.py",
+        "utilities.py",
+    ]
+]
+
+
+@functools.lru_cache(maxsize=None)
+def _get_code_hash():
+    return hash_files(path for path in CHART_FILES if path.exists())
+
+
+def get_chart_key(data, params):
+    """Hashes a chart's data, parameters and the charting code.
+
+    Args:
+        data: dataframe the chart is drawn from
+        params: JSON-serialisable dictionary of rendering parameters
+    """
+    digest = hashlib.sha256()
+    digest.update(_get_code_hash().encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    schema = [list(map(str, data.columns)), list(map(str, data.dtypes))]
+    digest.update(json.dumps(schema).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def render_cached(path, data, params, render, cache_dir=None):
+    """Copies a chart from the cache, or draws it with `render` and adds it
+    to the cache.
+
+    Args:
+        path: path of the chart; without a suffix, `.png` is added, as
+            matplotlib does when saving it
+        data: dataframe the chart is drawn from
+        params: rendering parameters
+        render: function without arguments that draws the chart to `path`
+        cache_dir: cache directory; defaults to `.chart_cache` next to
+            the chart
+
+    Returns:
+        True if the chart was copied from the cache
+    """
+    path = pathlib.Path(path)
+    if not path.suffix:
+        path = path.with_suffix(".png")
+    cache_dir = pathlib.Path(cache_dir or path.parent / CACHE_NAME)
+    cached = cache_dir / f"{get_chart_key(data, params)}{path.suffix}"
+    if cached.exists():
+        shutil.copyfile(cached, path)
+        log("chart_cache", path=path, hit=True)
+        return True
+
+    render()
+    log("chart_cache", path=path, hit=False)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = cached.with_name(f".{cached.name}.tmp")
+    shutil.copyfile(path, tmp_path)
+    tmp_path.replace(cached)
+    return False
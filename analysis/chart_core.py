@@ -0,0 +1,140 @@
+"""
+Shared chart rendering core.
+
+Charts are drawn on explicit `Figure`/`Axes` objects rather than through
+pyplot.  A figure with its styling, tick formatters and date lines is a
+template, cached per process and keyed by those options.  Drawing a chart
+takes a cleared template, adds the data, saves it and then removes only the
+data artists, so charts drawn with the same options reuse one figure.
+"""
+import functools
+
+import pandas as pd
+from dateutil import parser
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.dates import DateFormatter
+from matplotlib.figure import Figure
+from matplotlib.ticker import FuncFormatter
+
+DATE_LINE_STYLE = {"color": "orange", "ls": "--"}
+
+# Scale name to (y axis formatter, y axis label)
+SCALES = {
+    "percentage": (FuncFormatter(lambda x, pos: f"{x*100: .0f}"), "Percentage"),
+    "rate": (FuncFormatter(lambda x, pos: f"{x*1000: .0f}"), "Rate per thousand"),
+    # Proportions shown as percentages without a label
+    "proportion": (FuncFormatter(lambda x, pos: "{:.1f}%".format(x * 100)), None),
+    # Values that are already percentages
+    "percent": (FuncFormatter(lambda x, pos: "{:.1f}%".format(x)), None),
+}
+
+_TEMPLATES = {}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_date_lines(date_lines):
+    """Parses a tuple of date strings, skipping any that are not dates."""
+    dates = []
+    for date in date_lines:
+        try:
+            dates.append(pd.to_datetime(date))
+        except (parser.ParserError, ValueError):
+            # TODO: add logger and print warning on exception
+            continue
+    return tuple(dates)
+
+
+class ChartTemplate:
+    """A styled figure that is reused between charts.
+
+    Args:
+        figsize: figure size in inches
+        nrows: number of rows of axes
+        ncols: number of columns of axes
+        date_lines: tuple of dates to draw as vertical lines on every axes
+        scale: optional key of `SCALES` for the y axis
+        date_format: optional strftime format for the x axis
+        fontsize: optional font size for titles, labels and ticks
+        xtick_rotation: rotation of the x tick labels
+    """
+
+    def __init__(
+        self,
+        figsize=None,
+        nrows=1,
+        ncols=1,
+        date_lines=(),
+        scale=None,
+        date_format=None,
+        fontsize=None,
+        xtick_rotation=0,
+    ):
+        self.figure = Figure(figsize=figsize)
+        FigureCanvasAgg(self.figure)
+        self._suptitle = None
+        self._overlays = set()
+
+        self.axes = [
+            self.figure.add_subplot(nrows, ncols, index + 1)
+            for index in range(nrows * ncols)
+        ]
+        for ax in self.axes:
+            for date in parse_date_lines(date_lines):
+                self._overlays.add(ax.axvline(x=date, **DATE_LINE_STYLE))
+            if scale is not None:
+                formatter, label = SCALES[scale]
+                ax.yaxis.set_major_formatter(formatter)
+                if label is not None:
+                    ax.set_ylabel(label)
+            if date_format is not None:
+                ax.xaxis.set_major_formatter(DateFormatter(date_format))
+            ax.tick_params(axis="x", labelrotation=xtick_rotation)
+            if fontsize is not None:
+                ax.tick_params(labelsize=fontsize)
+
+    def clear(self):
+        """Removes the data artists, keeping the styling and date lines."""
+        for ax in self.axes:
+            for artist in [*ax.lines, *ax.collections, *ax.patches, *ax.texts]:
+                if artist not in self._overlays:
+                    artist.remove()
+            legend = ax.get_legend()
+            if legend is not None:
+                legend.remove()
+            ax.set_title("")
+            ax.set_xlabel("")
+            ax.set_visible(True)
+            # Start each chart from the first colour
+            ax.set_prop_cycle(None)
+            ax.set_autoscale_on(True)
+            ax.relim()
+        if self._suptitle is not None:
+            self._suptitle.set_text("")
+        self.figure.subplots_adjust()
+
+    def suptitle(self, title):
+        self._suptitle = self.figure.suptitle(title)
+        return self._suptitle
+
+    def savefig(self, path, **kwargs):
+        self.figure.savefig(path, **kwargs)
+
+    def close(self):
+        """Clears the template so that it can draw the next chart."""
+        self.clear()
+
+
+def get_template(**options):
+    """Gets a cleared `ChartTemplate`, creating it the first time a set of
+    options is used.  Options are the arguments of `ChartTemplate`."""
+    if "date_lines" in options:
+        options["date_lines"] = tuple(options["date_lines"] or ())
+    if "figsize" in options and options["figsize"] is not None:
+        options["figsize"] = tuple(options["figsize"])
+    key = tuple(sorted(options.items()))
+    template = _TEMPLATES.get(key)
+    if template is None:
+        template = _TEMPLATES[key] = ChartTemplate(**options)
+    else:
+        template.clear()
+    return template
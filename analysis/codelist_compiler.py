@@ -0,0 +1,176 @@
+"""
+Compiled codelists for the local engines.
+
+Each codelist CSV is compiled once into a `.npz` artefact: its codes as a
+sorted `int64` array and, for codelists with a category column, the
+category code of each code and the categories.  Artefacts are named by a
+hash of the spec and the CSV's path, size and modification time, so an
+edited codelist is compiled again, and an unchanged one is loaded without
+reading its CSV.
+
+Membership of a whole column of event codes is then one binary search
+against the sorted codes, and so is mapping the column to categories.
+"""
+import argparse
+import functools
+import hashlib
+import os
+import pathlib
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from codelist_specs import CODELISTS
+
+BASE_DIR = pathlib.Path(__file__).parents[1]
+# Build artefacts, kept out of output/ so they are not mistaken for outputs
+CACHE_DIR = BASE_DIR / ".compiled_codelists"
+
+# Code of values that are not in a codelist, or have no category
+MISSING = -1
+
+
+class CompiledCodelist(NamedTuple):
+    codes: np.ndarray
+    # Category code of each code, and the categories; None without a
+    # category column
+    category_codes: np.ndarray
+    categories: np.ndarray
+
+
+def get_artefact_path(spec, cache_dir=None):
+    """Gets the path of a codelist's artefact, named by a hash of its spec
+    and the path, size and modification time of its CSV."""
+    stat = os.stat(BASE_DIR / spec.path)
+    digest = hashlib.sha256(repr(tuple(spec)).encode())
+    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    cache_dir = pathlib.Path(cache_dir or CACHE_DIR)
+    name = f"{pathlib.Path(spec.path).stem}-{digest.hexdigest()[:16]}.npz"
+    return cache_dir / name
+
+
+def to_codes(values):
+    """Converts codes, as integers or strings, to int64.  Values that are
+    not codes, such as missing values, become -1."""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.integer):
+        return values.astype(np.int64)
+    # Strings are parsed directly, as SNOMED CT and dm+d codes have up to 18
+    # digits and would lose precision as floats
+    values = pd.Series(values, dtype=object).astype(str).str.strip()
+    valid = values.str.fullmatch(r"\d{1,18}")
+    return values.where(valid, "-1").astype(np.int64).values
+
+
+def compile_codelist(spec):
+    """Compiles a codelist CSV.
+
+    Codes that appear more than once keep their first category.
+    """
+    columns = [spec.column]
+    if spec.category_column:
+        columns.append(spec.category_column)
+    table = pd.read_csv(BASE_DIR / spec.path, usecols=columns, dtype=str)
+    codes = to_codes(table[spec.column].values)
+    keep = codes >= 0
+    codes, first = np.unique(codes[keep], return_index=True)
+    if not spec.category_column:
+        return CompiledCodelist(codes, None, None)
+
+    category_codes, categories = pd.factorize(
+        table[spec.category_column].values[keep][first], sort=True
+    )
+    return CompiledCodelist(
+        codes, category_codes.astype(np.int32), np.asarray(categories, dtype=str)
+    )
+
+
+def write_compiled_codelist(codelist, path):
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    arrays = {"codes": codelist.codes}
+    if codelist.categories is not None:
+        arrays["category_codes"] = codelist.category_codes
+        arrays["categories"] = codelist.categories
+    # np.savez adds a .npz suffix to names without one
+    tmp_path = path.with_name(f".{path.stem}.tmp.npz")
+    np.savez(tmp_path, **arrays)
+    tmp_path.replace(path)
+
+
+def read_compiled_codelist(path):
+    with np.load(path) as data:
+        if "categories" in data:
+            return CompiledCodelist(
+                data["codes"], data["category_codes"], data["categories"]
+            )
+        return CompiledCodelist(data["codes"], None, None)
+
+
+@functools.lru_cache(maxsize=None)
+def load_codelist(name, cache_dir=None):
+    """Loads a compiled codelist, compiling it first if its CSV or spec has
+    changed.
+
+    Args:
+        name: name of the codelist in `codelist_specs.CODELISTS`
+        cache_dir: directory of the artefacts; defaults to `CACHE_DIR`
+
+    Returns:
+        `CompiledCodelist`
+    """
+    spec = CODELISTS[name]
+    path = get_artefact_path(spec, cache_dir)
+    if path.exists():
+        return read_compiled_codelist(path)
+    codelist = compile_codelist(spec)
+    write_compiled_codelist(codelist, path)
+    return codelist
+
+
+def _find(values, codelist):
+    values = to_codes(values)
+    if not len(codelist.codes):
+        return np.zeros(len(values), dtype=np.int64), np.zeros(len(values), bool)
+    position = np.searchsorted(codelist.codes, values)
+    position = np.minimum(position, len(codelist.codes) - 1)
+    return position, codelist.codes[position] == values
+
+
+def is_in(values, codelist):
+    """Vectorised membership of a column of codes in a compiled codelist."""
+    return _find(values, codelist)[1]
+
+
+def map_categories(values, codelist):
+    """Maps a column of codes to the categories of a compiled codelist.
+
+    Returns:
+        Categorical, missing where a code is not in the codelist
+    """
+    position, found = _find(values, codelist)
+    codes = np.where(found, codelist.category_codes[position], MISSING)
+    return pd.Categorical.from_codes(codes, codelist.categories)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--cache-dir",
+        default=CACHE_DIR,
+        type=pathlib.Path,
+        help="Directory to write the compiled codelists to",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for name in CODELISTS:
+        codelist = load_codelist(name, args.cache_dir)
+        print(f"{name}: {len(codelist.codes)} codes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+The codelists used by the study definitions.
+
+The cohortextractor codelists (`codelists_ast`, `codelists_demographic`) and
+the ehrQL codelists (`ehrQL_code/ehrql_codelists_*`) share these specs, and
+are each built by `get_codelist_loader` with their framework's
+`codelist_from_csv`.  The local engines read the same specs through
+`codelist_compiler`.
+
+The specs are kept as data in `codelist_specs.json`.  Paths are relative to
+the repository root, where both frameworks are run.  This module has no
+dependencies, so that any definition can import it.
+"""
+import inspect
+import json
+import pathlib
+from typing import NamedTuple
+
+SPECS_PATH = pathlib.Path(__file__).with_name("codelist_specs.json")
+
+
+class CodelistSpec(NamedTuple):
+    path: str
+    system: str = "snomed"
+    column: str = "code"
+    category_column: str = None
+
+
+CODELISTS = {
+    name: CodelistSpec(**spec)
+    for name, spec in json.loads(SPECS_PATH.read_text()).items()
+}
+
+
+def get_codelist_loader(codelist_from_csv):
+    """Gets a function that builds a codelist from its spec by name.
+
+    Args:
+        codelist_from_csv: the framework's `codelist_from_csv`.  ehrQL's has
+            no `system` argument, so the system is only passed if it is taken.
+
+    Returns:
+        Function of the name of a codelist in `CODELISTS` to the framework's
+        codelist
+    """
+    takes_system = "system" in inspect.signature(codelist_from_csv).parameters
+
+    def load(name):
+        spec = CODELISTS[name]
+        kwargs = {"column": spec.column, "category_column": spec.category_column}
+        if takes_system:
+            kwargs["system"] = spec.system
+        return codelist_from_csv(spec.path, **kwargs)
+
+    return load
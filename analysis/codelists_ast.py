@@ -1,5 +1,10 @@
 from cohortextractor import codelist_from_csv
 
+from codelist_specs import get_codelist_loader
+
+_codelist = get_codelist_loader(codelist_from_csv)
+
+
 ######################################
 ## ASTHMA
 ######################################
@@ -7,26 +12,14 @@ from cohortextractor import codelist_from_csv
 # Cluster name: AST_COD
 # Description: Asthma diagnosis codes
 # SNOMED CT: 
-ast_cod = codelist_from_csv(
-    "codelists/nhsd-primary-care-domain-refsets-ast_cod.csv",
-    system="snomed",
-    column="code",
-)
+ast_cod = _codelist("ast_cod")
 
 # Cluster name: ASTTRT_COD
 # Description: Asthma treatment codes
 # SNOMED CT:
-asttrt_cod = codelist_from_csv(
-    "codelists/opensafely-asthma-related-drug-treatment-codes.csv",
-    system="snomed",
-    column="code",
-)
+asttrt_cod = _codelist("asttrt_cod")
 
 # Cluster name: ASTRES_COD
 # Description: Asthma resolved codes
 # SNOMED CT:
-astres_cod = codelist_from_csv(
-    "codelists/nhsd-primary-care-domain-refsets-astres_cod.csv",
-    system="snomed",
-    column="code",
-)
+astres_cod = _codelist("astres_cod")
@@ -1,20 +1,12 @@
 from cohortextractor import codelist_from_csv
 
-ethnicity6_codes = codelist_from_csv(
-    "codelists/opensafely-ethnicity-snomed-0removed.csv",
-    system="snomed",
-    column="snomedcode",
-    category_column="Grouping_6",
-)
+from codelist_specs import get_codelist_loader
 
-learning_disability_codes = codelist_from_csv(
-    "codelists/nhsd-primary-care-domain-refsets-ld_cod.csv",
-    system="snomed",
-    column="code",
-)
+_codelist = get_codelist_loader(codelist_from_csv)
 
-nhse_care_homes_codes = codelist_from_csv(
-    "codelists/nhsd-primary-care-domain-refsets-carehome_cod.csv",
-    system="snomed",
-    column="code",
-)
+
+ethnicity6_codes = _codelist("ethnicity6_codes")
+
+learning_disability_codes = _codelist("learning_disability_codes")
+
+nhse_care_homes_codes = _codelist("nhse_care_homes_codes")
@@ -0,0 +1,317 @@
+"""
+Storage for the patient-level monthly cohort files.
+
+Cohorts are written either as the `input_ast_reg_YYYY-MM-DD.csv` files
+produced by cohortextractor, or in a columnar format (Parquet or Arrow IPC)
+partitioned by index date:
+
+    <directory>/input_ast_reg/index_date=YYYY-MM-DD/part-0.parquet
+
+Columnar files store the demographic columns with dictionary encoding and
+can be read back with column projection, and whole months can be skipped
+without opening their files.  The columnar formats need pyarrow.
+"""
+import pathlib
+
+import pandas as pd
+
+COHORT_NAME = "input_ast_reg"
+
+FORMATS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+CATEGORICAL_COLUMNS = ["age_band", "sex", "region", "imd", "ethnicity"]
+
+DATE_PATTERN = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]"
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(
+            "pyarrow is needed to read and write parquet or arrow cohorts"
+        )
+    return pyarrow
+
+
+def encode_categories(table):
+    return table.astype(
+        {
+            column: "category"
+            for column in CATEGORICAL_COLUMNS
+            if column in table.columns
+        }
+    )
+
+
+def get_cohort_path(
+    directory, index_date, output_format="csv", cohort_name=COHORT_NAME
+):
+    """Gets the path of the cohort file for an index date.
+
+    Args:
+        directory: directory holding the cohort files
+        index_date: index date of the cohort
+        output_format: one of `FORMATS`
+        cohort_name: name of the cohort, e.g. `input_ast_reg`
+
+    Returns:
+        Path to the cohort file
+    """
+    date = f"{pd.Timestamp(index_date):%Y-%m-%d}"
+    directory = pathlib.Path(directory)
+    if output_format == "csv":
+        return directory / f"{cohort_name}_{date}.csv"
+    return (
+        directory
+        / cohort_name
+        / f"index_date={date}"
+        / f"part-0{FORMATS[output_format]}"
+    )
+
+
+def list_index_dates(directory, output_format="csv", cohort_name=COHORT_NAME):
+    """Lists the index dates with a cohort file, without opening any files."""
+    directory = pathlib.Path(directory)
+    if output_format == "csv":
+        paths = directory.glob(f"{cohort_name}_{DATE_PATTERN}.csv")
+        dates = [path.stem[len(cohort_name) + 1:] for path in paths]
+    else:
+        suffix = FORMATS[output_format]
+        paths = (directory / cohort_name).glob(f"index_date=*/part-0{suffix}")
+        dates = [path.parent.name.split("=", 1)[1] for path in paths]
+    return pd.DatetimeIndex(sorted(dates))
+
+
+def list_cohort_names(directory, output_format="csv", prefix="input_"):
+    """Lists the names of the monthly cohorts in a directory, e.g.
+    `input_ast_reg`, without opening any files."""
+    directory = pathlib.Path(directory)
+    if output_format == "csv":
+        paths = directory.glob(f"{prefix}*_{DATE_PATTERN}.csv")
+        names = {path.stem.rsplit("_", 1)[0] for path in paths}
+    else:
+        suffix = FORMATS[output_format]
+        paths = directory.glob(f"{prefix}*/index_date=*/part-0{suffix}")
+        names = {path.parents[1].name for path in paths}
+    return sorted(names)
+
+
+def write_cohort(table, directory, index_date, output_format="csv"):
+    """Writes one month's patient-level cohort.
+
+    Args:
+        table: patient-level dataframe
+        directory: directory holding the cohort files
+        index_date: index date of the cohort
+        output_format: one of `FORMATS`
+
+    Returns:
+        Path to the written file
+    """
+    path = get_cohort_path(directory, index_date, output_format)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if output_format == "csv":
+        table.to_csv(path, index=False)
+        return path
+
+    pyarrow = import_pyarrow()
+    arrow_table = pyarrow.Table.from_pandas(
+        encode_categories(table), preserve_index=False
+    )
+    if output_format == "parquet":
+        pyarrow.parquet.write_table(arrow_table, path, compression="zstd")
+    else:
+        pyarrow.feather.write_feather(arrow_table, path, compression="zstd")
+    return path
+
+
+def read_cohort(directory, index_date, output_format="csv", columns=None):
+    """Reads one month's patient-level cohort.
+
+    Args:
+        directory: directory holding the cohort files
+        index_date: index date of the cohort
+        output_format: one of `FORMATS`
+        columns: optional list of columns to read
+
+    Returns:
+        Patient-level dataframe
+    """
+    path = get_cohort_path(directory, index_date, output_format)
+    if output_format == "csv":
+        return pd.read_csv(path, usecols=columns)
+
+    pyarrow = import_pyarrow()
+    if output_format == "parquet":
+        arrow_table = pyarrow.parquet.read_table(path, columns=columns)
+    else:
+        arrow_table = pyarrow.feather.read_table(path, columns=columns)
+    return arrow_table.to_pandas()
+
+
+def iter_cohort_chunks(
+    directory,
+    index_date,
+    output_format="csv",
+    chunksize=100_000,
+    columns=None,
+    dtype=None,
+    cohort_name=COHORT_NAME,
+):
+    """Reads one month's patient-level cohort in chunks of rows.
+
+    CSV and Parquet files are streamed, so memory depends on `chunksize`
+    rather than on the number of patients.  Arrow IPC files are
+    memory-mapped and read one record batch at a time.  `dtype` is only used
+    for CSV files; the columnar formats keep the types they were written
+    with.
+
+    Yields:
+        Patient-level dataframes
+    """
+    path = get_cohort_path(directory, index_date, output_format, cohort_name)
+    if output_format == "csv":
+        yield from pd.read_csv(
+            path, usecols=columns, dtype=dtype, chunksize=chunksize
+        )
+        return
+
+    pyarrow = import_pyarrow()
+    if output_format == "parquet":
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        for batch in parquet_file.iter_batches(
+            batch_size=chunksize, columns=columns
+        ):
+            yield batch.to_pandas()
+    else:
+        with pyarrow.memory_map(str(path)) as source:
+            reader = pyarrow.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                if columns is not None:
+                    batch = batch.select(columns)
+                yield batch.to_pandas()
+
+
+def _extend_categories(chunk, categories):
+    """Sets the categories of each categorical column of a chunk to those of
+    the earlier chunks, followed by any new ones."""
+    for column in chunk.columns:
+        if isinstance(chunk[column].dtype, pd.CategoricalDtype):
+            known = categories.setdefault(column, [])
+            seen = set(known)
+            known.extend(
+                value
+                for value in chunk[column].cat.categories
+                if value not in seen
+            )
+            chunk[column] = chunk[column].cat.set_categories(known)
+    return chunk
+
+
+def _get_chunk_schema(pyarrow, schema):
+    """Widens the dictionary indices of a schema to int32, so that later
+    chunks with more categories than the first still fit it."""
+    return pyarrow.schema(
+        [
+            field.with_type(pyarrow.dictionary(pyarrow.int32(), field.type.value_type))
+            if pyarrow.types.is_dictionary(field.type)
+            else field
+            for field in schema
+        ],
+        metadata=schema.metadata,
+    )
+
+
+def write_cohort_chunks(
+    chunks, directory, index_date, output_format="csv", cohort_name=COHORT_NAME
+):
+    """Writes one month's patient-level cohort from an iterable of chunks.
+
+    Every format is written one chunk at a time, under a temporary name that
+    is moved into place once complete, so memory depends on the size of the
+    chunks rather than on the number of patients.  Arrow IPC files cannot
+    replace a dictionary between record batches, so the categories of each
+    column only grow from chunk to chunk and each batch adds its new
+    categories as a dictionary delta.
+
+    Returns:
+        Path to the written file
+    """
+    path = get_cohort_path(directory, index_date, output_format, cohort_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+
+    if output_format == "csv":
+        header = True
+        with open(tmp_path, "w", newline="") as f:
+            for chunk in chunks:
+                chunk.to_csv(f, index=False, header=header)
+                header = False
+        tmp_path.replace(path)
+        return path
+
+    pyarrow = import_pyarrow()
+    writer = None
+    categories = {}
+    for chunk in chunks:
+        chunk = encode_categories(chunk)
+        if output_format == "arrow":
+            chunk = _extend_categories(chunk, categories)
+        arrow_table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            schema = _get_chunk_schema(pyarrow, arrow_table.schema)
+            if output_format == "parquet":
+                writer = pyarrow.parquet.ParquetWriter(
+                    tmp_path, schema, compression="zstd"
+                )
+            else:
+                options = pyarrow.ipc.IpcWriteOptions(
+                    compression="zstd", emit_dictionary_deltas=True
+                )
+                writer = pyarrow.ipc.new_file(str(tmp_path), schema, options=options)
+        # Columns that are empty in a chunk are inferred as null
+        writer.write_table(arrow_table.cast(schema))
+    if writer is None:
+        raise ValueError(f"No rows to write for {path}")
+    writer.close()
+
+    tmp_path.replace(path)
+    return path
+
+
+def get_cohort_columns(directory, index_date, output_format="csv"):
+    """Gets the column names of a cohort file without reading its rows."""
+    path = get_cohort_path(directory, index_date, output_format)
+    if output_format == "csv":
+        return list(pd.read_csv(path, nrows=0).columns)
+
+    pyarrow = import_pyarrow()
+    if output_format == "parquet":
+        return pyarrow.parquet.read_schema(path).names
+    return pyarrow.ipc.open_file(path).schema.names
+
+
+def iter_cohorts(directory, output_format="csv", columns=None, index_dates=None):
+    """Reads the monthly cohorts one month at a time.
+
+    Args:
+        directory: directory holding the cohort files
+        output_format: one of `FORMATS`
+        columns: optional list of columns to read
+        index_dates: optional index dates to read; other months are skipped
+
+    Yields:
+        Tuples of (index date, patient-level dataframe)
+    """
+    available = list_index_dates(directory, output_format)
+    if index_dates is not None:
+        available = available[available.isin(pd.DatetimeIndex(index_dates))]
+    for index_date in available:
+        yield index_date, read_cohort(
+            directory, index_date, output_format, columns
+        )
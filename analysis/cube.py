@@ -0,0 +1,197 @@
+"""
+Pre-aggregated demographic cube.
+
+Aggregates the numerator and denominator of the joined monthly cohorts by
+date and every demographic dimension at once.  Any breakdown, including
+cross-breakdowns such as age_band x sex, is then a rollup of the cube rather
+than another scan of the patient-level data.
+
+The cube holds unsuppressed counts at practice level, so it is as sensitive
+as the cohorts it was built from.  Use `measure_table` to get a breakdown
+with the same small number suppression as the measure files.
+"""
+import argparse
+import pathlib
+
+import pandas as pd
+
+from cohort_store import (
+    FORMATS,
+    encode_categories,
+    get_cohort_columns,
+    import_pyarrow,
+    list_index_dates,
+    read_cohort,
+)
+from instrument import instrumented
+from measures_engine import suppress_small_numbers
+
+BASE_DIR = pathlib.Path(__file__).parents[1]
+OUTPUT_DIR = BASE_DIR / "output"
+
+CUBE_NAME = "cube_ast_reg.parquet"
+
+DIMENSIONS = [
+    "practice",
+    "age_band",
+    "sex",
+    "imd",
+    "region",
+    "ethnicity",
+    "learning_disability",
+    "care_home",
+]
+
+
+def aggregate_cohort(cohort, index_date, numerator="asthma", denominator="population"):
+    """Aggregates one month's patient-level cohort into cube rows.
+
+    Args:
+        cohort: patient-level table for a single index date
+        index_date: index date of the cohort
+        numerator: numerator column
+        denominator: denominator column; `population` counts patients
+
+    Returns:
+        Cube rows with a `date` column, one column per dimension present in
+        the cohort, and the summed numerator and denominator
+    """
+    if denominator not in cohort.columns:
+        cohort = cohort.assign(**{denominator: 1})
+    dimensions = [column for column in DIMENSIONS if column in cohort.columns]
+    cube = (
+        cohort.groupby(dimensions, dropna=False, observed=True, sort=False)[
+            [numerator, denominator]
+        ]
+        .sum()
+        .reset_index()
+    )
+    cube.insert(0, "date", pd.Timestamp(index_date))
+    return cube
+
+
+@instrumented
+def build_cube(input_dir, input_format="csv", numerator="asthma", denominator="population"):
+    """Builds the cube from every joined monthly cohort.
+
+    Args:
+        input_dir: directory holding the joined monthly cohorts
+        input_format: one of `cohort_store.FORMATS`
+        numerator: numerator column
+        denominator: denominator column
+
+    Returns:
+        Cube dataframe
+    """
+    months = []
+    for index_date in list_index_dates(input_dir, input_format):
+        available = get_cohort_columns(input_dir, index_date, input_format)
+        columns = [
+            column
+            for column in [*DIMENSIONS, numerator, denominator]
+            if column in available
+        ]
+        cohort = read_cohort(input_dir, index_date, input_format, columns=columns)
+        months.append(aggregate_cohort(cohort, index_date, numerator, denominator))
+    cube = pd.concat(months, ignore_index=True)
+    return cube.astype({numerator: "int32", denominator: "int32"})
+
+
+def write_cube(cube, path):
+    """Writes the cube as Parquet with dictionary-encoded dimensions."""
+    pyarrow = import_pyarrow()
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    arrow_table = pyarrow.Table.from_pandas(
+        encode_categories(cube), preserve_index=False
+    )
+    pyarrow.parquet.write_table(arrow_table, path, compression="zstd")
+
+
+def read_cube(path, columns=None):
+    pyarrow = import_pyarrow()
+    return pyarrow.parquet.read_table(path, columns=columns).to_pandas()
+
+
+def rollup(cube, by, where=None, numerator="asthma", denominator="population"):
+    """Rolls the cube up to the given dimensions for every date.
+
+    Args:
+        cube: cube dataframe
+        by: list of dimensions to keep; an empty list gives the total
+        where: optional dictionary of dimension to a value or list of values
+            to slice the cube by before rolling up
+        numerator: numerator column
+        denominator: denominator column
+
+    Returns:
+        Dataframe with `date`, the `by` dimensions, numerator, denominator
+        and `value`, sorted by date and dimension
+    """
+    if where:
+        for dimension, values in where.items():
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            cube = cube[cube[dimension].isin(values)]
+    table = (
+        cube.groupby(["date", *by], dropna=False, observed=True)[
+            [numerator, denominator]
+        ]
+        .sum()
+        .reset_index()
+    )
+    table["value"] = table[numerator] / table[denominator]
+    return table
+
+
+def measure_table(cube, group_by, numerator="asthma", denominator="population"):
+    """Gets a breakdown from the cube in the format of the measure files,
+    with the same small number suppression.
+
+    Args:
+        cube: cube dataframe
+        group_by: `group_by` of the measure, e.g. ["sex"] or ["population"]
+        numerator: numerator column
+        denominator: denominator column
+
+    Returns:
+        Measure table
+    """
+    by = [column for column in group_by if column != denominator]
+    table = rollup(cube, by, numerator=numerator, denominator=denominator)
+    table = suppress_small_numbers(table, numerator, denominator, by=["date"])
+    table["value"] = table[numerator] / table[denominator]
+    return table[[*by, numerator, denominator, "value", "date"]]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input-dir",
+        default=OUTPUT_DIR / "joined",
+        type=pathlib.Path,
+        help="Directory holding the joined monthly cohorts",
+    )
+    parser.add_argument(
+        "--input-format",
+        default="csv",
+        choices=FORMATS,
+        help="Format of the monthly cohort files",
+    )
+    parser.add_argument(
+        "--output",
+        default=OUTPUT_DIR / "joined" / CUBE_NAME,
+        type=pathlib.Path,
+        help="Path to write the cube to",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cube = build_cube(args.input_dir, args.input_format)
+    write_cube(cube, args.output)
+
+
+if __name__ == "__main__":
+    main()
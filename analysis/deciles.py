@@ -0,0 +1,167 @@
+"""
+Practice-level decile tables and charts.
+
+Every percentile (the deciles plus the outer 1st and 99th percentiles) of
+every month is calculated in one `np.nanpercentile` call over a date x
+practice matrix.  The percentiles are written to a `deciles_table_<id>.csv`
+file, and the charts are drawn from those tables rather than from the
+practice-level measure table.
+
+The tables have the columns of those written by the deciles-charts action:
+`date`, `percentile` and `value`.
+"""
+import argparse
+import glob
+import pathlib
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+
+DECILES = [10, 20, 30, 40, 50, 60, 70, 80, 90]
+OUTER_PERCENTILES = [1, 99]
+PERCENTILES = sorted([*DECILES, *OUTER_PERCENTILES])
+
+MEASURE_FNAME_REGEX = re.compile(r"measure_(?P<id>\w+)\.csv")
+
+
+def get_deciles_table(
+    dates, matrix, percentiles=PERCENTILES, period_column="date", column="value"
+):
+    """Calculates the percentiles of each row of a date x practice matrix.
+
+    Returns:
+        Deciles table with one row per date and percentile
+    """
+    with warnings.catch_warnings():
+        # Months where every practice is missing have missing percentiles
+        warnings.simplefilter("ignore", RuntimeWarning)
+        values = np.nanpercentile(matrix, percentiles, axis=1)
+    return pd.DataFrame(
+        {
+            period_column: np.tile(np.asarray(dates), len(percentiles)),
+            "percentile": np.repeat(percentiles, len(dates)),
+            column: values.ravel(),
+        }
+    )
+
+
+def write_deciles_table(deciles_table, path):
+    deciles_table.to_csv(path, index=False)
+
+
+def get_deciles_chart(
+    deciles_table,
+    period_column="date",
+    column="value",
+    show_outer_percentiles=False,
+    date_lines=None,
+    scale=None,
+    figsize=None,
+):
+    """Draws a deciles chart from a deciles table."""
+    from chart_core import get_template
+
+    chart = get_template(figsize=figsize, date_lines=date_lines, scale=scale)
+    ax = chart.axes[0]
+    percentiles = [*DECILES, *(OUTER_PERCENTILES if show_outer_percentiles else [])]
+    labelled = set()
+    for percentile, table in deciles_table.groupby("percentile"):
+        if percentile not in percentiles:
+            continue
+        if percentile == 50:
+            style = dict(linestyle="-", linewidth=1.5, label="median")
+        elif percentile in DECILES:
+            style = dict(linestyle="--", linewidth=0.8, label="decile")
+        else:
+            style = dict(linestyle=":", linewidth=0.6, label="1st-99th percentile")
+        # Only label the first line of each kind
+        if style["label"] in labelled:
+            style["label"] = "_nolegend_"
+        labelled.add(style["label"])
+        ax.plot(table[period_column], table[column], color="blue", **style)
+    ax.legend(loc="upper right")
+    ax.set_ylim(bottom=0)
+    chart.figure.autofmt_xdate()
+    chart.figure.tight_layout()
+    return chart
+
+
+def write_deciles_chart(deciles_table, path, **kwargs):
+    """Draws a deciles chart from a deciles table and writes it, unless it
+    is in the chart cache."""
+    from chart_cache import render_cached
+    from render_pool import save_figure
+
+    def render():
+        chart = get_deciles_chart(deciles_table, **kwargs)
+        save_figure(chart, path, bbox_inches="tight")
+        chart.close()
+
+    render_cached(path, deciles_table, kwargs, render)
+
+
+def get_path(*args):
+    return pathlib.Path(*args).resolve()
+
+
+def match_paths(pattern):
+    return [get_path(x) for x in glob.glob(pattern)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input-files",
+        required=True,
+        type=match_paths,
+        help="Glob pattern for matching one or more practice measure files",
+    )
+    parser.add_argument(
+        "--output-dir",
+        required=True,
+        type=pathlib.Path,
+        help="Path to the output directory",
+    )
+    parser.add_argument(
+        "--show-outer-percentiles",
+        action="store_true",
+        help="Show the 1st and 99th percentiles on the charts",
+    )
+    parser.add_argument(
+        "--date-lines",
+        nargs="+",
+        help="Vertical date lines",
+    )
+    choices = ["percentage", "rate"]
+    parser.add_argument("--scale", default=None, choices=choices)
+    return parser.parse_args()
+
+
+def main():
+    import practice_matrix
+
+    args = parse_args()
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    for input_file in args.input_files:
+        match = re.match(MEASURE_FNAME_REGEX, input_file.name)
+        if match is None:
+            continue
+        measure_table = pd.read_csv(input_file, parse_dates=["date"])
+        matrix = practice_matrix.from_measure_table(measure_table)
+        deciles_table = practice_matrix.get_deciles(matrix)
+        write_deciles_table(
+            deciles_table, args.output_dir / f"deciles_table_{match['id']}.csv"
+        )
+        write_deciles_chart(
+            deciles_table,
+            args.output_dir / f"deciles_chart_{match['id']}.png",
+            show_outer_percentiles=args.show_outer_percentiles,
+            date_lines=args.date_lines,
+            scale=args.scale,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,15 @@
+import sys
+
 from ehrql.codes import codelist_from_csv
 
+# The codelist specs are shared with the cohortextractor definitions.  ehrQL
+# only makes this directory importable, and is run from the repository root
+sys.path.append("analysis")
+from codelist_specs import get_codelist_loader  # noqa: E402
+
+_codelist = get_codelist_loader(codelist_from_csv)
+
+
 ######################################
 ## ASTHMA
 ######################################
@@ -7,14 +17,14 @@ from ehrql.codes import codelist_from_csv
 # Cluster name: AST_COD
 # Description: Asthma diagnosis codes
 # SNOMED CT: 
-ast_cod = codelist_from_csv("codelists/nhsd-primary-care-domain-refsets-ast_cod.csv", column="code")
+ast_cod = _codelist("ast_cod")
 
 # Cluster name: ASTTRT_COD
 # Description: Asthma treatment codes
 # SNOMED CT:
-asttrt_cod = codelist_from_csv("codelists/opensafely-asthma-related-drug-treatment-codes.csv",column="code",)
+asttrt_cod = _codelist("asttrt_cod")
 
 # Cluster name: ASTRES_COD
 # Description: Asthma resolved codes
 # SNOMED CT:
-astres_cod = codelist_from_csv("codelists/nhsd-primary-care-domain-refsets-astres_cod.csv",column="code",)
+astres_cod = _codelist("astres_cod")
@@ -1,14 +1,19 @@
+import sys
+
 from ehrql.codes import codelist_from_csv
 
+# The codelist specs are shared with the cohortextractor definitions.  ehrQL
+# only makes this directory importable, and is run from the repository root
+sys.path.append("analysis")
+from codelist_specs import get_codelist_loader  # noqa: E402
+
+_codelist = get_codelist_loader(codelist_from_csv)
+
+
 # ethnicity
-ethnicity_codes_6 = codelist_from_csv("codelists/opensafely-ethnicity-snomed-0removed.csv",
-                                      column="snomedcode",
-                                      category_column="Grouping_6",
-                                      )
+ethnicity_codes_6 = _codelist("ethnicity6_codes")
 
 # learning disability
-learning_disability_codes = codelist_from_csv(
-    "codelists/nhsd-primary-care-domain-refsets-ld_cod.csv", column="code",)
+learning_disability_codes = _codelist("learning_disability_codes")
 # care home
-nhse_care_homes_codes = codelist_from_csv(
-    "codelists/nhsd-primary-care-domain-refsets-carehome_cod.csv", column="code",)
+nhse_care_homes_codes = _codelist("nhse_care_homes_codes")
@@ -5,9 +5,10 @@ import glob
 
 import pandas
 
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
-from dateutil import parser
+from chart_cache import render_cached
+from chart_core import get_template
+from instrument import instrumented
+from render_pool import render_charts, save_figure
 
 MEASURE_FNAME_REGEX = re.compile(r"measure_ast_reg_(?P<id>\w+)\.csv")
 
@@ -45,59 +46,48 @@ def drop_zero_denominator_rows(measure_table):
     return measure_table[mask].reset_index(drop=True)
 
 
-def scale_thousand(ax):
-    """
-    Scale a proportion for rate by 1000
-    Used for y axis display
-    """
-    def thousand_formatter(x, pos):
-        return f"{x*1000: .0f}"
-
-    ax.yaxis.set_major_formatter(FuncFormatter(thousand_formatter))
-    ax.set_ylabel("Rate per thousand")
-
-
-def scale_hundred(ax):
-    """
-    Scale a proportion for percentage
-    Used for y axis display
-    """
-    def hundred_formatter(x, pos):
-        return f"{x*100: .0f}"
-
-    ax.yaxis.set_major_formatter(FuncFormatter(hundred_formatter))
-    ax.set_ylabel("Percentage")
-
-
+@instrumented
 def get_group_chart(measure_table, date_lines=None, scale=None):
     # TODO: do not hard code date and value
-    plt.figure()
-    fig, ax = plt.subplots()
+    chart = get_template(date_lines=date_lines, scale=scale)
+    ax = chart.axes[0]
     measure_table.set_index("date", inplace=True)
-    if (
-        len(measure_table.attrs["group_by"]) == 0
-        or "total" in measure_table.attrs["id"]
-    ):
-        measure_table.value.plot(legend=None, ax=ax)
+    group_by = measure_table.attrs["group_by"]
+    if len(group_by) == 0 or "total" in measure_table.attrs["id"]:
+        ax.plot(measure_table.index, measure_table.value)
     else:
-        measure_table.groupby(measure_table.attrs["group_by"]).value.plot(
-            legend=False, ax=ax
-        )
-        plt.legend(
+        if len(group_by) == 1:
+            group_by = group_by[0]
+        for group, group_table in measure_table.groupby(group_by):
+            ax.plot(group_table.index, group_table.value, label=group)
+        ax.legend(
             bbox_to_anchor=(1.05, 1.0), loc="upper left", fontsize="small"
         )
-    if date_lines:
-        add_date_lines(plt, date_lines)
-    if scale == "percentage":
-        scale_hundred(ax)
-    elif scale == "rate":
-        scale_thousand(ax)
-    plt.tight_layout()
-    return plt
+    ax.set_xlabel("date")
+    chart.figure.tight_layout()
+    return chart
 
 
 def write_group_chart(group_chart, path):
-    group_chart.savefig(path)
+    save_figure(group_chart, path)
+
+
+def render_group_chart(input_file, output_dir, date_lines=None, scale=None):
+    """Draws and writes the group chart for one measure file."""
+    for measure_table in get_measure_tables([input_file]):
+        measure_table = drop_zero_denominator_rows(measure_table)
+        id_ = measure_table.attrs["id"]
+        path = output_dir / f"group_chart_{id_}.png"
+
+        def render():
+            chart = get_group_chart(
+                measure_table, date_lines=date_lines, scale=scale
+            )
+            write_group_chart(chart, path)
+            chart.close()
+
+        params = dict(id=id_, date_lines=date_lines, scale=scale)
+        render_cached(path, measure_table, params, render)
 
 
 def get_path(*args):
@@ -108,17 +98,6 @@ def match_paths(pattern):
     return [get_path(x) for x in glob.glob(pattern)]
 
 
-def add_date_lines(plt, vlines):
-    # TODO: Check that it is within the range?
-    for date in vlines:
-        try:
-            plt.axvline(x=pandas.to_datetime(date), color="orange", ls="--")
-        except parser._parser.ParserError:
-            # TODO: add logger and print warning on exception
-            # Skip any dates not in the correct format
-            continue
-
-
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -140,6 +119,12 @@ def parse_args():
     )
     choices = ["percentage", "rate"]
     parser.add_argument("--scale", default=None, choices=choices)
+    parser.add_argument(
+        "--processes",
+        default=None,
+        type=int,
+        help="Number of charts to draw at once (default: number of cores)",
+    )
     return parser.parse_args()
 
 
@@ -149,16 +134,22 @@ def main():
     output_dir = args.output_dir
     date_lines = args.date_lines
     scale = args.scale
-
-    for measure_table in get_measure_tables(input_files):
-        measure_table = drop_zero_denominator_rows(measure_table)
-        chart = get_group_chart(
-            measure_table, date_lines=date_lines, scale=scale
+    processes = args.processes
+
+    jobs = [
+        (
+            render_group_chart,
+            dict(
+                input_file=input_file,
+                output_dir=output_dir,
+                date_lines=date_lines,
+                scale=scale,
+            ),
         )
-        id_ = measure_table.attrs["id"]
-        fname = f"group_chart_{id_}.png"
-        write_group_chart(chart, output_dir / fname)
-        chart.close()
+        for input_file in input_files
+        if re.match(MEASURE_FNAME_REGEX, input_file.name)
+    ]
+    render_charts(jobs, processes=processes)
 
 
 if __name__ == "__main__":
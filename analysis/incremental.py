@@ -0,0 +1,243 @@
+"""
+Incremental monthly extraction.
+
+Keeps a manifest of the monthly cohort files in the output directory, keyed
+by a hash of the study definition and a hash of the codelists.  Only index
+dates without a valid output are extracted, and only those months are joined
+with ethnicity and appended to the measure files.
+
+If either hash changes, every month is treated as missing and recomputed.
+"""
+import argparse
+import json
+import os
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from cohort_store import FORMATS, get_cohort_columns, get_cohort_path
+from config import start_date, end_date
+from instrument import log
+from join_ethnicity import build_lookup, join_cohorts
+from measure_registry import measures
+from measures_engine import generate_measures
+from register_engine import (
+    build_register,
+    get_index_dates,
+    load_tables,
+    write_monthly_tables,
+)
+from utilities import hash_files
+
+BASE_DIR = pathlib.Path(__file__).parents[1]
+OUTPUT_DIR = BASE_DIR / "output"
+
+MANIFEST_NAME = "manifest_ast_reg.json"
+
+STUDY_DEFINITION_FILES = [
+    BASE_DIR / "analysis" / name
+    for name in [
+        "study_definition_ast_reg.py",
+        "dict_ast_variables.py",
+        "dict_demographic_variables.py",
+        "codelists_ast.py",
+        "codelists_demographic.py",
+        "codelist_specs.py",
+        "codelist_specs.json",
+        "config.py",
+        "register_engine.py",
+        "measure_registry.py",
+    ]
+]
+CODELIST_DIR = BASE_DIR / "codelists"
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def get_definition_hashes(output_format="csv"):
+    """Gets the current study definition and codelist hashes.  Changing the
+    output format also invalidates every month."""
+    return {
+        "study_definition_hash": hash_files(STUDY_DEFINITION_FILES),
+        "codelist_hash": hash_files(CODELIST_DIR.glob("*.csv")),
+        "output_format": output_format,
+    }
+
+
+def read_manifest(output_dir, hashes):
+    """Reads the manifest, discarding it if it was written for a different
+    study definition or codelists.
+
+    Args:
+        output_dir: directory holding the monthly cohort files
+        hashes: current hashes from `get_definition_hashes`
+
+    Returns:
+        Manifest dictionary
+    """
+    path = pathlib.Path(output_dir) / MANIFEST_NAME
+    if path.exists():
+        manifest = json.loads(path.read_text())
+        if all(manifest.get(key) == value for key, value in hashes.items()):
+            return manifest
+    return {**hashes, "index_dates": {}}
+
+
+def write_manifest(manifest, output_dir):
+    path = pathlib.Path(output_dir) / MANIFEST_NAME
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(tmp_path, path)
+
+
+def record_outputs(manifest, index_dates, output_dir):
+    """Records the monthly cohort files for the given index dates."""
+    for index_date in index_dates:
+        path = get_cohort_path(
+            output_dir, index_date, manifest["output_format"]
+        )
+        manifest["index_dates"][f"{pd.Timestamp(index_date):%Y-%m-%d}"] = {
+            "file": str(path.relative_to(output_dir)),
+            **_file_signature(path),
+        }
+    return manifest
+
+
+def get_missing_index_dates(manifest, index_dates, output_dir):
+    """Gets the index dates without a valid monthly cohort file.
+
+    A month is valid if it is in the manifest and its file still exists with
+    the size and modification time that were recorded.
+
+    Args:
+        manifest: manifest from `read_manifest`
+        index_dates: all index dates in the study period
+        output_dir: directory holding the monthly cohort files
+
+    Returns:
+        DatetimeIndex of index dates that need to be extracted
+    """
+    missing = []
+    for index_date in pd.DatetimeIndex(index_dates):
+        entry = manifest["index_dates"].get(f"{index_date:%Y-%m-%d}")
+        path = get_cohort_path(
+            output_dir, index_date, manifest["output_format"]
+        )
+        if (
+            entry is None
+            or not path.exists()
+            or _file_signature(path) != {
+                "size": entry["size"],
+                "mtime_ns": entry["mtime_ns"],
+            }
+        ):
+            missing.append(index_date)
+    return pd.DatetimeIndex(missing)
+
+
+def append_measures(measures, index_dates, joined_dir, output_format="csv"):
+    """Appends the given months to every measure file, replacing any rows
+    already present for those months."""
+    joined_dir = pathlib.Path(joined_dir)
+    index_dates = pd.DatetimeIndex(index_dates)
+    cohort_columns = get_cohort_columns(joined_dir, index_dates[0], output_format)
+    available = []
+    for measure in measures:
+        missing = set([measure.numerator, *measure.group_by]) - set(
+            cohort_columns
+        ) - {"population"}
+        if missing:
+            log("measure_skipped", measure=measure.id, missing=sorted(missing))
+        else:
+            available.append(measure)
+
+    new_tables = generate_measures(
+        available, joined_dir, output_format, index_dates
+    )
+    for measure_id, table in new_tables.items():
+        path = joined_dir / f"measure_{measure_id}.csv"
+        if path.exists():
+            existing = pd.read_csv(path, parse_dates=["date"])
+            table = pd.concat([existing[~existing.date.isin(index_dates)], table])
+        table = table.sort_values("date", kind="stable")
+        table.to_csv(path, index=False)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input-dir",
+        default=BASE_DIR / "example-data",
+        type=pathlib.Path,
+        help="Directory holding the raw event tables",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=OUTPUT_DIR,
+        type=pathlib.Path,
+        help="Directory holding the monthly cohort files",
+    )
+    parser.add_argument(
+        "--joined-dir",
+        default=OUTPUT_DIR / "joined",
+        type=pathlib.Path,
+        help="Directory holding the joined cohort and measure files",
+    )
+    parser.add_argument(
+        "--ethnicity",
+        required=True,
+        type=pathlib.Path,
+        help="Ethnicity cohort to join onto each month",
+    )
+    parser.add_argument("--start-date", default=start_date)
+    parser.add_argument("--end-date", default=end_date)
+    parser.add_argument("--output-format", default="csv", choices=FORMATS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    output_dir = args.output_dir
+    joined_dir = args.joined_dir
+    output_format = args.output_format
+    if not args.ethnicity.exists():
+        raise FileNotFoundError(f"No ethnicity cohort at {args.ethnicity}")
+
+    index_dates = get_index_dates(args.start_date, args.end_date)
+    manifest = read_manifest(output_dir, get_definition_hashes(output_format))
+    missing = get_missing_index_dates(manifest, index_dates, output_dir)
+    print(f"{len(missing)} of {len(index_dates)} months need extracting")
+
+    if len(missing):
+        register = build_register(load_tables(args.input_dir), missing)
+        write_monthly_tables(register, output_dir, output_format)
+
+    # Months computed now, or computed earlier but never joined
+    to_join = pd.DatetimeIndex(
+        [
+            index_date
+            for index_date in index_dates
+            if index_date in missing
+            or not get_cohort_path(
+                joined_dir, index_date, output_format
+            ).exists()
+        ]
+    )
+    if len(to_join):
+        lookup = build_lookup(args.ethnicity)
+        join_cohorts(to_join, lookup, output_dir, joined_dir, output_format)
+        append_measures(measures, to_join, joined_dir, output_format)
+
+    # Only record the new months once they have been joined, so that a failed
+    # join is retried from extraction on the next run
+    if len(missing):
+        record_outputs(manifest, missing, output_dir)
+        write_manifest(manifest, output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Timing and memory instrumentation.
+
+`instrumented` wraps a function, and `stage` a block of code, so that each
+call appends a JSON line to `logs/<action>.jsonl` with its duration, the
+number of rows in and out, and memory.  The action is the name of the script
+being run, e.g. `join_and_round`.
+
+The kernel only reports the peak memory of the whole process so far, so each
+record has both that peak, `process_peak_rss_mb`, and how much the call
+raised it, `peak_rss_increase_mb`.  A call that needs less memory than an
+earlier one has raised it by 0.
+
+Each python action in `project.yaml` declares its log as a moderately
+sensitive output, so the logs are kept with the action's other outputs.  The
+logs hold timings, row counts of tables and paths, not patient data.
+
+Set the `INSTRUMENT` environment variable to `0` to turn logging off, for
+example when running a script outside the project pipeline.
+"""
+import contextlib
+import datetime
+import functools
+import inspect
+import json
+import os
+import pathlib
+import resource
+import sys
+import time
+
+BASE_DIR = pathlib.Path(__file__).parents[1]
+LOGS_DIR = BASE_DIR / "logs"
+
+
+def get_action():
+    return pathlib.Path(sys.argv[0]).stem or "interactive"
+
+
+def is_enabled():
+    return os.environ.get("INSTRUMENT", "1") != "0"
+
+
+def _count_rows(value):
+    # Dataframes and arrays have a shape; anything else has no row count
+    shape = getattr(value, "shape", None)
+    return shape[0] if shape else None
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def log(event, **fields):
+    """Appends a record to the action's log."""
+    if not is_enabled():
+        return
+    record = {
+        "time": datetime.datetime.now().isoformat(timespec="milliseconds"),
+        "action": get_action(),
+        "pid": os.getpid(),
+        "event": event,
+        **fields,
+    }
+    LOGS_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOGS_DIR / f"{get_action()}.jsonl", "a") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+
+def _log_stage(name, seconds, rows_in, rows_out, start_peak_rss_mb):
+    peak_rss_mb = _peak_rss_mb()
+    log(
+        "stage",
+        stage=name,
+        seconds=round(seconds, 6),
+        rows_in=rows_in,
+        rows_out=rows_out,
+        process_peak_rss_mb=peak_rss_mb,
+        peak_rss_increase_mb=round(peak_rss_mb - start_peak_rss_mb, 1),
+    )
+
+
+@contextlib.contextmanager
+def stage(name, rows_in=None):
+    """Logs the duration of a block of code.
+
+    The block can set `rows_out` on the yielded dictionary.
+    """
+    fields = {"rows_out": None}
+    start_peak_rss_mb = _peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        _log_stage(
+            name,
+            time.perf_counter() - start,
+            rows_in,
+            fields["rows_out"],
+            start_peak_rss_mb,
+        )
+
+
+def instrumented(function):
+    """Logs every call of a function.  `rows_in` is the row count of the
+    first argument and `rows_out` that of the return value.  For generators
+    the time is spent producing items, not consuming them, and `rows_out`
+    is the total over everything yielded."""
+    module = function.__module__
+    if module == "__main__":
+        module = get_action()
+    name = f"{module}.{function.__qualname__}"
+
+    if inspect.isgeneratorfunction(function):
+
+        @functools.wraps(function)
+        def generator_wrapper(*args, **kwargs):
+            rows_in = _count_rows(args[0]) if args else None
+            rows_out = 0
+            seconds = 0.0
+            start_peak_rss_mb = _peak_rss_mb()
+            items = function(*args, **kwargs)
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        return
+                    finally:
+                        seconds += time.perf_counter() - start
+                    rows_out += _count_rows(item) or 0
+                    yield item
+            finally:
+                _log_stage(name, seconds, rows_in, rows_out, start_peak_rss_mb)
+
+        return generator_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with stage(name, _count_rows(args[0]) if args else None) as fields:
+            result = function(*args, **kwargs)
+            fields["rows_out"] = _count_rows(result)
+            return result
+
+    return wrapper
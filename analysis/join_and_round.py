@@ -3,8 +3,13 @@ import pathlib
 import re
 import glob
 
+import numpy
 import pandas
 
+from cube import DIMENSIONS, read_cube
+from cube import measure_table as cube_measure_table
+from instrument import instrumented, log
+
 MEASURE_FNAME_REGEX = re.compile(r"measure_ast_reg_(?P<id>\S+)\.csv")
 
 
@@ -15,6 +20,7 @@ def _check_for_practice(table):
         )
 
 
+@instrumented
 def _reshape_data(measure_table):
     try:
         assert len(measure_table.columns) < 6
@@ -58,10 +64,15 @@ def _join_tables(tables):
     return pandas.concat(tables)
 
 
+@instrumented
 def get_measure_tables(input_files):
     for input_file in input_files:
         measure_fname_match = re.match(MEASURE_FNAME_REGEX, input_file.name)
-        print(input_file, measure_fname_match)
+        log(
+            "measure_file",
+            path=input_file,
+            matched=measure_fname_match is not None,
+        )
         if measure_fname_match is not None:
             # The `date` column is assigned by the measures framework.
             measure_table = pandas.read_csv(input_file, parse_dates=["date"])
@@ -72,18 +83,57 @@ def get_measure_tables(input_files):
             yield measure_table
 
 
-def _round_table(measure_table, round_to):
-    def custom_round(x, base):
-        return int(base * round(float(x) / base))
+def get_cube_measure_tables(cube_path, breakdowns):
+    """Gets measure tables from the cube instead of the measure files.
+
+    Each breakdown is a comma-separated list of cube dimensions, e.g.
+    "age_band" or "age_band,sex", or "population" for the total.  The groups
+    of a cross-breakdown are joined into a single group column.
+    """
+    cube = read_cube(cube_path)
+    for breakdown in breakdowns:
+        by = [d for d in breakdown.split(",") if d != "population"]
+        table = cube_measure_table(cube, by or ["population"])
+        if len(by) > 1:
+            group = table[by].astype(str).agg(" / ".join, axis=1)
+            table = table.drop(columns=by)
+            table.insert(0, "_".join(by), group)
+        table.attrs["id"] = f"{'_'.join(by) or 'total'}_rate"
+        yield table
+
+
+def round_to_nearest(values, base):
+    """Rounds to the nearest multiple of base, with halves rounded to even
+    as Python's `round` does.  Missing values stay missing."""
+    return base * numpy.round(values / base)
+
+
+def round_to_midpoint(values, base):
+    """Midpoint rounding, e.g. with base 6 counts of 1-6 become 3, 7-12
+    become 9 and 0 stays 0.  Missing values stay missing."""
+    return numpy.ceil(values / base) * base - numpy.floor(base / 2) * (values != 0)
+
+
+ROUNDING_METHODS = {"nearest": round_to_nearest, "midpoint": round_to_midpoint}
+
+
+def _round_column(column, round_to, method):
+    rounded = ROUNDING_METHODS[method](column.to_numpy(dtype=float), round_to)
+    if numpy.isnan(rounded).any():
+        return rounded
+    return rounded.astype(numpy.int64)
 
-    measure_table.numerator = measure_table.numerator.apply(
-        lambda x: custom_round(x, round_to) if pandas.notnull(x) else x
+
+@instrumented
+def _round_table(measure_table, round_to, method="nearest"):
+    measure_table["numerator"] = _round_column(
+        measure_table.numerator, round_to, method
     )
-    measure_table.denominator = measure_table.denominator.apply(
-        lambda x: custom_round(x, round_to) if pandas.notnull(x) else x
+    measure_table["denominator"] = _round_column(
+        measure_table.denominator, round_to, method
     )
     # recompute value
-    measure_table.value = measure_table.numerator / measure_table.denominator
+    measure_table["value"] = measure_table.numerator / measure_table.denominator
     return measure_table
 
 
@@ -126,6 +176,22 @@ def parse_args():
         action="append",
         help="Manually provide a list of one or more input files",
     )
+    input_group.add_argument(
+        "--input-cube",
+        required=False,
+        type=match_input,
+        help="Path to the demographic cube, used instead of measure files",
+    )
+    parser.add_argument(
+        "--breakdowns",
+        nargs="+",
+        default=["population"]
+        + [d for d in DIMENSIONS if d != "practice"],
+        help="""
+             Breakdowns to read from the cube, as comma-separated
+             dimensions, e.g. age_band or age_band,sex
+             """,
+    )
     parser.add_argument(
         "--output-dir",
         required=True,
@@ -144,6 +210,16 @@ def parse_args():
         type=int,
         help="Round to the nearest",
     )
+    parser.add_argument(
+        "--rounding",
+        default="nearest",
+        choices=ROUNDING_METHODS,
+        help="""
+             Round to the nearest multiple of --round-to, or to the midpoint
+             of each band of --round-to (e.g. midpoint 6 rounding with
+             --round-to 6)
+             """,
+    )
     return parser.parse_args()
 
 
@@ -151,17 +227,25 @@ def main():
     args = parse_args()
     input_files = args.input_files
     input_list = args.input_list
+    input_cube = args.input_cube
+    breakdowns = args.breakdowns
     output_dir = args.output_dir
     output_name = args.output_name
     round_to = args.round_to
+    rounding = args.rounding
 
-    if not input_files and not input_list:
+    if not input_files and not input_list and not input_cube:
         raise FileNotFoundError("No files matched the input pattern provided")
 
+    if input_cube:
+        measure_tables = get_cube_measure_tables(input_cube, breakdowns)
+    else:
+        measure_tables = get_measure_tables(input_list or input_files)
+
     tables = []
-    for measure_table in get_measure_tables(input_list or input_files):
+    for measure_table in measure_tables:
         table = _reshape_data(measure_table)
-        rounded = _round_table(table, round_to)
+        rounded = _round_table(table, round_to, rounding)
         tables.append(rounded)
 
     output = _join_tables(tables)
@@ -1,16 +1,211 @@
+import argparse
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
-import os
+
+from cohort_store import (
+    COHORT_NAME,
+    FORMATS,
+    iter_cohort_chunks,
+    list_cohort_names,
+    list_index_dates,
+    write_cohort_chunks,
+)
+from practice_index import refresh_practice_index
+
+# Monthly cohorts that are not joined, as `input_<kind>_...`
+EXCLUDED_KINDS = ["ethnicity", "practice"]
+
+# Set in each worker process so the lookup is only sent once per worker
+_LOOKUP = None
+
+
+def build_lookup(rhs_path):
+    """Builds a compact patient_id -> ethnicity lookup from the ethnicity
+    cohort.
+
+    Each joined column is stored as integer category codes aligned with a
+    sorted array of patient ids, rather than as a dataframe.
+
+    Args:
+        rhs_path: path to `input_ethnicity.csv`
+
+    Returns:
+        Dictionary with a sorted `patient_id` array and, for every other
+        column, a tuple of (codes, categories)
+    """
+    rhs = pd.read_csv(rhs_path, dtype=str)
+    patient_ids = rhs.pop("patient_id").astype(np.int64).values
+    order = np.argsort(patient_ids, kind="stable")
+    columns = {}
+    for column in rhs.columns:
+        categorical = pd.Categorical(rhs[column].values[order])
+        columns[column] = (categorical.codes, categorical.categories)
+    return {"patient_id": patient_ids[order], "columns": columns}
+
+
+def attach_columns(chunk, lookup):
+    """Adds the lookup columns to a chunk of patients by binary search on
+    patient_id.  Patients missing from the lookup get missing values."""
+    lookup_ids = lookup["patient_id"]
+    patient_ids = chunk.patient_id.values
+    position = np.minimum(
+        np.searchsorted(lookup_ids, patient_ids), max(len(lookup_ids) - 1, 0)
+    )
+    found = (
+        lookup_ids[position] == patient_ids
+        if len(lookup_ids)
+        else np.zeros(len(chunk), dtype=bool)
+    )
+    for column, (codes, categories) in lookup["columns"].items():
+        chunk_codes = np.where(found, codes[position] if len(codes) else -1, -1)
+        chunk[column] = pd.Categorical.from_codes(chunk_codes, categories)
+    return chunk
+
+
+def join_month(
+    index_date,
+    input_dir,
+    output_dir,
+    input_format,
+    chunksize,
+    lookup=None,
+    cohort_name=COHORT_NAME,
+):
+    """Streams one monthly cohort through the lookup and writes the joined
+    file.  The output directory can be the input directory, as the joined
+    file only replaces the input once it is complete."""
+    lookup = lookup if lookup is not None else _LOOKUP
+    chunks = (
+        attach_columns(chunk, lookup)
+        for chunk in iter_cohort_chunks(
+            input_dir, index_date, input_format, chunksize, cohort_name=cohort_name
+        )
+    )
+    write_cohort_chunks(chunks, output_dir, index_date, input_format, cohort_name)
+    return index_date
+
+
+def _init_worker(lookup):
+    global _LOOKUP
+    _LOOKUP = lookup
+
+
+def join_cohorts(
+    index_dates,
+    lookup,
+    input_dir,
+    output_dir,
+    input_format="csv",
+    chunksize=100_000,
+    processes=None,
+    cohort_name=COHORT_NAME,
+):
+    """Joins the lookup onto each monthly cohort, one month per process."""
+    if processes == 1:
+        for index_date in index_dates:
+            join_month(
+                index_date,
+                input_dir,
+                output_dir,
+                input_format,
+                chunksize,
+                lookup,
+                cohort_name,
+            )
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=processes, initializer=_init_worker, initargs=(lookup,)
+    ) as executor:
+        futures = [
+            executor.submit(
+                join_month,
+                index_date,
+                input_dir,
+                output_dir,
+                input_format,
+                chunksize,
+                cohort_name=cohort_name,
+            )
+            for index_date in index_dates
+        ]
+        for future in futures:
+            future.result()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input-dir",
+        default="output",
+        type=pathlib.Path,
+        help="Directory holding the monthly cohort files",
+    )
+    parser.add_argument(
+        "--rhs",
+        default="output/input_ethnicity.csv",
+        type=pathlib.Path,
+        help="Path to the ethnicity cohort",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=pathlib.Path,
+        help="Path to the output directory (default: rewrite the input files)",
+    )
+    parser.add_argument(
+        "--input-format",
+        default="csv",
+        choices=FORMATS,
+        help="Format of the monthly cohort files",
+    )
+    parser.add_argument(
+        "--chunksize",
+        default=100_000,
+        type=int,
+        help="Number of patients to read at a time",
+    )
+    parser.add_argument(
+        "--processes",
+        default=None,
+        type=int,
+        help="Number of files to join at once (default: number of cores)",
+    )
+    return parser.parse_args()
+
+
+def get_cohort_names(input_dir, input_format="csv"):
+    """Lists the monthly cohorts to join ethnicity onto."""
+    return [
+        name
+        for name in list_cohort_names(input_dir, input_format)
+        if name.split("_")[1] not in EXCLUDED_KINDS
+    ]
 
 
-ethnicity_df = pd.read_csv('output/input_ethnicity.csv')
+def main():
+    args = parse_args()
+    lookup = build_lookup(args.rhs)
+    cohort_names = get_cohort_names(args.input_dir, args.input_format)
+    if not cohort_names:
+        raise FileNotFoundError(f"No cohort files found in {args.input_dir}")
+    for cohort_name in cohort_names:
+        join_cohorts(
+            list_index_dates(args.input_dir, args.input_format, cohort_name),
+            lookup,
+            args.input_dir,
+            args.output_dir or args.input_dir,
+            args.input_format,
+            args.chunksize,
+            args.processes,
+            cohort_name,
+        )
+    # The practice count files are not joined, but are indexed here so
+    # that the practice coverage is read from the index
+    refresh_practice_index(args.input_dir)
 
 
-for file in os.listdir('output'):
-    if file.startswith('input'):
-        #exclude ethnicity
-        if file.split('_')[1] not in ['ethnicity.csv', 'practice']:
-            file_path = os.path.join('output', file)
-            df = pd.read_csv(file_path)
-            merged_df = df.merge(ethnicity_df, how='left', on='patient_id')
-            
-            merged_df.to_csv(file_path)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Local runner for the `python:latest` actions in project.yaml.
+
+Actions run in the order given by their `needs`, with independent actions
+running at the same time.  Each action's inputs are hashed before it runs:
+its command, its script and the analysis modules the script imports, and
+the files matching the outputs of the actions it needs.  An action is
+skipped when that hash is the same as at its last successful run and its
+outputs still exist.  Hashes are kept in `logs/local_runner.json`.
+
+Actions that are not `python:latest` actions (such as cohortextractor) are
+not run; their outputs are expected to exist already.
+"""
+import argparse
+import ast
+import hashlib
+import json
+import pathlib
+import shlex
+import subprocess
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utilities import hash_files
+
+BASE_DIR = pathlib.Path(__file__).parents[1]
+ANALYSIS_DIR = BASE_DIR / "analysis"
+LOGS_DIR = BASE_DIR / "logs"
+
+STATE_NAME = "local_runner.json"
+PYTHON_IMAGE = "python:latest"
+
+
+def read_actions(project_path):
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError("pyyaml is needed to read project.yaml")
+    with open(project_path) as f:
+        return yaml.safe_load(f)["actions"]
+
+
+def is_python_action(action):
+    return action["run"].split()[0] == PYTHON_IMAGE
+
+
+def get_command(action):
+    """Gets the command of a `python:latest` action, run with this
+    interpreter."""
+    args = shlex.split(action["run"])[1:]
+    if args[0] == "python":
+        args[0] = sys.executable
+    return args
+
+
+def get_output_patterns(action):
+    return [
+        pattern
+        for outputs in action.get("outputs", {}).values()
+        for pattern in outputs.values()
+    ]
+
+
+def get_output_files(action):
+    return sorted(
+        path
+        for pattern in get_output_patterns(action)
+        for path in BASE_DIR.glob(pattern)
+        if path.is_file()
+    )
+
+
+def get_local_imports(script):
+    """Gets the script and the analysis modules it imports, recursively."""
+    found = set()
+    pending = [pathlib.Path(script)]
+    while pending:
+        path = pending.pop()
+        if path in found or not path.exists():
+            continue
+        found.add(path)
+        for node in ast.walk(ast.parse(path.read_text())):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                pending.append(ANALYSIS_DIR / f"{name.split('.')[0]}.py")
+    return sorted(found)
+
+
+def get_action_hash(name, actions):
+    """Hashes the command, code and input files of an action."""
+    action = actions[name]
+    command = get_command(action)
+    scripts = [arg for arg in command if arg.endswith(".py")]
+    code = [
+        path
+        for script in scripts
+        for path in get_local_imports(BASE_DIR / script)
+    ]
+    inputs = [
+        path
+        for need in action.get("needs", [])
+        for path in get_output_files(actions[need])
+    ]
+    digest = hashlib.sha256()
+    digest.update(action["run"].encode())
+    digest.update(hash_files(code).encode())
+    for path in sorted(inputs):
+        # Inputs from different actions can share a file name
+        digest.update(str(path.relative_to(BASE_DIR)).encode())
+    digest.update(hash_files(inputs).encode())
+    return digest.hexdigest()
+
+
+def read_state(path):
+    path = pathlib.Path(path)
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def write_state(state, path):
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(json.dumps(state, indent=2))
+    tmp_path.replace(path)
+
+
+def get_run_order(names, actions):
+    """Orders actions so that each comes after the actions it needs.
+
+    Raises:
+        ValueError: if the actions have a cycle
+    """
+    order = []
+    visiting = set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"Cycle in the needs of {name}")
+        visiting.add(name)
+        for need in actions[name].get("needs", []):
+            if need in names:
+                visit(need)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in names:
+        visit(name)
+    return order
+
+
+def run_action(name, actions):
+    result = subprocess.run(get_command(actions[name]), cwd=BASE_DIR)
+    return result.returncode
+
+
+def run_actions(names, actions, state, processes=None, force=False):
+    """Runs actions in dependency order, running independent actions at the
+    same time and skipping unchanged actions.
+
+    Returns:
+        Dictionary of action name to "ran", "skipped", "failed" or
+        "not run" (because an action it needs failed)
+    """
+    names = get_run_order(names, actions)
+    status = {}
+    running = {}
+
+    def is_ready(name):
+        return all(
+            status.get(need) in ("ran", "skipped")
+            for need in actions[name].get("needs", [])
+            if need in names
+        )
+
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        while len(status) < len(names):
+            for name in names:
+                if name in status or name in running.values():
+                    continue
+                needs = [n for n in actions[name].get("needs", []) if n in names]
+                if any(status.get(need) in ("failed", "not run") for need in needs):
+                    status[name] = "not run"
+                    continue
+                if not is_ready(name):
+                    continue
+                action_hash = get_action_hash(name, actions)
+                if (
+                    not force
+                    and state.get(name) == action_hash
+                    and get_output_files(actions[name])
+                ):
+                    status[name] = "skipped"
+                    print(f"{name}: unchanged, skipped")
+                    continue
+                print(f"{name}: running")
+                running[executor.submit(run_action, name, actions)] = name
+                state.pop(name, None)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                if future.result() == 0:
+                    status[name] = "ran"
+                    # Hash the outputs of the actions it needs as they were
+                    # when it ran
+                    state[name] = get_action_hash(name, actions)
+                else:
+                    status[name] = "failed"
+                print(f"{name}: {status[name]}")
+    return status
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--project",
+        default=BASE_DIR / "project.yaml",
+        type=pathlib.Path,
+        help="Path to project.yaml",
+    )
+    parser.add_argument(
+        "--actions",
+        nargs="+",
+        help="Actions to run (default: every python:latest action)",
+    )
+    parser.add_argument(
+        "--processes",
+        default=None,
+        type=int,
+        help="Number of actions to run at once (default: number of cores)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Run actions even if they are unchanged",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    actions = read_actions(args.project)
+    names = args.actions or [
+        name for name, action in actions.items() if is_python_action(action)
+    ]
+    for name in names:
+        if not is_python_action(actions[name]):
+            raise ValueError(f"{name} is not a {PYTHON_IMAGE} action")
+
+    state_path = LOGS_DIR / STATE_NAME
+    state = read_state(state_path)
+    status = run_actions(names, actions, state, args.processes, args.force)
+    write_state(state, state_path)
+    if any(value in ("failed", "not run") for value in status.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Registry of the asthma register measures.
+
+The measures are plain data, so post-processing scripts can read their ids,
+numerators and breakdowns without importing cohortextractor or building the
+study definition.  `study_definition_ast_reg` builds its `Measure` objects
+from this registry.
+"""
+import json
+import pathlib
+from typing import NamedTuple
+
+MANIFEST_NAME = "measures_ast_reg.json"
+
+
+class MeasureSpec(NamedTuple):
+    """The arguments of a cohortextractor `Measure`."""
+
+    id: str
+    numerator: str
+    denominator: str
+    group_by: list
+    small_number_suppression: bool = True
+
+
+# One measure per breakdown; `population` is the total
+BREAKDOWNS = [
+    "population",
+    "practice",
+    "age_band",
+    "sex",
+    "imd",
+    "region",
+    "ethnicity",
+    "learning_disability",
+    "care_home",
+]
+
+
+def _get_measure_id(breakdown):
+    return f"ast_reg_{'total' if breakdown == 'population' else breakdown}_rate"
+
+
+measures = [
+    MeasureSpec(
+        id=_get_measure_id(breakdown),
+        numerator="asthma",
+        denominator="population",
+        group_by=[breakdown],
+    )
+    for breakdown in BREAKDOWNS
+]
+
+
+def write_manifest(output_dir, measures=measures):
+    """Writes the measures as JSON next to the measure files."""
+    path = pathlib.Path(output_dir) / MANIFEST_NAME
+    path.write_text(
+        json.dumps([measure._asdict() for measure in measures], indent=2)
+    )
+    return path
+
+
+def read_manifest(output_dir):
+    path = pathlib.Path(output_dir) / MANIFEST_NAME
+    return [MeasureSpec(**measure) for measure in json.loads(path.read_text())]
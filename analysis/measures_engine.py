@@ -0,0 +1,357 @@
+"""
+Local measures engine.
+
+Produces every `measure_<id>.csv` declared in the study definition while
+reading each joined monthly cohort only once.  All measures share a
+numerator and denominator and differ only in `group_by`, so each group_by
+column is factorised once per month and every measure is then a single
+weighted bincount over those codes (one grouping set per measure).
+
+With `chunksize` each month is instead streamed in chunks of patients, with
+only the measure columns read and cast to compact types, and each chunk's
+sums are folded into running totals per group.  Memory then depends on the
+number of groups rather than the number of patients.
+
+The output files have the same columns and small number suppression as the
+files written by `cohortextractor generate_measures`.
+"""
+import argparse
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from cohort_store import (
+    FORMATS,
+    get_cohort_columns,
+    iter_cohort_chunks,
+    list_index_dates,
+    read_cohort,
+)
+import measure_registry
+
+BASE_DIR = pathlib.Path(__file__).parents[1]
+OUTPUT_DIR = BASE_DIR / "output"
+
+SMALL_NUMBER_THRESHOLD = 5
+
+
+def get_measure_columns(measures):
+    """Gets the cohort columns needed to calculate the measures."""
+    columns = []
+    for measure in measures:
+        for column in [measure.numerator, measure.denominator, *measure.group_by]:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+def _get_available_columns(measures, input_dir, index_date, input_format):
+    available = get_cohort_columns(input_dir, index_date, input_format)
+    return [
+        column for column in get_measure_columns(measures) if column in available
+    ]
+
+
+def read_measure_columns(measures, input_dir, index_date, input_format="csv"):
+    """Reads only the columns of a monthly cohort that the measures use."""
+    columns = _get_available_columns(measures, input_dir, index_date, input_format)
+    return read_cohort(input_dir, index_date, input_format, columns=columns)
+
+
+def get_compact_dtypes(measures, columns):
+    """Gets compact types for the numerator and denominator columns, which
+    are 0/1 flags.  The group_by columns keep their types, as a CSV column
+    read as a category would have string categories."""
+    return {
+        column: np.int8
+        for measure in measures
+        for column in [measure.numerator, measure.denominator]
+        if column in columns
+    }
+
+
+def _get_group_by(measure):
+    # `group_by=["population"]` is the total, which has no group column
+    return [column for column in measure.group_by if column != measure.denominator]
+
+
+def _select_values_for_suppression(numerators, denominators):
+    small = (numerators > 0) & (numerators <= SMALL_NUMBER_THRESHOLD)
+    remainders = denominators - numerators
+    large = (remainders > 0) & (remainders <= SMALL_NUMBER_THRESHOLD)
+    suppressed = small | large
+    # A single redacted numerator could be recovered from the total, so the
+    # next smallest is redacted too
+    if suppressed.sum() == 1 and not suppressed.all():
+        others = np.flatnonzero(~suppressed)
+        suppressed[others[numerators[others].argmin()]] = True
+    return suppressed
+
+
+def suppress_small_numbers(table, numerator, denominator, by=None):
+    """Redacts numerators as `Measure(small_number_suppression=True)` does.
+
+    A numerator is redacted if it, or the denominator minus it, is between 1
+    and SMALL_NUMBER_THRESHOLD.  If that redacts only one row, the row with
+    the next smallest numerator is redacted too.
+
+    Args:
+        table: table of numerator and denominator sums
+        numerator: numerator column
+        denominator: denominator column
+        by: columns identifying each group of rows that is suppressed
+            together, e.g. ["date"].  Defaults to the whole table, which is
+            one month of one measure.
+
+    Returns:
+        Input table with the redacted numerators set to NaN
+    """
+    numerators = table[numerator].to_numpy(dtype=float)
+    denominators = table[denominator].to_numpy(dtype=float)
+    suppressed = np.zeros(len(table), dtype=bool)
+    if by:
+        groups = table.groupby(by, sort=False, dropna=False).indices.values()
+    else:
+        groups = [np.arange(len(table))]
+    for rows in groups:
+        suppressed[rows] = _select_values_for_suppression(
+            numerators[rows], denominators[rows]
+        )
+    table[numerator] = np.where(suppressed, np.nan, numerators)
+    return table
+
+
+def _sum_by(codes, size, values):
+    sums = np.bincount(codes, weights=values, minlength=size)
+    if np.issubdtype(values.dtype, np.integer) or values.dtype == bool:
+        return sums.astype(np.int64)
+    return sums
+
+
+def sum_measures(cohort, measures):
+    """Sums the numerator and denominator of every measure by group.
+
+    Args:
+        cohort: patient-level table
+        measures: objects with `id`, `numerator`, `denominator` and
+            `group_by`
+
+    Returns:
+        Dictionary of measure id to a table of the group_by columns and the
+        numerator and denominator sums, one row per group with a patient
+    """
+    if "population" not in cohort.columns:
+        cohort = cohort.assign(population=1)
+
+    factorised = {}
+    tables = {}
+    for measure in measures:
+        numerator, denominator = measure.numerator, measure.denominator
+        group_by = _get_group_by(measure)
+        for column in group_by:
+            if column not in factorised:
+                factorised[column] = pd.factorize(
+                    cohort[column], sort=True, use_na_sentinel=False
+                )
+
+        shape = tuple(len(factorised[column][1]) for column in group_by)
+        if group_by:
+            codes = np.ravel_multi_index(
+                [factorised[column][0] for column in group_by], shape
+            )
+        else:
+            codes = np.zeros(len(cohort), dtype=np.int64)
+        size = int(np.prod(shape))
+
+        # Only groups that contain at least one patient are reported
+        present = np.flatnonzero(np.bincount(codes, minlength=size))
+        group_index = np.unravel_index(present, shape) if group_by else []
+        table = pd.DataFrame(
+            {
+                column: np.asarray(factorised[column][1])[index]
+                for column, index in zip(group_by, group_index)
+            },
+            index=range(len(present)),
+        )
+        table[numerator] = _sum_by(codes, size, cohort[numerator].values)[present]
+        table[denominator] = _sum_by(codes, size, cohort[denominator].values)[
+            present
+        ]
+        tables[measure.id] = table
+    return tables
+
+
+def add_sums(table, other, measure):
+    """Adds two tables of sums from `sum_measures`, matching their groups."""
+    group_by = _get_group_by(measure)
+    columns = [measure.numerator, measure.denominator]
+    combined = pd.concat([table, other], ignore_index=True)
+    if not group_by:
+        return combined[columns].sum().to_frame().T
+    return (
+        combined.groupby(group_by, dropna=False, sort=True)[columns]
+        .sum()
+        .reset_index()
+    )
+
+
+def finish_measure(table, measure, index_date):
+    """Suppresses small numbers and adds the value and date of a table of
+    sums."""
+    if getattr(measure, "small_number_suppression", True):
+        table = suppress_small_numbers(
+            table, measure.numerator, measure.denominator
+        )
+    table["value"] = table[measure.numerator] / table[measure.denominator]
+    table["date"] = pd.Timestamp(index_date)
+    return table
+
+
+def calculate_measures(cohort, measures, index_date):
+    """Calculates one month of every measure from a single patient-level
+    table.
+
+    Args:
+        cohort: patient-level table for a single index date
+        measures: objects with `id`, `numerator`, `denominator`, `group_by`
+            and `small_number_suppression`
+        index_date: index date of the cohort
+
+    Returns:
+        Dictionary of measure id to measure table for the month
+    """
+    measures_by_id = {measure.id: measure for measure in measures}
+    return {
+        measure_id: finish_measure(table, measures_by_id[measure_id], index_date)
+        for measure_id, table in sum_measures(cohort, measures).items()
+    }
+
+
+def calculate_measures_chunked(chunks, measures, index_date):
+    """Calculates one month of every measure from chunks of a patient-level
+    table, keeping only the running sums of each group.
+
+    Args:
+        chunks: iterable of patient-level tables for a single index date
+        measures: as for `calculate_measures`
+        index_date: index date of the cohort
+
+    Returns:
+        Dictionary of measure id to measure table for the month
+    """
+    totals = {}
+    for chunk in chunks:
+        for measure, sums in zip(measures, sum_measures(chunk, measures).values()):
+            if measure.id in totals:
+                sums = add_sums(totals[measure.id], sums, measure)
+            totals[measure.id] = sums
+    if not totals:
+        return {}
+    return {
+        measure.id: finish_measure(totals[measure.id], measure, index_date)
+        for measure in measures
+    }
+
+
+def generate_measures(
+    measures, input_dir, input_format="csv", index_dates=None, chunksize=None
+):
+    """Calculates every measure for every monthly cohort.
+
+    Args:
+        measures: measures from `measure_registry` or the study definition
+        input_dir: directory holding the joined monthly cohorts
+        input_format: one of `cohort_store.FORMATS`
+        index_dates: optional index dates to calculate
+        chunksize: optional number of patients to read at a time; by default
+            each month is read whole
+
+    Returns:
+        Dictionary of measure id to measure table
+    """
+    monthly = {measure.id: [] for measure in measures}
+    available_dates = list_index_dates(input_dir, input_format)
+    if index_dates is not None:
+        available_dates = available_dates[
+            available_dates.isin(pd.DatetimeIndex(index_dates))
+        ]
+    for index_date in available_dates:
+        if chunksize:
+            columns = _get_available_columns(
+                measures, input_dir, index_date, input_format
+            )
+            chunks = iter_cohort_chunks(
+                input_dir,
+                index_date,
+                input_format,
+                chunksize,
+                columns=columns,
+                dtype=get_compact_dtypes(measures, columns),
+            )
+            tables = calculate_measures_chunked(chunks, measures, index_date)
+        else:
+            cohort = read_measure_columns(
+                measures, input_dir, index_date, input_format
+            )
+            tables = calculate_measures(cohort, measures, index_date)
+        for measure_id, table in tables.items():
+            monthly[measure_id].append(table)
+    return {
+        measure_id: pd.concat(tables, ignore_index=True)
+        for measure_id, tables in monthly.items()
+        if tables
+    }
+
+
+def write_measures(measure_tables, output_dir):
+    pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+    for measure_id, table in measure_tables.items():
+        table.to_csv(
+            pathlib.Path(output_dir) / f"measure_{measure_id}.csv", index=False
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input-dir",
+        default=OUTPUT_DIR / "joined",
+        type=pathlib.Path,
+        help="Directory holding the joined monthly cohorts",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=OUTPUT_DIR / "joined",
+        type=pathlib.Path,
+        help="Path to the output directory",
+    )
+    parser.add_argument(
+        "--input-format",
+        default="csv",
+        choices=FORMATS,
+        help="Format of the monthly cohort files",
+    )
+    parser.add_argument(
+        "--chunksize",
+        default=None,
+        type=int,
+        help="Number of patients to read at a time (default: whole months)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    measure_tables = generate_measures(
+        measure_registry.measures,
+        args.input_dir,
+        args.input_format,
+        chunksize=args.chunksize,
+    )
+    write_measures(measure_tables, args.output_dir)
+    measure_registry.write_manifest(args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,12 @@ import fnmatch
 import pandas
 import numpy
 
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
-from dateutil import parser
 from collections import Counter
 
+from chart_cache import render_cached
+from chart_core import get_template, parse_date_lines
+from instrument import instrumented
+
 
 def get_measure_tables(input_file):
     # The `date` column is assigned by the measures framework.
@@ -32,32 +33,6 @@ def subset_table(measure_table, measures_pattern, measures_list):
     return measure_table[measure_table["name"].isin(measures_list)]
 
 
-def scale_thousand(ax):
-    """
-    Scale a proportion for rate by 1000
-    Used for y axis display
-    """
-
-    def thousand_formatter(x, pos):
-        return f"{x*1000: .0f}"
-
-    ax.yaxis.set_major_formatter(FuncFormatter(thousand_formatter))
-    ax.set_ylabel("Rate per thousand")
-
-
-def scale_hundred(ax):
-    """
-    Scale a proportion for percentage
-    Used for y axis display
-    """
-
-    def hundred_formatter(x, pos):
-        return f"{x*100: .0f}"
-
-    ax.yaxis.set_major_formatter(FuncFormatter(hundred_formatter))
-    ax.set_ylabel("Percentage")
-
-
 def autoselect_labels(measures_list):
     measures_set = set(measures_list)
     counts = Counter(
@@ -101,6 +76,7 @@ def plot_cis(ax, data):
     )
 
 
+@instrumented
 def get_group_chart(
     measure_table,
     columns=2,
@@ -109,7 +85,6 @@ def get_group_chart(
     ci=False,
     exclude_group=None,
 ):
-    figure = plt.figure(figsize=(columns * 6, columns * 5))
     measure_table.set_index("date", inplace=True)
 
     repeated = autoselect_labels(measure_table["name"])
@@ -125,11 +100,29 @@ def get_group_chart(
     if total_plots % columns > 0:
         rows = rows + 1
 
-    for index, panel_group in enumerate(groups):
-        ax = figure.add_subplot(rows, columns, index + 1)
+    if date_lines:
+        min_date = min(measure_table.index)
+        max_date = max(measure_table.index)
+        date_lines = [
+            date
+            for date in parse_date_lines(tuple(date_lines))
+            if date >= min_date and date <= max_date
+        ]
+
+    chart = get_template(
+        figsize=(columns * 6, columns * 5),
+        nrows=rows,
+        ncols=columns,
+        date_lines=date_lines,
+        scale=scale,
+    )
+    for ax in chart.axes[total_plots:]:
+        ax.set_visible(False)
+
+    for ax, panel_group in zip(chart.axes, groups):
         ax.autoscale(enable=True, axis="y")
         title = translate_group(
-            panel_group[1].category[0],
+            panel_group[1].category.iloc[0],
             panel_group[0],
             repeated,
             autolabel=True,
@@ -142,33 +135,17 @@ def get_group_chart(
             )
             if ci:
                 plot_cis(ax, plot_group_data)
-            # TODO: determine whether tight_layout is sufficient
-            # plt.legend(
-            #    bbox_to_anchor=(0.5, -0.8),
-            #    loc="lower center",
-            #    fontsize="x-small",
-            #    ncol=4,
-            # )
-        plt.legend(fontsize="x-small", ncol=4)
+        ax.legend(fontsize="x-small", ncol=4)
         ax.set_xlabel("")
         ax.tick_params(axis="x", labelsize=7)
-        if date_lines:
-            min_date = min(measure_table.index)
-            max_date = max(measure_table.index)
-            add_date_lines(plt, date_lines, min_date, max_date)
-        if scale == "percentage":
-            scale_hundred(ax)
-        elif scale == "rate":
-            scale_thousand(ax)
-    figure.tight_layout()
+    chart.figure.tight_layout()
     # Allow space of suptitle after running tight
-    plt.subplots_adjust(top=0.92)
-    # plt.subplots_adjust(hspace=1.0)
-    return plt
+    chart.figure.subplots_adjust(top=0.92)
+    return chart
 
 
 def write_group_chart(group_chart, path, plot_title):
-    suptitle = plt.suptitle(plot_title)
+    suptitle = group_chart.suptitle(plot_title)
     group_chart.savefig(
         path, bbox_extra_artists=(suptitle,), bbox_inches="tight"
     )
@@ -182,16 +159,6 @@ def match_paths(files, pattern):
     return fnmatch.filter(files, pattern)
 
 
-def add_date_lines(plt, vlines, min_date, max_date):
-    for date in vlines:
-        date_obj = pandas.to_datetime(date)
-        if date_obj >= min_date and date_obj <= max_date:
-            try:
-                plt.axvline(x=date_obj, color="orange", ls="--")
-            except parser._parser.ParserError:
-                continue
-
-
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -261,16 +228,28 @@ def main():
 
     # Parse the names field to determine which subset to use
     subset = subset_table(measure_table, measures_pattern, measures_list)
-    chart = get_group_chart(
-        subset,
-        columns=2,
+    path = output_dir / output_name
+
+    def render():
+        chart = get_group_chart(
+            subset.copy(),
+            columns=2,
+            date_lines=date_lines,
+            scale=scale,
+            ci=confidence_intervals,
+            exclude_group=exclude_group,
+        )
+        write_group_chart(chart, path, plot_title)
+        chart.close()
+
+    params = dict(
+        title=plot_title,
         date_lines=date_lines,
         scale=scale,
         ci=confidence_intervals,
         exclude_group=exclude_group,
     )
-    write_group_chart(chart, output_dir / output_name, plot_title)
-    chart.close()
+    render_cached(path, subset, params, render)
 
 
 if __name__ == "__main__":
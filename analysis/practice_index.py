@@ -0,0 +1,145 @@
+"""
+Index of the practices in the monthly practice count files.
+
+Each `input_practice_count*.csv` file is read once and reduced to its sorted
+unique practice ids.  The ids of every file, and the union over all files,
+are stored in a single `.npz` file in compressed sparse row form.  Refreshing
+the index only reads files that are new or have changed since it was last
+written, and the number of practices is then read from the index rather than
+from the files.
+
+The index is built by the extraction (`incremental`) and join
+(`join_ethnicity`) steps.  Readers refresh it too, which only checks the
+size and modification time of each file when it is already up to date.
+"""
+import argparse
+import pathlib
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = pathlib.Path(__file__).parents[1]
+OUTPUT_DIR = BASE_DIR / "output"
+
+PREFIX = "input_practice_count"
+INDEX_NAME = "practice_index.npz"
+
+
+class PracticeIndex(NamedTuple):
+    # File names, and their size and mtime_ns when they were read
+    names: np.ndarray
+    stamps: np.ndarray
+    # Practices in file i are practices[offsets[i]:offsets[i + 1]]
+    offsets: np.ndarray
+    practices: np.ndarray
+    # Sorted practices in any file
+    all_practices: np.ndarray
+
+
+def _get_stamp(path):
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _read_practices(path):
+    practices = pd.read_csv(path, usecols=["practice"]).practice.dropna()
+    return np.unique(practices.values.astype(np.int64))
+
+
+def build_practice_index(files, previous=None):
+    """Builds the index for the given files, reusing the practices of any
+    file that is unchanged since `previous` was built."""
+    reusable = {}
+    if previous is not None:
+        for i, name in enumerate(previous.names):
+            reusable[name] = (
+                tuple(previous.stamps[i]),
+                previous.practices[previous.offsets[i]:previous.offsets[i + 1]],
+            )
+
+    files = sorted(files, key=lambda path: path.name)
+    stamps = [_get_stamp(path) for path in files]
+    practices = []
+    for path, stamp in zip(files, stamps):
+        cached = reusable.get(path.name)
+        if cached is not None and cached[0] == stamp:
+            practices.append(cached[1])
+        else:
+            practices.append(_read_practices(path))
+
+    offsets = np.zeros(len(files) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(ids) for ids in practices])
+    practices = (
+        np.concatenate(practices) if practices else np.array([], dtype=np.int64)
+    )
+    return PracticeIndex(
+        names=np.array([path.name for path in files], dtype=str),
+        stamps=np.array(stamps, dtype=np.int64).reshape(-1, 2),
+        offsets=offsets,
+        practices=practices,
+        all_practices=np.unique(practices),
+    )
+
+
+def write_practice_index(index, path):
+    path = pathlib.Path(path)
+    tmp_path = path.with_name(f".{path.stem}.tmp{path.suffix}")
+    np.savez(tmp_path, **index._asdict())
+    tmp_path.replace(path)
+
+
+def read_practice_index(path):
+    with np.load(path) as data:
+        return PracticeIndex(**{field: data[field] for field in PracticeIndex._fields})
+
+
+def refresh_practice_index(directory, prefix=PREFIX, index_path=None):
+    """Brings the index for the practice count files in `directory` up to
+    date, writing it only if a file was added, changed or removed.
+
+    Returns:
+        The `PracticeIndex`
+    """
+    directory = pathlib.Path(directory)
+    index_path = pathlib.Path(index_path or directory / INDEX_NAME)
+    previous = read_practice_index(index_path) if index_path.exists() else None
+    files = list(directory.glob(f"{prefix}*.csv"))
+    if previous is not None and sorted(previous.names.tolist()) == sorted(
+        path.name for path in files
+    ):
+        stamps = np.array(
+            [_get_stamp(directory / name) for name in previous.names],
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        if np.array_equal(stamps, previous.stamps):
+            return previous
+
+    index = build_practice_index(files, previous)
+    write_practice_index(index, index_path)
+    return index
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input-dir",
+        default=OUTPUT_DIR,
+        type=pathlib.Path,
+        help="Directory holding the practice count files",
+    )
+    parser.add_argument(
+        "--prefix",
+        default=PREFIX,
+        help="Prefix of the practice count files",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    refresh_practice_index(args.input_dir, args.prefix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Practice x month matrices for practice-level measures.
+
+A practice-level measure table has one row per practice and month.  Here
+the numerator and denominator are instead held as aligned `int32` matrices
+with one row per practice and one column per month, so relevance filtering,
+totals, deciles and per-practice trends are array operations rather than
+groupbys and pivots.  Practice months without a row in the measure table,
+and suppressed numerators, are stored as -1.
+"""
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from deciles import PERCENTILES, get_deciles_table
+
+MISSING = -1
+
+
+class PracticeMatrix(NamedTuple):
+    practices: np.ndarray
+    dates: pd.DatetimeIndex
+    numerator: np.ndarray
+    denominator: np.ndarray
+
+
+def _to_int32(values):
+    return np.where(np.isnan(values), MISSING, values).astype(np.int32)
+
+
+def from_measure_table(
+    measure_table,
+    numerator="asthma",
+    denominator="population",
+    practice_column="practice",
+    period_column="date",
+):
+    """Builds a `PracticeMatrix` from a practice-level measure table."""
+    measure_table = measure_table[measure_table[practice_column].notnull()]
+    practice_codes, practices = pd.factorize(
+        measure_table[practice_column], sort=True
+    )
+    date_codes, dates = pd.factorize(measure_table[period_column], sort=True)
+    shape = (len(practices), len(dates))
+    numerators = np.full(shape, MISSING, dtype=np.int32)
+    denominators = np.full(shape, MISSING, dtype=np.int32)
+    numerators[practice_codes, date_codes] = _to_int32(
+        measure_table[numerator].astype(float).values
+    )
+    denominators[practice_codes, date_codes] = _to_int32(
+        measure_table[denominator].astype(float).values
+    )
+    return PracticeMatrix(
+        np.asarray(practices), pd.DatetimeIndex(dates), numerators, denominators
+    )
+
+
+def to_measure_table(
+    matrix,
+    numerator="asthma",
+    denominator="population",
+    practice_column="practice",
+    period_column="date",
+):
+    """Converts a `PracticeMatrix` back to a practice-level measure table,
+    with a row for every practice month that has a denominator."""
+    practice_index, date_index = np.nonzero(matrix.denominator != MISSING)
+    numerators = matrix.numerator[practice_index, date_index].astype(float)
+    numerators[numerators == MISSING] = np.nan
+    table = pd.DataFrame(
+        {
+            practice_column: matrix.practices[practice_index],
+            numerator: numerators,
+            denominator: matrix.denominator[practice_index, date_index],
+        }
+    )
+    table["value"] = table[numerator] / table[denominator]
+    table[period_column] = matrix.dates[date_index]
+    return table.sort_values([period_column, practice_column], ignore_index=True)
+
+
+def get_values(matrix):
+    """Gets numerator / denominator, with NaN for missing practice months."""
+    numerators = matrix.numerator.astype(float)
+    denominators = matrix.denominator.astype(float)
+    numerators[matrix.numerator == MISSING] = np.nan
+    denominators[matrix.denominator == MISSING] = np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return numerators / denominators
+
+
+def get_relevant_practices(matrix):
+    """Gets a mask of practices with at least one event in the study period,
+    as `utilities.drop_irrelevant_practices` does."""
+    return (matrix.numerator > 0).any(axis=1)
+
+
+def select_practices(matrix, mask):
+    return matrix._replace(
+        practices=matrix.practices[mask],
+        numerator=matrix.numerator[mask],
+        denominator=matrix.denominator[mask],
+    )
+
+
+def get_totals(matrix, numerator="asthma", denominator="population"):
+    """Sums the practices for each month, ignoring missing values."""
+    return pd.DataFrame(
+        {
+            "date": matrix.dates,
+            numerator: np.where(
+                matrix.numerator == MISSING, 0, matrix.numerator
+            ).sum(axis=0, dtype=np.int64),
+            denominator: np.where(
+                matrix.denominator == MISSING, 0, matrix.denominator
+            ).sum(axis=0, dtype=np.int64),
+        }
+    )
+
+
+def get_deciles(matrix, percentiles=PERCENTILES):
+    """Calculates the percentiles of the practice values for each month."""
+    return get_deciles_table(matrix.dates, get_values(matrix).T, percentiles)
+
+
+def get_trends(matrix):
+    """Gets the least-squares slope of each practice's value per month,
+    using only the months where the value is present.  Practices with fewer
+    than two months have a missing slope."""
+    values = get_values(matrix)
+    present = np.isfinite(values)
+    months = np.where(present, np.arange(len(matrix.dates)), 0.0)
+    values = np.where(present, values, 0.0)
+    n = present.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_month = months.sum(axis=1) / n
+        mean_value = values.sum(axis=1) / n
+        covariance = (months * values).sum(axis=1) / n - mean_month * mean_value
+        variance = (months**2).sum(axis=1) / n - mean_month**2
+        slopes = covariance / variance
+    slopes[n < 2] = np.nan
+    return pd.Series(slopes, index=matrix.practices, name="slope")
+
+
+def write_practice_matrix(matrix, path):
+    np.savez_compressed(
+        path,
+        practices=matrix.practices,
+        dates=matrix.dates.values.astype("datetime64[D]"),
+        numerator=matrix.numerator,
+        denominator=matrix.denominator,
+    )
+
+
+def read_practice_matrix(path):
+    with np.load(path) as data:
+        return PracticeMatrix(
+            data["practices"],
+            pd.DatetimeIndex(data["dates"]),
+            data["numerator"],
+            data["denominator"],
+        )
@@ -2,101 +2,137 @@ from utilities import *
 from pathlib import Path
 import pandas as pd
 import os
-from cohortextractor import Measure
 from config import demographics, codelist_path, vertical_lines
-from ebmdatalab import charts
+from cube import CUBE_NAME, measure_table, read_cube
+from deciles import write_deciles_chart, write_deciles_table
+from render_pool import render_charts
+import practice_matrix
 
 BASE_DIR = Path(__file__).parents[1]
 OUTPUT_DIR = BASE_DIR / "output" 
 
 #import measures
-from study_definition_ast_reg import measures
+from measure_registry import measures
 
 
+def get_practice_tables(df, numerator, denominator):
+    """Gets the tables written for the practice-level measure.
 
-measures_dict = {}
+    The totals and the deciles are calculated from every relevant practice
+    before the practice-level table is suppressed, so that suppressing small
+    practices does not bias the percentiles.
 
-for m in measures:
-    measures_dict[m.id] = m
+    Returns:
+        Tuple of (suppressed practice-level table, totals, deciles table)
+    """
+    matrix = practice_matrix.from_measure_table(df, numerator, denominator)
+    matrix = practice_matrix.select_practices(matrix, practice_matrix.get_relevant_practices(matrix))
+    df = df[df['practice'].isin(matrix.practices)]
+
+    df_total = practice_matrix.get_totals(matrix, numerator, denominator)
+    deciles_table = practice_matrix.get_deciles(matrix)
+    df = redact_small_numbers(df, 5, numerator, denominator, ['rate', 'value'])
+    return df, df_total, deciles_table
+
+
+def main(input_dir=OUTPUT_DIR / 'joined', output_dir=OUTPUT_DIR):
+    """Writes the rate tables and charts of every measure.
+
+    Args:
+        input_dir: directory holding the measure files, or the cube
+        output_dir: directory to write the tables and charts to
+    """
+    input_dir = Path(input_dir)
+    output_dir = Path(output_dir)
+    measures_dict = {}
+
+    for m in measures:
+        measures_dict[m.id] = m
  
-print(measures_dict)
+    print(measures_dict)
 
+    # Read breakdowns from the demographic cube when it has been built, rather
+    # than from the measure files
+    cube_path = input_dir / CUBE_NAME
+    cube = read_cube(cube_path) if os.path.exists(cube_path) else None
 
-for key, value in measures_dict.items():
-    
-    df = pd.read_csv(os.path.join(OUTPUT_DIR, 'joined',f'measure_{value.id}.csv'), parse_dates=['date']).sort_values(by='date')
-    df = drop_missing_demographics(df, value.group_by[0])
+    # Charts are drawn in parallel once every table has been written
+    chart_jobs = []
 
-    # if key == "ethnicity_rate":
-    #     df = convert_ethnicity(df)
-        
-    df = calculate_rate(df, numerator=value.numerator, denominator=value.denominator, rate_per=100)
+    for key, value in measures_dict.items():
     
-    if key == "imd_rate":
-        df = redact_small_numbers(df, 5, value.numerator, value.denominator, 'rate')
+        if cube is not None:
+            df = measure_table(cube, value.group_by, value.numerator, value.denominator).sort_values(by='date')
+        else:
+            df = pd.read_csv(input_dir / f'measure_{value.id}.csv', parse_dates=['date']).sort_values(by='date')
+        df = drop_missing_demographics(df, value.group_by[0])
+
+        # if key == "ethnicity_rate":
+        #     df = convert_ethnicity(df)
+        
+        df = calculate_rate(df, numerator=value.numerator, denominator=value.denominator, rate_per=100)
     
-    elif key == "care_home_status_rate":
-        df = convert_binary(df, 'care_home_status', 'Record of positive care home status', 'No record of positive care home status')
+        if key == "care_home_status_rate":
+            df = convert_binary(df, 'care_home_status', 'Record of positive care home status', 'No record of positive care home status')
 
-    elif key =='learning_disability_rate':
-        df = convert_binary(df, 'learning_disability', 'Record of learning disability', 'No record of learning disability')
+        elif key =='learning_disability_rate':
+            df = convert_binary(df, 'learning_disability', 'Record of learning disability', 'No record of learning disability')
 
 
-    # get total population rate
-    if value.id=='ast_reg_practice_rate':
-        
-        df = drop_irrelevant_practices(df, 'practice')
-        df.to_csv(os.path.join(OUTPUT_DIR, f'rate_table_{value.group_by[0]}.csv'), index=False)
-
-        ast_decile = charts.deciles_chart(
-            df,
-            period_column='date',
-            column='value',
-            title=None,
-            ylabel=None,
-            show_outer_percentiles=False,
-            show_legend=True,
-        )
+        # get total population rate
+        if value.id=='ast_reg_practice_rate':
         
-        add_date_lines(ast_decile, vertical_lines)    
-        ast_decile.gcf().set_size_inches(15, 8)
-        ast_decile.gca().set_yticklabels(
-            ["{:.1f}%".format(x * 100) for x in ast_decile.gca().get_yticks()]
-        )
-   
-        ast_decile.savefig("output/decile_chart.png", bbox_inches="tight")
-
-        df_total = df.groupby(by='date')[[value.numerator, value.denominator]].sum().reset_index()
-
-        df_total = calculate_rate(df_total, numerator=value.numerator, denominator=value.denominator, rate_per=100)
-
-        plot_measures(
-            df_total, 
-            filename='plot_total.png', 
-            title=None, 
-            column_to_plot='rate', 
-            category=None, 
-            y_label=None,
-            vlines=vertical_lines
-            )
-       
-        df_total.to_csv(os.path.join(OUTPUT_DIR, 'rate_table_total.csv'), index=False)
-
-    # elif value.id=='event_code_rate':
-    #     df.to_csv(os.path.join(OUTPUT_DIR, f'rate_table_{value.group_by[0]}.csv'), index=False)
-    #     codelist = pd.read_csv(codelist_path)
-    #     child_code_table = create_child_table(df=df, code_df=codelist, code_column='code', term_column='term')
-    #     child_code_table.to_csv('output/child_code_table.csv', index=False)
-
-    else:
-        plot_measures(
-                df, 
-                filename=f'plot_{value.group_by[0]}.png', 
+            df, df_total, deciles_table = get_practice_tables(df, value.numerator, value.denominator)
+            df.to_csv(output_dir / f'rate_table_{value.group_by[0]}.csv', index=False)
+
+            # Percentiles are calculated once and the chart is drawn from the table
+            write_deciles_table(deciles_table, output_dir / 'deciles_table_practice.csv')
+            chart_jobs.append((write_deciles_chart, dict(
+                deciles_table=deciles_table,
+                path=output_dir / 'decile_chart.png',
+                date_lines=vertical_lines,
+                scale='proportion',
+                figsize=(15, 8),
+                )))
+
+            df_total = calculate_rate(df_total, numerator=value.numerator, denominator=value.denominator, rate_per=100)
+            df_total = redact_small_numbers(df_total, 5, value.numerator, value.denominator, 'rate')
+
+            chart_jobs.append((plot_measures, dict(
+                df=df_total, 
+                filename=output_dir / 'plot_total.png', 
                 title=None, 
                 column_to_plot='rate', 
-                category=value.group_by[0], 
+                category=None, 
                 y_label=None,
                 vlines=vertical_lines
-        )
+                )))
+       
+            df_total.to_csv(output_dir / 'rate_table_total.csv', index=False)
+
+        # elif value.id=='event_code_rate':
+        #     df.to_csv(os.path.join(OUTPUT_DIR, f'rate_table_{value.group_by[0]}.csv'), index=False)
+        #     codelist = pd.read_csv(codelist_path)
+        #     child_code_table = create_child_table(df=df, code_df=codelist, code_column='code', term_column='term')
+        #     child_code_table.to_csv('output/child_code_table.csv', index=False)
+
+        else:
+            df = redact_small_numbers(df, 5, value.numerator, value.denominator, ['rate', 'value'])
+
+            chart_jobs.append((plot_measures, dict(
+                    df=df, 
+                    filename=output_dir / f'plot_{value.group_by[0]}.png', 
+                    title=None, 
+                    column_to_plot='rate', 
+                    category=value.group_by[0], 
+                    y_label=None,
+                    vlines=vertical_lines
+            )))
         
-        df.to_csv(os.path.join(OUTPUT_DIR, f'rate_table_{value.group_by[0]}.csv'), index=False)
+            df.to_csv(output_dir / f'rate_table_{value.group_by[0]}.csv', index=False)
+
+    render_charts(chart_jobs)
+
+
+if __name__ == "__main__":
+    main()
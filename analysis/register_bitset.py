@@ -0,0 +1,356 @@
+"""
+Register membership across all months as packed bitsets.
+
+`asthma` and `population` membership are held as one packed bit vector of
+patients per month, so every month of every patient fits in a bit per flag:
+55 months of 30 million patients is about 200MB per flag.  Month-over-month
+flows onto and off the register are then bitwise operations on consecutive
+months, counted with popcounts, and a breakdown by a demographic group is a
+popcount against a packed mask of the group's patients.
+
+Flows hold unsuppressed counts, so they are as sensitive as the cohorts
+they were built from; `write_flows` suppresses small numbers.
+"""
+import argparse
+import pathlib
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from cohort_store import (
+    FORMATS,
+    get_cohort_columns,
+    list_index_dates,
+    read_cohort,
+)
+from measures_engine import SMALL_NUMBER_THRESHOLD
+
+BASE_DIR = pathlib.Path(__file__).parents[1]
+OUTPUT_DIR = BASE_DIR / "output"
+
+FLOW_COLUMNS = [
+    "on_register",
+    "entries",
+    "exits",
+    "left_population",
+    "persisted",
+    "churn",
+]
+
+
+class Membership(NamedTuple):
+    patient_ids: np.ndarray
+    dates: pd.DatetimeIndex
+    # Shape (months, ceil(patients / 8)); bit i of a month is patient i
+    asthma: np.ndarray
+    population: np.ndarray
+
+
+def _pack(flags):
+    return np.packbits(np.asarray(flags, dtype=bool), axis=-1)
+
+
+# Set bits of every byte, for numpy before 2.0, which has no bitwise_count
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+def _count(bits):
+    if hasattr(np, "bitwise_count"):
+        counts = np.bitwise_count(bits)
+    else:
+        counts = _POPCOUNT[bits]
+    return counts.sum(axis=-1, dtype=np.int64)
+
+
+def from_register(register):
+    """Builds a `Membership` from the output of
+    `register_engine.build_register`.
+
+    Patients without a `population` array are all in the population.
+    """
+    asthma = register["asthma"].astype(bool)
+    population = register.get("population")
+    if population is None:
+        population = np.ones_like(asthma)
+    return Membership(
+        np.asarray(register["patient_id"]),
+        pd.DatetimeIndex(register["index_date"]),
+        _pack(asthma.T),
+        _pack(np.asarray(population, dtype=bool).T),
+    )
+
+
+def from_cohorts(input_dir, input_format="csv"):
+    """Builds a `Membership` from the monthly cohorts.
+
+    The cohorts are read twice: once for the patient ids of every month and
+    once for the flags, so that only one month is held in memory at a time.
+    A patient is in the population in a month if they are in that month's
+    cohort (and their `population` flag is set, if the cohort has one).
+    """
+    index_dates = list_index_dates(input_dir, input_format)
+    patient_ids = np.array([], dtype=np.int64)
+    for index_date in index_dates:
+        cohort = read_cohort(input_dir, index_date, input_format, ["patient_id"])
+        patient_ids = np.union1d(patient_ids, cohort.patient_id.values)
+
+    shape = (len(index_dates), (len(patient_ids) + 7) // 8)
+    asthma = np.zeros(shape, dtype=np.uint8)
+    population = np.zeros(shape, dtype=np.uint8)
+    for month, index_date in enumerate(index_dates):
+        available = get_cohort_columns(input_dir, index_date, input_format)
+        columns = [
+            column
+            for column in ["patient_id", "asthma", "population"]
+            if column in available
+        ]
+        cohort = read_cohort(input_dir, index_date, input_format, columns)
+        position = np.searchsorted(patient_ids, cohort.patient_id.values)
+        in_population = np.zeros(len(patient_ids), dtype=bool)
+        in_population[position] = (
+            cohort.population.values.astype(bool)
+            if "population" in cohort.columns
+            else True
+        )
+        on_register = np.zeros(len(patient_ids), dtype=bool)
+        on_register[position] = cohort.asthma.values.astype(bool)
+        population[month] = _pack(in_population)
+        asthma[month] = _pack(on_register)
+    return Membership(patient_ids, index_dates, asthma, population)
+
+
+def get_group_masks(membership, groups):
+    """Packs a mask of the patients in each group.
+
+    Args:
+        membership: `Membership`
+        groups: series of group labels indexed by patient id; patients
+            without a label are in a missing group
+
+    Returns:
+        Tuple of (group labels, packed masks of shape (groups, bytes))
+    """
+    groups = groups[~groups.index.duplicated(keep="last")].sort_index()
+    position = np.searchsorted(groups.index.values, membership.patient_ids)
+    position = np.minimum(position, len(groups) - 1)
+    found = groups.index.values[position] == membership.patient_ids
+    labels = pd.Series(groups.values[position]).where(found)
+    codes, uniques = pd.factorize(labels, sort=True, use_na_sentinel=False)
+    masks = np.stack([_pack(codes == code) for code in range(len(uniques))])
+    return np.asarray(uniques), masks
+
+
+def get_flows(membership, groups=None):
+    """Counts the flows onto and off the register between consecutive
+    months.
+
+    For each month after the first:
+
+    * `on_register`: patients on the register
+    * `entries`: patients on the register who were not the month before
+    * `exits`: patients on the register the month before who are not now
+    * `left_population`: exits who also left the population, e.g. by
+      deregistering or dying, rather than leaving the register
+    * `persisted`: patients on the register in both months
+    * `churn`: entries plus exits
+
+    Args:
+        membership: `Membership`
+        groups: optional series of group labels indexed by patient id
+
+    Returns:
+        Dataframe with `date`, `group` if `groups` is given, and the flows
+    """
+    if groups is None:
+        labels = None
+        masks = np.full((1, membership.asthma.shape[1]), 0xFF, dtype=np.uint8)
+    else:
+        labels, masks = get_group_masks(membership, groups)
+
+    # One month at a time, so memory does not grow with the months
+    counts = {name: [] for name in FLOW_COLUMNS[:-1]}
+    for month in range(1, len(membership.dates)):
+        previous = membership.asthma[month - 1]
+        current = membership.asthma[month]
+        flows = {
+            "on_register": current,
+            "entries": current & ~previous,
+            "exits": previous & ~current,
+            "left_population": (
+                previous & ~current & ~membership.population[month]
+            ),
+            "persisted": previous & current,
+        }
+        for name, bits in flows.items():
+            counts[name].append(_count(bits & masks))
+
+    dates = membership.dates[1:]
+    table = pd.DataFrame(
+        {
+            name: np.concatenate(values) if values else []
+            for name, values in counts.items()
+        }
+    )
+    if labels is None:
+        table.insert(0, "date", dates)
+    else:
+        table.insert(0, "group", np.tile(labels, len(dates)))
+        table.insert(0, "date", np.repeat(dates, len(labels)))
+    table["churn"] = table.entries + table.exits
+    return table
+
+
+def get_suppressed(flows, n=SMALL_NUMBER_THRESHOLD):
+    """Gets the mask of flows to redact.
+
+    Counts between 1 and `n` are redacted.  The flows add up, so a redacted
+    count could be recovered from the others: for each month and group
+    `on_register = entries + persisted` and `churn = entries + exits`, and
+    between consecutive months the previous `on_register = persisted +
+    exits`.  Wherever only one count of such an identity is redacted, its
+    smallest other non-zero count is redacted too, until none is left
+    recoverable.
+
+    Args:
+        flows: dataframe returned by `get_flows`
+        n: threshold for small number suppression
+
+    Returns:
+        Boolean dataframe with the index of `flows` and `FLOW_COLUMNS`
+    """
+    counts = flows[FLOW_COLUMNS].to_numpy(dtype=float)
+    cells = np.arange(counts.size).reshape(counts.shape)
+    column = dict(zip(FLOW_COLUMNS, cells.T))
+
+    if "group" in flows.columns:
+        groups = pd.factorize(flows["group"], use_na_sentinel=False)[0]
+    else:
+        groups = np.zeros(len(flows), dtype=np.int64)
+    # Row of the same group in the month before
+    previous = pd.Series(np.arange(len(flows))).groupby(groups).shift(1)
+    has_previous = previous.notnull().to_numpy()
+    previous = previous[has_previous].to_numpy(dtype=np.int64)
+
+    # Cells of the total and the parts of each identity
+    identities = np.concatenate(
+        [
+            np.stack(
+                [column["on_register"], column["entries"], column["persisted"]],
+                axis=1,
+            ),
+            np.stack(
+                [column["churn"], column["entries"], column["exits"]], axis=1
+            ),
+            np.stack(
+                [
+                    column["on_register"][previous],
+                    column["persisted"][has_previous],
+                    column["exits"][has_previous],
+                ],
+                axis=1,
+            ),
+        ]
+    )
+
+    counts = counts.ravel()
+    suppressed = (counts > 0) & (counts <= n)
+    while True:
+        members = suppressed[identities]
+        recoverable = identities[members.sum(axis=1) == 1]
+        if not len(recoverable):
+            break
+        candidates = np.where(
+            suppressed[recoverable] | (counts[recoverable] == 0),
+            np.inf,
+            counts[recoverable],
+        )
+        chosen = candidates.argmin(axis=1)
+        suppressed[recoverable[np.arange(len(recoverable)), chosen]] = True
+    return pd.DataFrame(
+        suppressed.reshape(cells.shape), index=flows.index, columns=FLOW_COLUMNS
+    )
+
+
+def write_flows(flows, path):
+    """Writes the flows with small numbers suppressed, see
+    `get_suppressed`."""
+    flows = flows.copy()
+    flows[FLOW_COLUMNS] = flows[FLOW_COLUMNS].astype(float).mask(
+        get_suppressed(flows)
+    )
+    flows.to_csv(path, index=False)
+
+
+def write_membership(membership, path):
+    np.savez_compressed(
+        path,
+        patient_ids=membership.patient_ids,
+        dates=membership.dates.values.astype("datetime64[D]"),
+        asthma=membership.asthma,
+        population=membership.population,
+    )
+
+
+def read_membership(path):
+    with np.load(path) as data:
+        return Membership(
+            data["patient_ids"],
+            pd.DatetimeIndex(data["dates"]),
+            data["asthma"],
+            data["population"],
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input-dir",
+        default=OUTPUT_DIR / "joined",
+        type=pathlib.Path,
+        help="Directory holding the joined monthly cohorts",
+    )
+    parser.add_argument(
+        "--input-format",
+        default="csv",
+        choices=FORMATS,
+        help="Format of the monthly cohort files",
+    )
+    parser.add_argument(
+        "--group-by",
+        help="Cohort column to break the flows down by, as of the last month",
+    )
+    parser.add_argument(
+        "--output",
+        default=OUTPUT_DIR / "register_flows.csv",
+        type=pathlib.Path,
+        help="Path to write the flows to",
+    )
+    parser.add_argument(
+        "--membership",
+        type=pathlib.Path,
+        help="Optional path to write the membership bitsets to",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    membership = from_cohorts(args.input_dir, args.input_format)
+    if args.membership:
+        write_membership(membership, args.membership)
+
+    groups = None
+    if args.group_by:
+        cohort = read_cohort(
+            args.input_dir,
+            membership.dates[-1],
+            args.input_format,
+            ["patient_id", args.group_by],
+        )
+        groups = cohort.set_index("patient_id")[args.group_by]
+    write_flows(get_flows(membership, groups), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+"""
+Local AST005 register engine.
+
+Evaluates the asthma register variables from `dict_ast_variables` for every
+index date in a single sweep over the raw event tables (the `example-data/`
+schema), rather than re-running the study definition once per month.
+
+Each table is read once, events are sorted once per patient and every
+(patient, month) query is answered with a vectorised binary search against
+the sorted events.  The demographic variables from
+`dict_demographic_variables` and the study population are evaluated the
+same way, with registrations, addresses and deaths resolved by the as-of
+joins in `asof_join`.
+"""
+import argparse
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from asof_join import build_spell_index, spells_as_of
+from codelist_compiler import is_in, load_codelist
+from cohort_store import FORMATS, write_cohort
+from config import start_date, end_date
+from utilities import events_in_windows
+
+BASE_DIR = pathlib.Path(__file__).parents[1]
+
+# Day numbers are counted from this date so that they stay positive and -1
+# can mark a missing date
+DAY_ZERO = np.datetime64("1800-01-01", "D")
+
+REGISTER_VARIABLES = [
+    "had_asthma",
+    "had_asthma_drug_treatment",
+    "latest_asthma_diag_date",
+    "had_asthma_resolve",
+    "age_ast_reg",
+    "asthma",
+]
+
+DEMOGRAPHIC_VARIABLES = [
+    "gms_reg_status",
+    "died",
+    "age",
+    "age_band",
+    "sex",
+    "imd",
+    "region",
+    "practice",
+    "learning_disability",
+    "care_home",
+]
+
+SEX_CODES = {"male": "M", "female": "F", "intersex": "I", "unknown": "U"}
+
+# Lower bounds of the age bands; ages outside them are "missing"
+AGE_BAND_BOUNDS = [6, 20, 30, 40, 50, 60, 70, 80, 121]
+AGE_BANDS = np.array(
+    [
+        "missing",
+        "6-19",
+        "20-29",
+        "30-39",
+        "40-49",
+        "50-59",
+        "60-69",
+        "70-79",
+        "80+",
+        "missing",
+    ],
+    dtype=object,
+)
+
+# Lower bounds of IMD quintiles 2 to 5, out of 32,844 LSOAs
+IMD_BOUNDS = [32844 * quintile / 5 for quintile in range(1, 5)]
+IMD_QUINTILES = np.array(["1", "2", "3", "4", "5"], dtype=object)
+
+
+def get_index_dates(start=start_date, end=end_date):
+    """Gets the monthly index dates used by `--index-date-range ... by month`.
+
+    Args:
+        start: first index date
+        end: last date of the range
+
+    Returns:
+        DatetimeIndex of the first day of every month in the range
+    """
+    return pd.date_range(start, end, freq="MS")
+
+
+def to_day_numbers(dates):
+    """Converts dates to integer day numbers counted from DAY_ZERO.
+
+    Missing dates are returned as -1.
+    """
+    dates = pd.to_datetime(pd.Series(dates)).values.astype("datetime64[D]")
+    days = (dates - DAY_ZERO).astype(np.int64)
+    days[np.isnat(dates)] = -1
+    return days
+
+
+def from_day_numbers(days):
+    """Converts day numbers from `to_day_numbers` back to datetime64, with
+    -1 mapped to NaT."""
+    dates = DAY_ZERO + days.astype("timedelta64[D]")
+    return np.where(days < 0, np.datetime64("NaT"), dates)
+
+
+def load_tables(input_dir):
+    """Reads the raw event tables needed by the register engine once.
+
+    Args:
+        input_dir: directory holding tables in the `example-data/` schema
+
+    Returns:
+        Dictionary of table name to dataframe
+    """
+    input_dir = pathlib.Path(input_dir)
+    return {
+        "patients": pd.read_csv(
+            input_dir / "patients.csv",
+            usecols=["patient_id", "date_of_birth", "sex"],
+        ),
+        "clinical_events": pd.read_csv(
+            input_dir / "clinical_events.csv",
+            usecols=["patient_id", "date", "snomedct_code"],
+            # Read as strings, as a column with a missing code would otherwise
+            # be read as floats, which cannot hold 18 digit codes exactly
+            dtype={"snomedct_code": str},
+        ),
+        "medications": pd.read_csv(
+            input_dir / "medications.csv",
+            usecols=["patient_id", "date", "dmd_code"],
+            dtype={"dmd_code": str},
+        ),
+        "practice_registrations": pd.read_csv(
+            input_dir / "practice_registrations.csv",
+            usecols=[
+                "patient_id",
+                "start_date",
+                "end_date",
+                "practice_pseudo_id",
+                "practice_nuts1_region_name",
+            ],
+        ),
+        "addresses": pd.read_csv(
+            input_dir / "addresses.csv",
+            usecols=["patient_id", "start_date", "end_date", "imd_rounded"],
+        ),
+        "ons_deaths": pd.read_csv(
+            input_dir / "ons_deaths.csv",
+            usecols=["patient_id", "date"],
+        ),
+    }
+
+
+def build_event_index(events, patient_ids, code_column, codelist):
+    """Sorts the events matching a codelist by (patient, date) once.
+
+    Args:
+        events: event table with `patient_id`, `date` and code columns
+        patient_ids: sorted array of all patient ids
+        code_column: name of the column holding the event code
+        codelist: name of the codelist in `codelist_specs.CODELISTS`
+
+    Returns:
+        Tuple of (day numbers, offsets) where patient i's sorted event days
+        are days[offsets[i]:offsets[i + 1]]
+    """
+    matched = events[
+        is_in(events[code_column].values, load_codelist(codelist))
+        & np.isin(events.patient_id.values, patient_ids)
+    ]
+    patient_index = np.searchsorted(patient_ids, matched.patient_id.values)
+    days = to_day_numbers(matched.date)
+    order = np.lexsort((days, patient_index))
+    offsets = np.searchsorted(
+        patient_index[order], np.arange(len(patient_ids) + 1)
+    )
+    return days[order], offsets
+
+
+def last_event(days, offsets):
+    """Gets each patient's last event day, or -1 if they have no events."""
+    if not len(days):
+        return np.full(len(offsets) - 1, -1)
+    has_events = offsets[1:] > offsets[:-1]
+    return np.where(has_events, days[np.maximum(offsets[1:] - 1, 0)], -1)
+
+
+def age_on(date_of_birth, days):
+    """Vectorised equivalent of `patients.age_as_of` for every (patient, day).
+
+    Args:
+        date_of_birth: datetime64 array of dates of birth, one per patient
+        days: day numbers at which to calculate age
+
+    Returns:
+        Integer array of ages, shape (patients, days)
+    """
+    dob = pd.DatetimeIndex(date_of_birth)
+    on = pd.DatetimeIndex(from_day_numbers(days))
+    age = on.year.values[None, :] - dob.year.values[:, None]
+    before_birthday = (on.month.values[None, :] * 100 + on.day.values[None, :]) < (
+        dob.month.values[:, None] * 100 + dob.day.values[:, None]
+    )
+    return age - before_birthday
+
+
+def get_age_bands(age):
+    """Vectorised equivalent of the `age_band` variable."""
+    return AGE_BANDS[np.digitize(age, AGE_BAND_BOUNDS)]
+
+
+def get_imd_quintiles(imd):
+    """Vectorised equivalent of the `imd` variable: the quintile of the
+    IMD rank rounded to the nearest 100, or "missing"."""
+    imd = np.round(np.asarray(imd, dtype=float) / 100) * 100
+    quintiles = IMD_QUINTILES[np.digitize(np.nan_to_num(imd), IMD_BOUNDS)]
+    return np.where(np.isnan(imd) | (imd < 0), "missing", quintiles)
+
+
+def build_demographics(tables, patient_ids, month_ends, age):
+    """Evaluates the demographic variables for every patient and month.
+
+    Registrations, addresses and deaths are each sorted once, and every
+    `..._as_of("last_day_of_month(index_date)")` is one as-of join for all
+    months.
+
+    Args:
+        tables: tables returned by `load_tables`
+        patient_ids: sorted array of all patient ids
+        month_ends: day numbers of the last day of each month
+        age: ages at the day after each month end, shape (patients, months)
+
+    Returns:
+        Dictionary of variable to array of shape (patients, months), except
+        `sex`, which has one value per patient
+    """
+    registrations = tables["practice_registrations"]
+    registration_rows = spells_as_of(
+        build_spell_index(
+            registrations.patient_id.values,
+            to_day_numbers(registrations.start_date),
+            to_day_numbers(registrations.end_date),
+            patient_ids,
+        ),
+        month_ends,
+    )
+    registered = registration_rows >= 0
+    registration_rows = np.maximum(registration_rows, 0)
+    practice = np.where(
+        registered,
+        registrations.practice_pseudo_id.values[registration_rows],
+        0,
+    )
+    region = np.where(
+        registered,
+        registrations.practice_nuts1_region_name.fillna("").values.astype(
+            object
+        )[registration_rows],
+        "",
+    )
+
+    addresses = tables["addresses"]
+    address_rows = spells_as_of(
+        build_spell_index(
+            addresses.patient_id.values,
+            to_day_numbers(addresses.start_date),
+            to_day_numbers(addresses.end_date),
+            patient_ids,
+        ),
+        month_ends,
+    )
+    imd = np.where(
+        address_rows >= 0,
+        addresses.imd_rounded.values.astype(float)[np.maximum(address_rows, 0)],
+        np.nan,
+    )
+
+    deaths = tables["ons_deaths"]
+    died = (
+        spells_as_of(
+            build_spell_index(
+                deaths.patient_id.values,
+                to_day_numbers(deaths.date),
+                None,
+                patient_ids,
+            ),
+            # `on_or_before` the month end
+            month_ends,
+        )
+        >= 0
+    )
+
+    sex = (
+        tables["patients"]
+        .sort_values("patient_id")
+        .sex.map(SEX_CODES)
+        .fillna("")
+        .values.astype(object)
+    )
+
+    flags = {}
+    for variable, codelist in [
+        ("learning_disability", "learning_disability_codes"),
+        ("care_home", "nhse_care_homes_codes"),
+    ]:
+        days, offsets = build_event_index(
+            tables["clinical_events"], patient_ids, "snomedct_code", codelist
+        )
+        flags[variable] = events_in_windows(days, offsets, month_ends)["exists"]
+
+    return {
+        "gms_reg_status": registered.astype(np.int8),
+        "died": died.astype(np.int8),
+        "age": age,
+        "age_band": get_age_bands(age),
+        "sex": sex,
+        "imd": get_imd_quintiles(imd),
+        "region": region,
+        "practice": practice,
+        "learning_disability": flags["learning_disability"].astype(np.int8),
+        "care_home": flags["care_home"].astype(np.int8),
+    }
+
+
+def get_population(demographics):
+    """Evaluates the study population of `study_definition_ast_reg`."""
+    sex = demographics["sex"][:, None]
+    return (
+        (demographics["died"] == 0)
+        & ((sex == "M") | (sex == "F"))
+        & (demographics["age_band"] != "missing")
+        & (demographics["gms_reg_status"] == 1)
+        & (demographics["age"] >= 6)
+    )
+
+
+def build_register(tables, index_dates):
+    """Evaluates the asthma register variables for every patient and month.
+
+    Args:
+        tables: tables returned by `load_tables`
+        index_dates: index dates to evaluate
+
+    Returns:
+        Dictionary with `patient_id`, `index_date`, one array of shape
+        (patients, index dates) per register and demographic variable (one
+        value per patient for `sex`), and the `population`
+    """
+    patients = tables["patients"].sort_values("patient_id")
+    patient_ids = patients.patient_id.values
+
+    index_dates = pd.DatetimeIndex(index_dates)
+    month_ends = to_day_numbers(index_dates + pd.offsets.MonthEnd(0))
+
+    ast_days, ast_offsets = build_event_index(
+        tables["clinical_events"], patient_ids, "snomedct_code", "ast_cod"
+    )
+    trt_days, trt_offsets = build_event_index(
+        tables["medications"], patient_ids, "dmd_code", "asttrt_cod"
+    )
+    res_days, res_offsets = build_event_index(
+        tables["clinical_events"], patient_ids, "snomedct_code", "astres_cod"
+    )
+
+    ast = events_in_windows(ast_days, ast_offsets, month_ends)
+    had_asthma = ast["exists"]
+    latest_diag = ast["last"]
+
+    trt = events_in_windows(trt_days, trt_offsets, month_ends, window_days=365)
+    had_asthma_drug_treatment = trt["exists"]
+
+    # `on_or_after="latest_asthma_diag_date"` has no upper bound, so only the
+    # patient's last resolved code matters
+    res_last = last_event(res_days, res_offsets)
+    had_asthma_resolve = had_asthma & (res_last[:, None] >= latest_diag)
+
+    # Age at the end of the month, plus one day
+    age_ast_reg = age_on(patients.date_of_birth.values, month_ends + 1)
+
+    asthma = (
+        had_asthma
+        & had_asthma_drug_treatment
+        & ~had_asthma_resolve
+        & (age_ast_reg >= 6)
+    )
+
+    demographics = build_demographics(tables, patient_ids, month_ends, age_ast_reg)
+
+    return {
+        "patient_id": patient_ids,
+        "index_date": index_dates,
+        "population": get_population(demographics),
+        **demographics,
+        "had_asthma": had_asthma.astype(np.int8),
+        "had_asthma_drug_treatment": had_asthma_drug_treatment.astype(np.int8),
+        "latest_asthma_diag_date": latest_diag,
+        "had_asthma_resolve": had_asthma_resolve.astype(np.int8),
+        "age_ast_reg": age_ast_reg,
+        "asthma": asthma.astype(np.int8),
+    }
+
+
+def get_monthly_tables(register):
+    """Splits the output of `build_register` into one table per index date,
+    holding the patients in that month's population, as the cohorts written
+    by cohortextractor do.
+
+    Yields:
+        Tuples of (index date, patient-level dataframe)
+    """
+    for month, index_date in enumerate(register["index_date"]):
+        in_population = register["population"][:, month]
+        table = pd.DataFrame(
+            {"patient_id": register["patient_id"][in_population]}
+        )
+        for variable in [*REGISTER_VARIABLES, *DEMOGRAPHIC_VARIABLES]:
+            values = register[variable]
+            if values.ndim == 2:
+                values = values[:, month]
+            table[variable] = values[in_population]
+        table["latest_asthma_diag_date"] = pd.to_datetime(
+            from_day_numbers(table["latest_asthma_diag_date"].values)
+        ).strftime("%Y-%m-%d")
+        yield index_date, table
+
+
+def write_monthly_tables(register, output_dir, output_format="csv"):
+    for index_date, table in get_monthly_tables(register):
+        write_cohort(table, output_dir, index_date, output_format)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input-dir",
+        default=BASE_DIR / "example-data",
+        type=pathlib.Path,
+        help="Directory holding the raw event tables",
+    )
+    parser.add_argument(
+        "--output-dir",
+        required=True,
+        type=pathlib.Path,
+        help="Path to the output directory",
+    )
+    parser.add_argument(
+        "--start-date",
+        default=start_date,
+        help="First index date",
+    )
+    parser.add_argument(
+        "--end-date",
+        default=end_date,
+        help="Last date of the index date range",
+    )
+    parser.add_argument(
+        "--output-format",
+        default="csv",
+        choices=FORMATS,
+        help="Write CSV files, or columnar files partitioned by index date",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    tables = load_tables(args.input_dir)
+    index_dates = get_index_dates(args.start_date, args.end_date)
+    register = build_register(tables, index_dates)
+    write_monthly_tables(register, args.output_dir, args.output_format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Renders charts in parallel.
+
+Each chart is a job: a module-level function and its keyword arguments.  The
+function draws the chart and writes it with `save_figure`.  Jobs run in a
+process pool using the non-interactive Agg backend, so every worker has its
+own pyplot state, and any figures a job leaves open are closed before the
+next job starts.
+"""
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+
+
+def save_figure(figure, path, **kwargs):
+    """Saves a figure (or the pyplot module) without leaving a partly
+    written file at `path` if rendering fails.
+
+    The chart is written to a temporary file in the same directory and then
+    moved into place.
+    """
+    path = pathlib.Path(path)
+    tmp_path = path.with_name(f".{path.stem}.tmp{path.suffix}")
+    figure.savefig(tmp_path, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def _init_worker():
+    import matplotlib
+
+    matplotlib.use("Agg", force=True)
+
+
+def _run_job(function, kwargs):
+    import matplotlib.pyplot as plt
+
+    try:
+        return function(**kwargs)
+    finally:
+        plt.close("all")
+
+
+def render_charts(jobs, processes=None):
+    """Runs chart jobs, one per process.
+
+    Args:
+        jobs: list of (function, kwargs) tuples
+        processes: number of worker processes; defaults to the number of
+            cores, and 1 renders in this process
+
+    Returns:
+        List of the values returned by each job, in order
+    """
+    if processes == 1 or len(jobs) <= 1:
+        _init_worker()
+        return [_run_job(function, kwargs) for function, kwargs in jobs]
+
+    processes = min(processes or os.cpu_count() or 1, len(jobs))
+    with ProcessPoolExecutor(
+        max_workers=processes, initializer=_init_worker
+    ) as executor:
+        futures = [
+            executor.submit(_run_job, function, kwargs)
+            for function, kwargs in jobs
+        ]
+        return [future.result() for future in futures]
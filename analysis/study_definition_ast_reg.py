@@ -18,6 +18,8 @@ from codelists_ast import ast_cod, asttrt_cod, astres_cod
 from dict_ast_variables import ast_reg_variables
 from dict_demographic_variables import demographic_variables
 
+import measure_registry
+
 
 study = StudyDefinition(
     index_date=start_date,
@@ -45,69 +47,5 @@ study = StudyDefinition(
     **demographic_variables,
 )
 
-# Create default measures
-measures = [
-    Measure(
-        id="ast_reg_total_rate",
-        numerator="asthma",
-        denominator="population",
-        group_by=["population"],
-        small_number_suppression=True,
-    ),
-    Measure(
-        id="ast_reg_practice_rate",
-        numerator="asthma",
-        denominator="population",
-        group_by=["practice"],
-        small_number_suppression=True,
-    ),
-    Measure(
-        id="ast_reg_age_band_rate",
-        numerator="asthma",
-        denominator="population",
-        group_by=["age_band"],
-        small_number_suppression=True,
-    ),
-    Measure(
-        id="ast_reg_sex_rate",
-        numerator="asthma",
-        denominator="population",
-        group_by=["sex"],
-        small_number_suppression=True,
-    ),
-    Measure(
-        id="ast_reg_imd_rate",
-        numerator="asthma",
-        denominator="population",
-        group_by=["imd"],
-        small_number_suppression=True,
-    ),
-    Measure(
-        id="ast_reg_region_rate",
-        numerator="asthma",
-        denominator="population",
-        group_by=["region"],
-        small_number_suppression=True,
-    ),
-    Measure(
-        id="ast_reg_ethnicity_rate",
-        numerator="asthma",
-        denominator="population",
-        group_by=["ethnicity"],
-        small_number_suppression=True,
-    ),
-    Measure(
-        id="ast_reg_learning_disability_rate",
-        numerator="asthma",
-        denominator="population",
-        group_by=["learning_disability"],
-        small_number_suppression=True,
-    ),
-    Measure(
-        id="ast_reg_care_home_rate",
-        numerator="asthma",
-        denominator="population",
-        group_by=["care_home"],
-        small_number_suppression=True,
-    ),
-]
+# Create default measures from the measure registry
+measures = [Measure(**spec._asdict()) for spec in measure_registry.measures]
@@ -0,0 +1,577 @@
+"""
+Synthetic data generator.
+
+Reads the `return_expectations` of the variables in the study definitions
+without importing cohortextractor (the files are parsed, not run) and
+generates, with vectorised numpy sampling:
+
+* the monthly `input_ast_reg_YYYY-MM-DD` cohorts for any number of patients
+  and index dates, with `population` and `asthma` evaluated from their
+  `patients.satisfying` expressions,
+* `input_ethnicity.csv`, and
+* optionally, event-level tables in the `example-data/` schema, for the
+  register engine.
+
+Like cohortextractor's dummy data, each variable is sampled independently
+from its expectations, so the data has a realistic size and shape but not
+realistic relationships between variables.
+"""
+import argparse
+import ast
+import pathlib
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from codelist_compiler import load_codelist
+from codelist_specs import CODELISTS
+from cohort_store import FORMATS, write_cohort
+from config import start_date, end_date
+from register_engine import get_index_dates
+
+BASE_DIR = pathlib.Path(__file__).parents[1]
+ANALYSIS_DIR = BASE_DIR / "analysis"
+
+STUDY_DEFINITION_FILES = [
+    ANALYSIS_DIR / "study_definition_ast_reg.py",
+    ANALYSIS_DIR / "dict_ast_variables.py",
+    ANALYSIS_DIR / "dict_demographic_variables.py",
+]
+ETHNICITY_STUDY_DEFINITION_FILE = ANALYSIS_DIR / "study_definition_ethnicity.py"
+
+# Names the study definitions use in their expectations
+CONFIG_NAMES = {"start_date": start_date, "end_date": end_date}
+
+# Approximate share of the population in each age range, used for the
+# `population_ages` distribution
+POPULATION_AGES = [
+    (0, 20, 0.23),
+    (20, 40, 0.26),
+    (40, 60, 0.27),
+    (60, 80, 0.19),
+    (80, 105, 0.05),
+]
+
+BINARY_FUNCTIONS = ["registered_as_of", "died_from_any_cause"]
+
+
+class Variable(NamedTuple):
+    function: str
+    returning: str
+    expectations: dict
+    # Expression of `satisfying` variables
+    expression: str = None
+    # Category used by `categorised_as` when no other category matches
+    default_category: str = None
+    # Name of the codelist of event variables
+    codelist: str = None
+
+
+class _ReplaceNames(ast.NodeTransformer):
+    def __init__(self, names):
+        self.names = names
+
+    def visit_Name(self, node):
+        if node.id in self.names:
+            return ast.Constant(self.names[node.id])
+        return node
+
+
+def _literal(node, names=CONFIG_NAMES):
+    return ast.literal_eval(_ReplaceNames(names).visit(node))
+
+
+def _is_patients_call(node):
+    return (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Attribute)
+        and isinstance(node.func.value, ast.Name)
+        and node.func.value.id == "patients"
+    )
+
+
+def _parse_variable(call):
+    function = call.func.attr
+    keywords = {keyword.arg: keyword.value for keyword in call.keywords}
+    returning = (
+        _literal(keywords["returning"]) if "returning" in keywords else None
+    )
+    if returning is None and function in BINARY_FUNCTIONS:
+        returning = "binary_flag"
+    expectations = (
+        _literal(keywords["return_expectations"])
+        if "return_expectations" in keywords
+        else {}
+    )
+    expression = default_category = codelist = None
+    if function == "satisfying":
+        expression = _literal(call.args[0])
+    elif function == "categorised_as":
+        categories = _literal(call.args[0])
+        default_category = next(
+            (key for key, value in categories.items() if value == "DEFAULT"), None
+        )
+    elif call.args and isinstance(call.args[0], ast.Name):
+        codelist = call.args[0].id
+    return Variable(
+        function, returning, expectations, expression, default_category, codelist
+    )
+
+
+def parse_study_definition(paths):
+    """Parses the variables and default expectations of study definition
+    files.
+
+    Returns:
+        Tuple of (dictionary of variable name to `Variable`, default
+        expectations)
+    """
+    variables = {}
+    default_expectations = {}
+    for path in paths:
+        tree = ast.parse(pathlib.Path(path).read_text())
+        for node in ast.walk(tree):
+            if not (
+                isinstance(node, ast.Call)
+                and isinstance(node.func, ast.Name)
+                and node.func.id in ("dict", "StudyDefinition")
+            ):
+                continue
+            for keyword in node.keywords:
+                if keyword.arg == "default_expectations":
+                    default_expectations = _literal(keyword.value)
+                elif keyword.arg is not None and _is_patients_call(keyword.value):
+                    variables[keyword.arg] = _parse_variable(keyword.value)
+    return variables, default_expectations
+
+
+def _get_date_range(expectations):
+    date = expectations.get("date", {})
+    earliest, latest = (
+        pd.Timestamp("today" if value == "today" else value).normalize()
+        for value in (date.get("earliest", start_date), date.get("latest", end_date))
+    )
+    return earliest, latest
+
+
+def _sample_categories(rng, ratios, n):
+    """Samples category codes in proportion to `ratios`.
+
+    Returns:
+        Tuple of (codes, categories)
+    """
+    categories = list(ratios.keys())
+    weights = np.cumsum(list(ratios.values()), dtype=float)
+    codes = np.searchsorted(weights / weights[-1], rng.random(n), side="right")
+    return np.minimum(codes, len(categories) - 1), categories
+
+
+def sample_ages(rng, n):
+    bands = np.array([band[:2] for band in POPULATION_AGES])
+    weights = np.array([band[2] for band in POPULATION_AGES])
+    band = np.searchsorted(np.cumsum(weights / weights.sum()), rng.random(n))
+    band = np.minimum(band, len(bands) - 1)
+    return rng.integers(bands[band, 0], bands[band, 1])
+
+
+def sample_dates(rng, n, earliest, latest):
+    """Samples dates uniformly, returned as datetime64[D]."""
+    earliest = np.datetime64(earliest.date(), "D")
+    span = (np.datetime64(latest.date(), "D") - earliest).astype(int) + 1
+    return earliest + rng.integers(0, span, n)
+
+
+def sample_variable(rng, variable, n, default_expectations):
+    """Samples one variable for `n` patients from its expectations."""
+    expectations = {**default_expectations, **variable.expectations}
+    if expectations.get("rate") == "universal":
+        incidence = 1.0
+    else:
+        incidence = expectations.get("incidence", 1.0)
+    present = rng.random(n) < incidence
+
+    if variable.returning == "binary_flag":
+        return present.astype(np.int8)
+    if variable.returning == "date":
+        dates = sample_dates(rng, n, *_get_date_range(expectations))
+        return np.where(present, dates, np.datetime64("NaT"))
+    if "category" in expectations:
+        codes, categories = _sample_categories(
+            rng, expectations["category"]["ratios"], n
+        )
+        if variable.default_category is None:
+            missing = -1
+        elif variable.default_category in categories:
+            missing = categories.index(variable.default_category)
+        else:
+            missing = len(categories)
+            categories = [*categories, variable.default_category]
+        return pd.Categorical.from_codes(
+            np.where(present, codes, missing), categories
+        )
+    if "int" in expectations:
+        distribution = expectations["int"]
+        if distribution["distribution"] == "population_ages":
+            values = sample_ages(rng, n)
+        else:
+            values = np.maximum(
+                np.rint(
+                    rng.normal(distribution["mean"], distribution["stddev"], n)
+                ),
+                0,
+            ).astype(np.int64)
+        return np.where(present, values, 0)
+    return present.astype(np.int8)
+
+
+def _to_pandas_expression(expression):
+    lines = [line.split("#", 1)[0] for line in expression.splitlines()]
+    expression = " ".join(lines)
+    expression = re.sub(r"(?<![<>!=])=(?!=)", "==", expression)
+    for keyword in ("AND", "OR", "NOT"):
+        expression = re.sub(rf"\b{keyword}\b", keyword.lower(), expression)
+    return expression
+
+
+def evaluate_expression(expression, columns, variables):
+    """Evaluates a `patients.satisfying` expression over sampled columns."""
+    local_dict = {
+        name: pd.Series(
+            values.astype(bool)
+            if variables[name].returning == "binary_flag"
+            else values
+        )
+        for name, values in columns.items()
+    }
+    return (
+        pd.eval(_to_pandas_expression(expression), local_dict=local_dict)
+        .astype(np.int8)
+        .values
+    )
+
+
+def sample_cohort(
+    rng, variables, n, default_expectations, patient_ids=None, practices=None
+):
+    """Samples every variable for `n` patients, keeping those in the
+    population.
+
+    Args:
+        practices: optional number of practices to spread patients over
+            uniformly, instead of following the expectations of `practice`
+
+    Returns:
+        Patient-level dataframe
+    """
+    columns = {}
+    for name, variable in variables.items():
+        if variable.expression is None:
+            columns[name] = sample_variable(rng, variable, n, default_expectations)
+    if practices is not None and "practice" in columns:
+        columns["practice"] = rng.integers(1, practices + 1, n)
+    for name, variable in variables.items():
+        if variable.expression is not None:
+            columns[name] = evaluate_expression(
+                variable.expression, columns, variables
+            )
+    table = pd.DataFrame(
+        {
+            "patient_id": (
+                np.arange(1, n + 1) if patient_ids is None else patient_ids
+            ),
+            **columns,
+        }
+    )
+    if "population" in table.columns:
+        table = table[table.pop("population").astype(bool)]
+    return table.reset_index(drop=True)
+
+
+def _write_month(
+    index_date,
+    n,
+    output_dir,
+    output_format,
+    seed,
+    practices,
+    variables,
+    default_expectations,
+):
+    rng = np.random.default_rng([seed, pd.Timestamp(index_date).toordinal()])
+    cohort = sample_cohort(
+        rng, variables, n, default_expectations, practices=practices
+    )
+    write_cohort(cohort, output_dir, index_date, output_format)
+    return index_date
+
+
+def generate_cohorts(
+    n,
+    index_dates,
+    output_dir,
+    output_format="csv",
+    seed=0,
+    processes=None,
+    practices=None,
+):
+    """Writes a synthetic monthly cohort of `n` patients for each index
+    date, one month per process."""
+    variables, default_expectations = parse_study_definition(
+        STUDY_DEFINITION_FILES
+    )
+    arguments = (
+        n,
+        output_dir,
+        output_format,
+        seed,
+        practices,
+        variables,
+        default_expectations,
+    )
+    if processes == 1:
+        for index_date in index_dates:
+            _write_month(index_date, *arguments)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [
+            executor.submit(_write_month, index_date, *arguments)
+            for index_date in index_dates
+        ]
+        for future in futures:
+            future.result()
+
+
+def generate_ethnicity(n, output_dir, seed=0):
+    """Writes a synthetic `input_ethnicity.csv` for `n` patients."""
+    variables, default_expectations = parse_study_definition(
+        [ETHNICITY_STUDY_DEFINITION_FILE]
+    )
+    rng = np.random.default_rng([seed, 0])
+    table = sample_cohort(rng, variables, n, default_expectations)
+    path = pathlib.Path(output_dir) / "input_ethnicity.csv"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(path, index=False)
+    return path
+
+
+def _sample_events(rng, patient_ids, incidence, earliest, latest, codes, mean=1.0):
+    """Samples events for a share of patients from a codelist."""
+    has_events = rng.random(len(patient_ids)) < incidence
+    counts = np.where(has_events, 1 + rng.poisson(mean, len(patient_ids)), 0)
+    ids = np.repeat(patient_ids, counts)
+    return pd.DataFrame(
+        {
+            "patient_id": ids,
+            "date": sample_dates(rng, len(ids), earliest, latest),
+            "code": codes[rng.integers(0, len(codes), len(ids))],
+        }
+    )
+
+
+def generate_event_tables(n, output_dir, seed=0, practices=None):
+    """Writes event-level tables in the `example-data/` schema for `n`
+    patients.
+
+    Events are sampled for the binary event variables of the study
+    definition, from their codelists, for the share of patients given by
+    their `incidence`.
+
+    Args:
+        n: number of patients
+        output_dir: directory to write the tables to
+        seed: random seed
+        practices: optional number of practices; by default practice ids
+            span the expectations of the `practice` variable
+    """
+    output_dir = pathlib.Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    variables, default_expectations = parse_study_definition(
+        STUDY_DEFINITION_FILES
+    )
+    earliest, latest = _get_date_range(default_expectations)
+    rng = np.random.default_rng([seed, 1])
+    patient_ids = np.arange(1, n + 1)
+
+    # Patients
+    ages = sample_ages(rng, n)
+    date_of_birth = (
+        np.datetime64(latest.date(), "D")
+        - ages * 365
+        - rng.integers(0, 365, n)
+    ).astype("datetime64[M]").astype("datetime64[D]")
+    codes, categories = _sample_categories(
+        rng, variables["sex"].expectations["category"]["ratios"], n
+    )
+    sex = np.asarray(categories)[codes]
+    died = rng.random(n) < variables["died"].expectations["incidence"]
+    date_of_death = np.where(
+        died, np.datetime_as_string(sample_dates(rng, n, earliest, latest)), ""
+    )
+    pd.DataFrame(
+        {
+            "patient_id": patient_ids,
+            "date_of_birth": date_of_birth,
+            "sex": np.where(sex == "M", "male", "female"),
+            "date_of_death": date_of_death,
+        }
+    ).to_csv(output_dir / "patients.csv", index=False)
+    pd.DataFrame(
+        {
+            "patient_id": patient_ids[died],
+            "date": date_of_death[died],
+            "place": "Home",
+            "cause_of_death_01": "I21.0",
+        }
+    ).to_csv(output_dir / "ons_deaths.csv", index=False)
+
+    # Registrations and addresses, one of each per patient
+    if practices is None:
+        # Every patient is registered, so patients are spread uniformly over
+        # the range of the expected practice ids
+        distribution = variables["practice"].expectations["int"]
+        practices = int(distribution["mean"] + 3 * distribution["stddev"])
+    practice_ids = rng.integers(1, practices + 1, n)
+    codes, categories = _sample_categories(
+        rng,
+        variables["region"].expectations["category"]["ratios"],
+        practice_ids.max() + 1,
+    )
+    practice_regions = np.asarray(categories)[codes]
+    registration_start = np.datetime64(earliest.date(), "D") - rng.integers(
+        0, 365 * 20, n
+    )
+    pd.DataFrame(
+        {
+            "patient_id": patient_ids,
+            "start_date": registration_start,
+            "end_date": "",
+            "practice_pseudo_id": practice_ids,
+            "practice_stp": "E54000009",
+            "practice_nuts1_region_name": practice_regions[practice_ids],
+        }
+    ).to_csv(output_dir / "practice_registrations.csv", index=False)
+    pd.DataFrame(
+        {
+            "patient_id": patient_ids,
+            "address_id": patient_ids + 1000,
+            "start_date": registration_start,
+            "end_date": "",
+            "rural_urban_classification": rng.integers(1, 9, n),
+            "imd_rounded": rng.integers(0, 329, n) * 100,
+            "msoa_code": "E02000001",
+        }
+    ).to_csv(output_dir / "addresses.csv", index=False)
+
+    # Events
+    tables = {"with_these_clinical_events": [], "with_these_medications": []}
+    for variable in variables.values():
+        if (
+            variable.function in tables
+            and variable.returning == "binary_flag"
+            and variable.codelist in CODELISTS
+        ):
+            codes = load_codelist(variable.codelist).codes
+            tables[variable.function].append(
+                _sample_events(
+                    rng,
+                    patient_ids,
+                    variable.expectations.get("incidence", 1.0),
+                    earliest,
+                    latest,
+                    codes,
+                )
+            )
+    clinical_events = pd.concat(tables["with_these_clinical_events"])
+    clinical_events = clinical_events.rename(columns={"code": "snomedct_code"})
+    clinical_events["ctv3_code"] = ""
+    clinical_events["numeric_value"] = ""
+    clinical_events.sort_values(["patient_id", "date"], kind="stable").to_csv(
+        output_dir / "clinical_events.csv", index=False
+    )
+    medications = pd.concat(tables["with_these_medications"])
+    medications = medications.rename(columns={"code": "dmd_code"})
+    medications.sort_values(["patient_id", "date"], kind="stable").to_csv(
+        output_dir / "medications.csv", index=False
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--patients",
+        default=1000,
+        type=int,
+        help="Number of patients",
+    )
+    parser.add_argument(
+        "--output-dir",
+        required=True,
+        type=pathlib.Path,
+        help="Path to the output directory",
+    )
+    parser.add_argument(
+        "--output-format",
+        default="csv",
+        choices=FORMATS,
+        help="Format of the monthly cohort files",
+    )
+    parser.add_argument(
+        "--start-date",
+        default=start_date,
+        help="First index date",
+    )
+    parser.add_argument(
+        "--end-date",
+        default=end_date,
+        help="Last index date",
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="Random seed",
+    )
+    parser.add_argument(
+        "--event-tables-dir",
+        type=pathlib.Path,
+        help="Also write event-level tables in the example-data schema here",
+    )
+    parser.add_argument(
+        "--practices",
+        type=int,
+        help="Number of practices (default: follow the expectations)",
+    )
+    parser.add_argument(
+        "--processes",
+        default=None,
+        type=int,
+        help="Number of months to generate at once (default: number of cores)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    index_dates = get_index_dates(args.start_date, args.end_date)
+    generate_cohorts(
+        args.patients,
+        index_dates,
+        args.output_dir,
+        args.output_format,
+        args.seed,
+        args.processes,
+        args.practices,
+    )
+    generate_ethnicity(args.patients, args.output_dir, args.seed)
+    if args.event_tables_dir is not None:
+        generate_event_tables(
+            args.patients, args.event_tables_dir, args.seed, args.practices
+        )
+
+
+if __name__ == "__main__":
+    main()
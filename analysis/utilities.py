@@ -1,53 +1,86 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from dateutil import parser
-import os
+import hashlib
 from pathlib import Path
+from instrument import instrumented
+from practice_index import refresh_practice_index
+from render_pool import save_figure
 
 BASE_DIR = Path(__file__).parents[1]
 OUTPUT_DIR = BASE_DIR / "output"
 
-def redact_small_numbers(df, n, numerator, denominator, rate_column):
-    """Takes counts df as input and suppresses low numbers.  Sequentially redacts
-    low numbers from numerator and denominator until count of redcted values >=n.
+def _suppress_column(values, groups, n):
+    """Gets the mask of values to redact within each group, see
+    `redact_small_numbers`."""
+    candidate = ~np.isnan(values)
+    counts = np.where(candidate, values, 0)
+
+    # Sort by group, then by value, with missing values last in each group
+    order = np.lexsort((np.where(candidate, values, np.inf), groups))
+    sorted_groups = groups[order]
+    sorted_counts = counts[order]
+    sorted_candidate = candidate[order]
+
+    # Running total of the smaller values in the same group
+    cumulative = np.cumsum(sorted_counts) - sorted_counts
+    is_first = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+    group_start = np.maximum.accumulate(np.where(is_first, np.arange(len(order)), 0))
+    smaller_total = cumulative - cumulative[group_start]
+
+    primary = candidate & (values <= n)
+    has_primary = np.bincount(groups, weights=np.where(primary, values, 0)) > 0
+
+    sorted_mask = (
+        has_primary[sorted_groups]
+        & sorted_candidate
+        & ((sorted_counts <= n) | (smaller_total <= n))
+    )
+    mask = np.empty_like(sorted_mask)
+    mask[order] = sorted_mask
+    return mask
+
+
+@instrumented
+def redact_small_numbers(df, n, numerator, denominator, rate_column, group_columns=None):
+    """Takes counts df as input and suppresses low numbers within each group
+    of rows (by default each date).  Counts <=n are redacted (primary
+    suppression), then the next smallest counts in the same group are
+    redacted until the total of redacted values is >n, so that the redacted
+    values cannot be recovered from a group total (secondary suppression).
     Rates corresponding to redacted values are also redacted.
-    
+
     Args:
         df: measures dataframe
         n: threshold for low number suppression
         numerator: column name for numerator
         denominator: column name for denominator
-        rate_column: column name for rate
-    
+        rate_column: column name (or list of names) for rate
+        group_columns: columns identifying each group of rows that is
+            suppressed together, e.g. ["date", "name"] for a joined measures
+            table.  Defaults to ["date"] if there is a date column.
+
     Returns:
         Input dataframe with low numbers suppressed
     """
-    
-    def suppress_column(column):    
-        suppressed_count = column[column<=n].sum()
-        
-        #if 0 dont need to suppress anything
-        if suppressed_count == 0:
-            pass
-        
-        else:
-            column = column.replace([0, 1, 2, 3, 4, 5],np.nan)
-            
+    if group_columns is None:
+        group_columns = ["date"] if "date" in df.columns else []
+    if group_columns:
+        groups = df.groupby(group_columns, sort=False, dropna=False).ngroup()
+        groups = groups.to_numpy(dtype=np.int64)
+    else:
+        groups = np.zeros(len(df), dtype=np.int64)
 
-            while suppressed_count <=n:
-                suppressed_count += column.min()
-                column.iloc[column.idxmin()] = np.nan   
-        return column
-    
-    
+    redacted = np.zeros(len(df), dtype=bool)
     for column in [numerator, denominator]:
-        df[column] = suppress_column(df[column])
-    
-    df.loc[(df[numerator].isna())| (df[denominator].isna()), rate_column] = np.nan
-    
-    return df    
+        values = df[column].to_numpy(dtype=float)
+        mask = _suppress_column(values, groups, n)
+        df[column] = np.where(mask, np.nan, values)
+        redacted |= np.isnan(df[column].to_numpy(dtype=float))
+
+    df.loc[redacted, rate_column] = np.nan
+
+    return df
+
 
 def convert_ethnicity(df):
     """Converts the ethnicity of a dataframe from int to an understandable string.
@@ -91,6 +124,7 @@ def drop_missing_demographics(df, demographic):
     """
     return df.loc[df[demographic].notnull(),:]
 
+@instrumented
 def calculate_rate(df, numerator, denominator, rate_per=100):
     """Creates a rate column for a dataframe with a numerator and denominator column.
     
@@ -167,6 +201,98 @@ def drop_irrelevant_practices(df, practice_col):
     
 #     return event_counts.iloc[:nrows, :]
 
+def _as_day_numbers(dates):
+    dates = np.asarray(dates)
+    if np.issubdtype(dates.dtype, np.datetime64):
+        return dates.astype("datetime64[D]").astype(np.int64)
+    return dates.astype(np.int64)
+
+
+def events_in_windows(dates, offsets, window_ends, window_days=None):
+    """Summarises each patient's events in a window ending on each of the
+    given dates, e.g. `between=["index_date - 365 days", "index_date"]`
+    evaluated for every index date at once.
+
+    The events are swept once rather than filtered again for each window.
+    An event is in a contiguous run of windows: from the first window that
+    ends on or after it until the first window that starts after it.  Each
+    event is placed among the window ends once, and a cumulative sum of the
+    events entering and leaving at each window then gives every window's
+    first and last event, so the work is linear in the number of events
+    plus the number of patient windows.
+
+    Args:
+        dates: event dates (day numbers or datetime64) concatenated by
+            patient and sorted within each patient
+        offsets: array of length patients + 1, where patient i's events
+            are dates[offsets[i]:offsets[i + 1]]
+        window_ends: sorted window end dates (inclusive)
+        window_days: window length in days, so that each window covers
+            [end - window_days, end].  None counts every event on or before
+            the end.
+
+    Returns:
+        Dictionary of `exists`, `count`, `first` and `last` arrays of shape
+        (patients, windows).  `first` and `last` are in the units of `dates`
+        and are NaT (or -1 for day numbers) for empty windows.
+    """
+    is_datetime = np.issubdtype(np.asarray(dates).dtype, np.datetime64)
+    days = _as_day_numbers(dates)
+    ends = _as_day_numbers(window_ends)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_patients = len(offsets) - 1
+    n_windows = len(ends)
+    patient = np.repeat(np.arange(n_patients), np.diff(offsets))
+
+    def count_by_window(window):
+        # Events of each patient whose window index is at most each window;
+        # index n_windows is after every window
+        counts = np.bincount(
+            patient * (n_windows + 1) + window,
+            minlength=n_patients * (n_windows + 1),
+        ).reshape(n_patients, n_windows + 1)
+        return np.cumsum(counts[:, :n_windows], axis=1)
+
+    # A patient's events are sorted, so the events that have entered a
+    # window come first and those that have left it come before those
+    entered = np.searchsorted(ends, days, side="left")
+    stop = offsets[:-1, None] + count_by_window(entered)
+    if window_days is None:
+        start = np.broadcast_to(offsets[:-1, None], stop.shape)
+    else:
+        left = np.searchsorted(ends, days + window_days, side="right")
+        start = offsets[:-1, None] + count_by_window(left)
+
+    count = stop - start
+    exists = count > 0
+    lookup = days if len(days) else np.array([-1])
+    first = np.where(exists, lookup[np.minimum(start, len(lookup) - 1)], -1)
+    last = np.where(exists, lookup[np.maximum(stop - 1, 0)], -1)
+    if is_datetime:
+        first = np.where(exists, first.astype("datetime64[D]"), np.datetime64("NaT"))
+        last = np.where(exists, last.astype("datetime64[D]"), np.datetime64("NaT"))
+
+    return {"exists": exists, "count": count, "first": first, "last": last}
+
+
+def hash_files(paths):
+    """Gets a single sha256 hex digest of the names and contents of files.
+
+    Args:
+        paths: iterable of file paths, hashed in sorted order
+
+    Returns:
+        Hex digest string
+    """
+    digest = hashlib.sha256()
+    for path in sorted(Path(p) for p in paths):
+        digest.update(path.name.encode())
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
 def get_number_practices(df):
     """Gets the number of practices in the given measure table.
     Args:
@@ -181,38 +307,17 @@ def get_percentage_practices(measure_table):
         measure_table: A measure table.
     """
 
-    # Read in all input practice count files and get num unique
-    practice_df_list = []
-    for file in os.listdir(OUTPUT_DIR):
-        if file.startswith("input_practice_count"):
-            df = pd.read_csv(os.path.join(OUTPUT_DIR, file))
-            practice_df_list.append(df)
-
-    total_practices_df = pd.concat(practice_df_list, axis=0)
-    num_practices_total= get_number_practices(total_practices_df)
+    # Get num unique practices in all input practice count files, reading
+    # only files added since the practice index was last refreshed
+    num_practices_total = len(refresh_practice_index(OUTPUT_DIR).all_practices)
 
     # Get number of practices in measure
     num_practices_in_study = get_number_practices(measure_table)
 
     return np.round((num_practices_in_study / num_practices_total) * 100, 2)
 
-def add_date_lines(plt, vlines):
-    # TODO: Check that it is within the range?
-    for date in vlines:
-        try:
-            plt.vlines(
-                x=[pd.to_datetime(date)],
-                ymin=0,
-                ymax=100,
-                colors="orange",
-                ls="--",
-            )
-        except parser._parser.ParserError:
-            # TODO: add logger and print warning on exception
-            # Skip any dates not in the correct format
-            continue
-
 
+@instrumented
 def plot_measures(
     df,
     filename,
@@ -232,52 +337,49 @@ def plot_measures(
         category: Name of column indicating different categories
         y_label: String indicating y axis text
     """
-    plt.figure(figsize=(15, 8))
-    if category:
-        for unique_category in df[category].unique():
-
-            df_subset = df[df[category] == unique_category]
-
-            plt.plot(df_subset["date"], df_subset[column_to_plot], marker="o")
-    else:
-        plt.plot(df["date"], df[column_to_plot], marker="o")
-
-    plt.ylabel(y_label)
-    plt.xlabel(None)
-    # plt.xticks(rotation="horizontal")
-
-    plt.title(title)
-
-    plt.rc("font", size=14)
-    plt.rc("axes", titlesize=14)
-    plt.rc("axes", labelsize=14)
-    plt.rc("xtick", labelsize=14)
-    plt.rc("ytick", labelsize=14)
-    plt.rc("legend", fontsize=14)
-    plt.rc("figure", titlesize=14)
-
-    # yticks = np.arange(5)
-    # plt.set_yticks(yticks)
-    plt.ylim(bottom=0, top=20)
-
-    plt.gca().set_yticklabels(
-        ["{:.1f}%".format(x) for x in plt.gca().get_yticks()]
+    from chart_cache import render_cached
+    from chart_core import get_template
+
+    def render():
+        template = get_template(
+            figsize=(15, 8),
+            date_lines=vlines,
+            scale="percent",
+            date_format="%b-%Y",
+            fontsize=14,
+            xtick_rotation=45,
+        )
+        ax = template.axes[0]
+        if category:
+            for unique_category in df[category].unique():
+
+                df_subset = df[df[category] == unique_category]
+
+                ax.plot(
+                    df_subset["date"],
+                    df_subset[column_to_plot],
+                    marker="o",
+                    label=unique_category,
+                )
+            ax.legend(loc="upper right", fontsize=14)
+        else:
+            ax.plot(df["date"], df[column_to_plot], marker="o")
+
+        ax.set_ylabel(y_label, fontsize=14)
+        ax.set_title(title, fontsize=14)
+        ax.set_ylim(bottom=0, top=20)
+
+        template.figure.tight_layout()
+        save_figure(template, OUTPUT_DIR / filename)
+        template.close()
+
+    columns = ["date", column_to_plot, *([category] if category else [])]
+    params = dict(
+        title=title,
+        column_to_plot=column_to_plot,
+        category=category,
+        y_label=y_label,
+        vlines=vlines,
     )
-
-    myFmt = mdates.DateFormatter('%b-%Y')
-    plt.gca().xaxis.set_major_formatter(myFmt)
-    
-    plt.xticks(rotation = 45)
-   
-    add_date_lines(plt, vlines)
-
-    if category:
-        plt.legend(df[category].unique(), loc="upper right")
-
-    else:
-        pass
-
-    plt.tight_layout()
-    plt.savefig(OUTPUT_DIR / filename)
-    plt.clf()
+    render_cached(OUTPUT_DIR / filename, df[columns], params, render)
 
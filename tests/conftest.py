@@ -0,0 +1,28 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The analysis scripts import each other as top-level modules
+sys.path.insert(0, str(Path(__file__).parents[1] / "analysis"))
+
+
+@pytest.fixture(autouse=True)
+def logs_dir(tmp_path, monkeypatch):
+    # Keep instrumentation logs out of the repository's logs/ directory
+    import instrument
+
+    monkeypatch.setattr(instrument, "LOGS_DIR", tmp_path / "logs")
+    return tmp_path / "logs"
+
+
+@pytest.fixture(autouse=True, scope="session")
+def compiled_codelists_dir(tmp_path_factory):
+    # Keep compiled codelists out of the repository's output/ directory.
+    # Session scoped, so that module scoped fixtures also use it
+    import codelist_compiler
+
+    cache_dir = tmp_path_factory.mktemp("compiled_codelists")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(codelist_compiler, "CACHE_DIR", cache_dir)
+        yield cache_dir
@@ -0,0 +1,26 @@
+import numpy as np
+
+from asof_join import build_spell_index, spells_as_of
+
+
+def test_steps_back_to_overlapping_spell():
+    # Patient 1's second spell ends before day 30, while the first is open;
+    # patient 2 has no spells
+    index = build_spell_index(
+        spell_patient_ids=[1, 1, 3],
+        starts=[0, 10, 5],
+        ends=[-1, 20, 8],
+        patient_ids=np.array([1, 2, 3]),
+    )
+
+    rows = spells_as_of(index, [-5, 0, 15, 20, 30])
+
+    np.testing.assert_array_equal(
+        rows,
+        [
+            [-1, 0, 1, 0, 0],
+            [-1, -1, -1, -1, -1],
+            [-1, -1, -1, -1, -1],
+        ],
+    )
+    np.testing.assert_array_equal(spells_as_of(index, [6]), [[0], [-1], [2]])
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+import attribute_store
+from cohort_store import write_cohort
+
+
+def test_month_views_match_cohorts(tmp_path):
+    rng = np.random.default_rng(0)
+    index_dates = pd.date_range("2019-03-01", periods=4, freq="MS")
+    sex = pd.Series(rng.choice(["F", "M"], 50), index=range(50))
+    practice = pd.Series(rng.integers(1, 5, 50), index=range(50))
+    cohorts = {}
+    for month, index_date in enumerate(index_dates):
+        patient_ids = np.sort(rng.choice(50, 30, replace=False))
+        # Some patients move practice each month
+        moved = rng.random(50) < 0.1
+        practice[moved] = rng.integers(1, 5, moved.sum())
+        cohorts[index_date] = pd.DataFrame(
+            {
+                "patient_id": patient_ids,
+                "sex": sex[patient_ids].values,
+                "practice": practice[patient_ids].values,
+                "imd": rng.choice([1, 2, None], 30),
+            }
+        )
+        write_cohort(cohorts[index_date], tmp_path, index_date)
+
+    store = attribute_store.build_attribute_store(tmp_path)
+    attribute_store.write_attribute_store(store, tmp_path / "store.npz")
+    store = attribute_store.read_attribute_store(tmp_path / "store.npz")
+
+    assert set(store.attributes) == {"sex", "practice", "imd"}
+    # Sex never changes, so there is one change point per patient
+    assert len(store.attributes["sex"].keys) == len(store.patient_ids)
+    for index_date, view in attribute_store.iter_month_views(store):
+        expected = pd.read_csv(tmp_path / f"input_ast_reg_{index_date:%Y-%m-%d}.csv")
+        np.testing.assert_array_equal(view.patient_id, expected.patient_id)
+        for column in ["sex", "practice", "imd"]:
+            pd.testing.assert_series_equal(
+                view[column].astype(expected[column].dtype),
+                expected[column],
+            )
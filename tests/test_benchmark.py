@@ -0,0 +1,22 @@
+from benchmark import compare_results, get_key
+
+
+def test_compare_results_flags_regressions_beyond_threshold():
+    baseline_result = {
+        "stage": "join_ethnicity",
+        "patients": 10_000,
+        "practices": 1_000,
+        "months": 12,
+        "seconds": 10.0,
+        "peak_rss_mb": 100.0,
+    }
+    baseline = {get_key(baseline_result): baseline_result}
+
+    within = dict(baseline_result, seconds=11.5, peak_rss_mb=110.0)
+    slower = dict(baseline_result, seconds=13.0)
+    larger = dict(baseline_result, peak_rss_mb=150.0)
+
+    assert compare_results([within], baseline, 0.2) == []
+    assert len(compare_results([slower], baseline, 0.2)) == 1
+    assert len(compare_results([larger], baseline, 0.2)) == 1
+    assert compare_results([dict(slower, patients=1)], baseline, 0.2) == []
@@ -0,0 +1,65 @@
+import pandas as pd
+
+from chart_cache import render_cached
+
+
+def test_render_cached_only_redraws_changed_charts(tmp_path):
+    calls = []
+
+    def render_to(path):
+        def render():
+            calls.append(path.name)
+            path.write_bytes(b"png")
+
+        return render
+
+    data = pd.DataFrame({"date": ["2020-01-01"], "value": [0.5]})
+    paths = [tmp_path / "a.png", tmp_path / "b.png"]
+    for path in paths:
+        assert not render_cached(path, data, {"name": path.name}, render_to(path))
+
+    path.unlink()
+    assert render_cached(paths[0], data, {"name": "a.png"}, render_to(paths[0]))
+    assert render_cached(path, data, {"name": "b.png"}, render_to(path))
+    assert path.read_bytes() == b"png"
+
+    changed = data.assign(value=[0.6])
+    assert not render_cached(path, changed, {"name": "b.png"}, render_to(path))
+    assert not render_cached(path, data, {"name": "c.png"}, render_to(path))
+    assert calls == ["a.png", "b.png", "b.png", "b.png"]
+
+
+def test_panel_plots_output_name_without_suffix(tmp_path, monkeypatch):
+    import panel_plots
+
+    dates = pd.date_range("2020-01-01", periods=3, freq="MS")
+    measures = pd.DataFrame(
+        {
+            "date": dates.repeat(2),
+            "name": ["ast_reg_sex_rate"] * 6,
+            "category": ["sex"] * 6,
+            "group": ["F", "M"] * 3,
+            "value": [0.1, 0.2, 0.15, 0.25, 0.12, 0.22],
+        }
+    )
+    input_file = tmp_path / "measure_register.csv"
+    measures.to_csv(input_file, index=False)
+    argv = [
+        "panel_plots.py",
+        "--input-file",
+        str(input_file),
+        "--measures-pattern",
+        "*_rate",
+        "--output-dir",
+        str(tmp_path),
+        "--output-name",
+        "register_by_group",
+    ]
+    monkeypatch.setattr("sys.argv", argv)
+
+    panel_plots.main()
+    chart = tmp_path / "register_by_group.png"
+    drawn = chart.read_bytes()
+    chart.unlink()
+    panel_plots.main()
+    assert chart.read_bytes() == drawn
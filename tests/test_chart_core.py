@@ -0,0 +1,20 @@
+import pandas as pd
+
+from chart_core import get_template
+
+
+def test_template_is_reused_and_keeps_date_lines(tmp_path):
+    dates = pd.date_range("2019-03-01", periods=12, freq="MS")
+
+    template = get_template(date_lines=["2019-06-01", "not a date"], scale="rate")
+    ax = template.axes[0]
+    ax.plot(dates, range(12), label="a")
+    ax.legend()
+    template.savefig(tmp_path / "chart.png")
+    template.close()
+
+    assert get_template(date_lines=("2019-06-01", "not a date"), scale="rate") is template
+    assert len(ax.lines) == 1  # the date line
+    assert ax.get_legend() is None
+    assert ax.get_ylabel() == "Rate per thousand"
+    assert (tmp_path / "chart.png").exists()
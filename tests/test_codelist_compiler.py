@@ -0,0 +1,51 @@
+import numpy as np
+
+import codelist_compiler
+
+
+def test_membership_and_categories_of_event_codes():
+    ethnicity = codelist_compiler.load_codelist("ethnicity6_codes")
+    codes = ethnicity.codes[:3]
+
+    values = np.array([str(codes[0]), "not a code", None, codes[2]], dtype=object)
+
+    np.testing.assert_array_equal(
+        codelist_compiler.is_in(values, ethnicity), [True, False, False, True]
+    )
+    categories = codelist_compiler.map_categories(values, ethnicity)
+    assert categories[0] == ethnicity.categories[ethnicity.category_codes[0]]
+    assert categories.isna().tolist() == [False, True, True, False]
+
+
+def test_artefact_is_reused_until_the_codelist_changes(tmp_path, monkeypatch):
+    csv = tmp_path / "codelist.csv"
+    csv.write_text("code,term\n22164911000001100,a\n1,b\n")
+    spec = codelist_compiler.CODELISTS["ast_cod"]._replace(path=str(csv))
+    monkeypatch.setitem(codelist_compiler.CODELISTS, "test_cod", spec)
+
+    path = codelist_compiler.get_artefact_path(spec, tmp_path)
+    codelist = codelist_compiler.load_codelist("test_cod", tmp_path)
+
+    assert path.exists()
+    # Codes keep their full precision
+    assert codelist.codes.tolist() == [1, 22164911000001100]
+    csv.write_text("code,term\n2,c\n")
+    assert codelist_compiler.get_artefact_path(spec, tmp_path) != path
+
+
+def test_unchanged_codelist_is_loaded_without_reading_its_csv(tmp_path, monkeypatch):
+    csv = tmp_path / "codelist.csv"
+    csv.write_text("code,term\n3,a\n1,b\n")
+    spec = codelist_compiler.CODELISTS["ast_cod"]._replace(path=str(csv))
+    monkeypatch.setitem(codelist_compiler.CODELISTS, "test_cod", spec)
+    codelist_compiler.load_codelist("test_cod", tmp_path)
+    codelist_compiler.load_codelist.cache_clear()
+
+    def read_csv(*args, **kwargs):
+        raise AssertionError("the codelist CSV was read")
+
+    monkeypatch.setattr(codelist_compiler.pd, "read_csv", read_csv)
+    monkeypatch.setattr(type(csv), "read_bytes", read_csv)
+
+    codelist = codelist_compiler.load_codelist("test_cod", tmp_path)
+    assert codelist.codes.tolist() == [1, 3]
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+import cube
+from join_and_round import get_cube_measure_tables
+
+INDEX_DATES = pd.date_range("2019-03-01", periods=2, freq="MS")
+
+
+def get_cohorts():
+    rng = np.random.default_rng(0)
+    cohorts = {}
+    for index_date in INDEX_DATES:
+        size = 500
+        cohorts[index_date] = pd.DataFrame(
+            {
+                "patient_id": np.arange(size),
+                "practice": rng.integers(1, 6, size),
+                "age_band": rng.choice(["0-19", "20-39", "40+"], size),
+                "sex": rng.choice(["F", "M"], size),
+                "region": rng.choice(["North", "South", None], size),
+                "asthma": rng.integers(0, 2, size),
+            }
+        )
+    return cohorts
+
+
+def get_cube():
+    return pd.concat(
+        [
+            cube.aggregate_cohort(cohort, index_date)
+            for index_date, cohort in get_cohorts().items()
+        ],
+        ignore_index=True,
+    )
+
+
+def get_patients():
+    return pd.concat(
+        [
+            cohort.assign(date=index_date, population=1)
+            for index_date, cohort in get_cohorts().items()
+        ],
+        ignore_index=True,
+    )
+
+
+def test_rollups_match_direct_groupby():
+    demographic_cube = get_cube()
+    patients = get_patients()
+
+    for by, where in [
+        ([], None),
+        (["sex"], None),
+        (["region"], None),
+        (["age_band", "sex"], None),
+        (["sex"], {"region": "North"}),
+    ]:
+        table = cube.rollup(demographic_cube, by, where)
+        if where:
+            patients_in = patients[patients.region == where["region"]]
+        else:
+            patients_in = patients
+        expected = (
+            patients_in.groupby(["date", *by], dropna=False)[
+                ["asthma", "population"]
+            ]
+            .sum()
+            .reset_index()
+        )
+        pd.testing.assert_frame_equal(
+            table[["date", *by, "asthma", "population"]],
+            expected,
+            check_dtype=False,
+        )
+        assert np.allclose(table.value, expected.asthma / expected.population)
+
+
+def test_measure_table_suppresses_small_numerators():
+    demographic_cube = get_cube()
+    # Practice 1 has 3 patients on the register in the first month and none
+    # in the second
+    practice_1 = demographic_cube.practice == 1
+    demographic_cube.loc[practice_1, "asthma"] = 0
+    first_month = demographic_cube.index[
+        practice_1 & (demographic_cube.date == INDEX_DATES[0])
+    ]
+    demographic_cube.loc[first_month[0], "asthma"] = 3
+
+    table = cube.measure_table(demographic_cube, ["practice"])
+
+    assert list(table.columns) == ["practice", "asthma", "population", "value", "date"]
+    practice_1 = table[table.practice == 1].set_index("date")
+    assert np.isnan(practice_1.asthma[INDEX_DATES[0]])
+    assert np.isnan(practice_1.value[INDEX_DATES[0]])
+    assert practice_1.asthma[INDEX_DATES[1]] == 0
+    # The next smallest numerator of the first month is also redacted, and
+    # the second month is suppressed separately
+    redacted = table[table.asthma.isna()]
+    assert redacted.date.tolist() == [INDEX_DATES[0]] * 2
+
+
+def test_cube_measure_tables_from_parquet(tmp_path):
+    cube.write_cube(get_cube(), tmp_path / cube.CUBE_NAME)
+
+    breakdowns = ["population", "age_band,sex"]
+    tables = list(get_cube_measure_tables(tmp_path / cube.CUBE_NAME, breakdowns))
+
+    assert [table.attrs["id"] for table in tables] == [
+        "total_rate",
+        "age_band_sex_rate",
+    ]
+    assert tables[0].population.tolist() == [500, 500]
+    assert "40+ / M" in set(tables[1].age_band_sex)
@@ -0,0 +1,48 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+import deciles
+from deciles import PERCENTILES
+
+
+def test_deciles_action_matches_groupby_quantile(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    dates = pd.date_range("2019-03-01", periods=6, freq="MS")
+    measure_table = pd.DataFrame(
+        {
+            "practice": np.tile(np.arange(50), len(dates)),
+            "asthma": rng.integers(0, 100, 50 * len(dates)).astype(float),
+            "population": 100,
+            "date": np.repeat(dates, 50),
+        }
+    )
+    measure_table.loc[::7, "asthma"] = np.nan
+    measure_table["value"] = measure_table.asthma / measure_table.population
+    measure_table.to_csv(tmp_path / "measure_practice_rate.csv", index=False)
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "deciles.py",
+            "--input-files",
+            str(tmp_path / "measure_*.csv"),
+            "--output-dir",
+            str(tmp_path / "deciles"),
+        ],
+    )
+
+    deciles.main()
+
+    output_dir = tmp_path / "deciles"
+    deciles_table = pd.read_csv(output_dir / "deciles_table_practice_rate.csv")
+    expected = (
+        measure_table.groupby("date")["value"]
+        .quantile([p / 100 for p in PERCENTILES])
+        .unstack()
+        .values
+    )
+    actual = deciles_table.pivot(index="date", columns="percentile", values="value")
+    np.testing.assert_allclose(actual.values, expected)
+    assert (output_dir / "deciles_chart_practice_rate.png").exists()
@@ -0,0 +1,91 @@
+import json
+import os
+
+import pandas as pd
+
+import incremental
+from cohort_store import get_cohort_path, write_cohort
+from instrument import get_action
+from measure_registry import MeasureSpec
+
+HASHES = {
+    "study_definition_hash": "a",
+    "codelist_hash": "b",
+    "output_format": "csv",
+}
+INDEX_DATES = pd.date_range("2019-03-01", periods=3, freq="MS")
+
+
+def write_months(directory, index_dates):
+    for index_date in index_dates:
+        # Large enough that no count is suppressed
+        cohort = pd.DataFrame(
+            {
+                "patient_id": range(40),
+                "asthma": [1, 0, 1, 1] * 10,
+                "population": 1,
+                "sex": ["F", "M", "F", "M"] * 10,
+            }
+        )
+        write_cohort(cohort, directory, index_date)
+
+
+def test_manifest_detects_new_and_changed_months(tmp_path):
+    write_months(tmp_path, INDEX_DATES[:2])
+    manifest = incremental.read_manifest(tmp_path, HASHES)
+    missing = incremental.get_missing_index_dates(manifest, INDEX_DATES, tmp_path)
+    assert list(missing) == list(INDEX_DATES)
+
+    incremental.record_outputs(manifest, INDEX_DATES[:2], tmp_path)
+    incremental.write_manifest(manifest, tmp_path)
+    manifest = incremental.read_manifest(tmp_path, HASHES)
+
+    # Unchanged months are skipped and the new month is extracted
+    missing = incremental.get_missing_index_dates(manifest, INDEX_DATES, tmp_path)
+    assert list(missing) == [INDEX_DATES[2]]
+
+    # A month whose file has changed is extracted again
+    path = get_cohort_path(tmp_path, INDEX_DATES[0])
+    stat = os.stat(path)
+    path.write_text(path.read_text().replace("F", "M"))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    missing = incremental.get_missing_index_dates(manifest, INDEX_DATES, tmp_path)
+    assert list(missing) == [INDEX_DATES[0], INDEX_DATES[2]]
+
+    # As is every month when the study definition changes
+    changed = dict(HASHES, study_definition_hash="c")
+    manifest = incremental.read_manifest(tmp_path, changed)
+    missing = incremental.get_missing_index_dates(manifest, INDEX_DATES, tmp_path)
+    assert list(missing) == list(INDEX_DATES)
+
+
+def test_append_measures_replaces_months_already_present(tmp_path, logs_dir):
+    measures = [
+        MeasureSpec("ast_reg_total_rate", "asthma", "population", ["population"]),
+        MeasureSpec("ast_reg_sex_rate", "asthma", "population", ["sex"]),
+        # Skipped, as the cohorts have no imd column
+        MeasureSpec("ast_reg_imd_rate", "asthma", "population", ["imd"]),
+    ]
+    write_months(tmp_path, INDEX_DATES)
+
+    incremental.append_measures(measures, INDEX_DATES[:2], tmp_path)
+    incremental.append_measures(measures, INDEX_DATES[1:], tmp_path)
+
+    total = pd.read_csv(tmp_path / "measure_ast_reg_total_rate.csv")
+    by_sex = pd.read_csv(tmp_path / "measure_ast_reg_sex_rate.csv")
+    assert total.date.tolist() == [f"{date:%Y-%m-%d}" for date in INDEX_DATES]
+    assert total.asthma.tolist() == [30, 30, 30]
+    assert len(by_sex) == 2 * len(INDEX_DATES)
+    assert not by_sex.duplicated(["date", "sex"]).any()
+    assert not (tmp_path / "measure_ast_reg_imd_rate.csv").exists()
+    skipped = [
+        record
+        for record in map(
+            json.loads,
+            (logs_dir / f"{get_action()}.jsonl").read_text().splitlines(),
+        )
+        if record["event"] == "measure_skipped"
+    ]
+    assert [(r["measure"], r["missing"]) for r in skipped] == [
+        ("ast_reg_imd_rate", ["imd"])
+    ] * 2
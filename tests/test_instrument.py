@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from instrument import _peak_rss_mb, get_action, instrumented, stage
+
+
+@instrumented
+def double(table):
+    return pd.concat([table, table])
+
+
+@instrumented
+def split(table):
+    yield table.iloc[:1]
+    yield table.iloc[1:]
+
+
+def test_instrumented_logs_rows_and_timings(logs_dir):
+    table = pd.DataFrame({"a": [1, 2, 3]})
+
+    double(table)
+    parts = list(split(table))
+
+    records = [
+        json.loads(line)
+        for line in (logs_dir / f"{get_action()}.jsonl").read_text().splitlines()
+    ]
+    assert len(parts) == 2
+    assert [(r["stage"].split(".")[-1], r["rows_in"], r["rows_out"]) for r in records] == [
+        ("double", 3, 6),
+        ("split", 3, 3),
+    ]
+    assert all(r["seconds"] >= 0 and r["process_peak_rss_mb"] > 0 for r in records)
+
+
+def test_stage_logs_its_own_peak_increase(logs_dir):
+    with stage("small"):
+        pass
+    # Larger than the process peak so far, so it raises the peak
+    size = int((_peak_rss_mb() + 64) * 1024 * 1024 // 8)
+    with stage("large"):
+        block = np.ones(size)
+    del block
+    with stage("after"):
+        pass
+
+    records = {
+        r["stage"]: r
+        for r in map(
+            json.loads,
+            (logs_dir / f"{get_action()}.jsonl").read_text().splitlines(),
+        )
+    }
+    assert records["large"]["peak_rss_increase_mb"] >= 32
+    assert records["after"]["peak_rss_increase_mb"] < 32
+    assert (
+        records["after"]["process_peak_rss_mb"]
+        >= records["large"]["process_peak_rss_mb"]
+    )
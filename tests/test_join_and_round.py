@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+from join_and_round import _round_table
+
+
+def test_round_table_matches_python_round():
+    values = np.arange(0, 200)
+    table = pd.DataFrame(
+        {"numerator": values, "denominator": values + 100, "value": 0.0}
+    )
+
+    rounded = _round_table(table, 10)
+
+    assert rounded.numerator.tolist() == [int(10 * round(x / 10)) for x in values]
+    assert rounded.value.tolist() == (rounded.numerator / rounded.denominator).tolist()
+
+
+def test_round_table_keeps_missing_values_with_midpoint_rounding():
+    table = pd.DataFrame(
+        {"numerator": [0, 1, 6, 7, np.nan], "denominator": [12] * 5, "value": 0.0}
+    )
+
+    rounded = _round_table(table, 6, "midpoint")
+
+    assert rounded.numerator.tolist()[:4] == [0, 3, 3, 9]
+    assert np.isnan(rounded.numerator.iloc[4])
+    assert np.isnan(rounded.value.iloc[4])
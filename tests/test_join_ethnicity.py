@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import join_ethnicity
+from practice_index import INDEX_NAME, read_practice_index
+from cohort_store import iter_cohort_chunks, read_cohort, write_cohort_chunks
+
+
+def test_attach_columns_by_patient_id(tmp_path):
+    pd.DataFrame({"patient_id": [3, 1], "eth": ["2", "1"]}).to_csv(
+        tmp_path / "input_ethnicity.csv", index=False
+    )
+    lookup = join_ethnicity.build_lookup(tmp_path / "input_ethnicity.csv")
+
+    chunk = join_ethnicity.attach_columns(
+        pd.DataFrame({"patient_id": [1, 2, 3]}), lookup
+    )
+
+    assert chunk.eth.tolist()[::2] == ["1", "2"]
+    assert pd.isnull(chunk.eth[1])
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+def test_chunks_are_written_as_they_arrive(tmp_path, output_format):
+    # Later chunks have categories the first did not, and more than fit in
+    # the first chunk's int8 dictionary indices
+    chunks = [
+        pd.DataFrame({"patient_id": [1, 2], "region": ["North", None]}),
+        pd.DataFrame(
+            {
+                "patient_id": np.arange(3, 303),
+                "region": [f"Region {i}" for i in range(300)],
+            }
+        ),
+        pd.DataFrame({"patient_id": [303], "region": ["North"]}),
+    ]
+
+    def generate():
+        for chunk in chunks:
+            yield chunk
+            # Each chunk is written before the next is produced
+            assert list((tmp_path / "input_ast_reg").rglob(".*.tmp"))
+
+    write_cohort_chunks(generate(), tmp_path, "2019-03-01", output_format)
+
+    expected = pd.concat(chunks, ignore_index=True)
+    cohort = read_cohort(tmp_path, "2019-03-01", output_format)
+    assert cohort.region.astype(object).tolist() == expected.region.tolist()
+    batches = list(
+        iter_cohort_chunks(tmp_path, "2019-03-01", output_format, chunksize=1000)
+    )
+    assert sum(map(len, batches)) == len(expected)
+
+
+def test_main_joins_every_monthly_cohort_in_place(tmp_path, monkeypatch):
+    pd.DataFrame({"patient_id": [1, 2], "eth": [1, 3]}).to_csv(
+        tmp_path / "input_ethnicity.csv", index=False
+    )
+    cohort = pd.DataFrame(
+        {"patient_id": [2, 1, 5], "asthma": [1, 0, 1], "practice": [7, 3, 7]}
+    )
+    names = ["input_ast_reg", "input_copd_reg", "input_practice_count"]
+    for name in names:
+        cohort.to_csv(tmp_path / f"{name}_2019-03-01.csv", index=False)
+    monkeypatch.setattr(
+        "sys.argv",
+        [
+            "join_ethnicity.py",
+            "--input-dir",
+            str(tmp_path),
+            "--rhs",
+            str(tmp_path / "input_ethnicity.csv"),
+            "--processes",
+            "1",
+        ],
+    )
+
+    join_ethnicity.main()
+
+    for name in names[:2]:
+        joined = pd.read_csv(tmp_path / f"{name}_2019-03-01.csv")
+        assert list(joined.columns) == ["patient_id", "asthma", "practice", "eth"]
+        assert joined.eth.tolist()[:2] == [3, 1]
+        assert pd.isnull(joined.eth[2])
+    practice = pd.read_csv(tmp_path / "input_practice_count_2019-03-01.csv")
+    assert list(practice.columns) == ["patient_id", "asthma", "practice"]
+    assert not list(tmp_path.glob(".*.tmp"))
+    # The practice count files are indexed by the join
+    index = read_practice_index(tmp_path / INDEX_NAME)
+    assert index.all_practices.tolist() == [3, 7]
@@ -0,0 +1,57 @@
+import local_runner
+
+
+def get_actions():
+    return {
+        "first": {
+            "run": "python:latest python first.py",
+            "outputs": {"moderately_sensitive": {"table": "output/first.csv"}},
+        },
+        "second": {
+            "run": "python:latest python second.py",
+            "needs": ["first"],
+            "outputs": {"moderately_sensitive": {"table": "output/second.csv"}},
+        },
+    }
+
+
+def test_unchanged_actions_are_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_runner, "BASE_DIR", tmp_path)
+    (tmp_path / "output").mkdir()
+    (tmp_path / "first.py").write_text(
+        "open('output/first.csv', 'w').write('a\\n1\\n')\n"
+    )
+    (tmp_path / "second.py").write_text(
+        "open('output/second.csv', 'w').write(open('output/first.csv').read())\n"
+    )
+    actions = get_actions()
+    state = {}
+
+    assert local_runner.run_actions(["second", "first"], actions, state) == {
+        "first": "ran",
+        "second": "ran",
+    }
+    assert local_runner.run_actions(["first", "second"], actions, state) == {
+        "first": "skipped",
+        "second": "skipped",
+    }
+
+    # A change to the first script that gives the same output does not
+    # rerun the second action
+    (tmp_path / "first.py").write_text(
+        "# comment\nopen('output/first.csv', 'w').write('a\\n1\\n')\n"
+    )
+    assert local_runner.run_actions(["first", "second"], actions, state) == {
+        "first": "ran",
+        "second": "skipped",
+    }
+
+
+def test_failed_action_stops_its_dependents(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_runner, "BASE_DIR", tmp_path)
+    (tmp_path / "first.py").write_text("raise SystemExit(1)\n")
+    (tmp_path / "second.py").write_text("")
+
+    status = local_runner.run_actions(["first", "second"], get_actions(), {})
+
+    assert status == {"first": "failed", "second": "not run"}
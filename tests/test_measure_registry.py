@@ -0,0 +1,9 @@
+from measure_registry import measures, read_manifest, write_manifest
+
+
+def test_manifest_round_trip(tmp_path):
+    write_manifest(tmp_path)
+
+    assert read_manifest(tmp_path) == measures
+    assert measures[0].id == "ast_reg_total_rate"
+    assert measures[0].group_by == ["population"]
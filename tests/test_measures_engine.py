@@ -0,0 +1,124 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from measures_engine import calculate_measures, generate_measures
+
+
+def _measure(id_, group_by):
+    return SimpleNamespace(
+        id=id_,
+        numerator="asthma",
+        denominator="population",
+        group_by=group_by,
+        small_number_suppression=True,
+    )
+
+
+MEASURES = [
+    _measure("ast_reg_total_rate", ["population"]),
+    _measure("ast_reg_sex_rate", ["sex"]),
+    _measure("ast_reg_ethnicity_rate", ["ethnicity"]),
+]
+
+
+def test_measures_match_per_measure_groupby():
+    rng = np.random.default_rng(1)
+    cohort = pd.DataFrame(
+        {
+            "asthma": rng.integers(0, 2, 1000),
+            "sex": rng.choice(["F", "M"], 1000),
+            "ethnicity": rng.choice(["White", "Black", None], 1000),
+        }
+    )
+
+    tables = calculate_measures(cohort, MEASURES, "2019-03-01")
+
+    expected = (
+        cohort.assign(population=1)
+        .groupby("ethnicity", dropna=False)[["asthma", "population"]]
+        .sum()
+        .reset_index()
+    )
+    ethnicity = tables["ast_reg_ethnicity_rate"]
+    assert list(ethnicity.columns) == [
+        "ethnicity", "asthma", "population", "value", "date",
+    ]
+    np.testing.assert_array_equal(ethnicity.asthma, expected.asthma)
+    np.testing.assert_array_equal(ethnicity.population, expected.population)
+    assert list(tables["ast_reg_total_rate"].columns) == [
+        "asthma", "population", "value", "date",
+    ]
+    assert tables["ast_reg_total_rate"].population[0] == 1000
+
+
+def test_small_numerators_are_suppressed():
+    cohort = pd.DataFrame({"asthma": [1, 1, 0, 0, 1], "sex": ["F"] * 5})
+
+    table = calculate_measures(cohort, MEASURES[1:2], "2019-03-01")[
+        "ast_reg_sex_rate"
+    ]
+
+    assert table.asthma.isna().all()
+    assert table.value.isna().all()
+    assert table.population[0] == 5
+
+
+def test_numerators_close_to_denominators_are_suppressed():
+    # 8 of the 10 women have asthma, and 10 of the 30 men
+    cohort = pd.DataFrame(
+        {
+            "asthma": [1] * 8 + [0] * 2 + [1] * 10 + [0] * 20,
+            "sex": ["F"] * 10 + ["M"] * 30,
+        }
+    )
+
+    table = calculate_measures(cohort, MEASURES[1:2], "2019-03-01")[
+        "ast_reg_sex_rate"
+    ].set_index("sex")
+
+    # Redacting the women's 8 alone could be undone from the total, so the
+    # men's 10 is redacted too
+    assert table.asthma.isna().all()
+    assert table.population.tolist() == [10, 30]
+
+
+def test_next_smallest_numerator_is_suppressed_with_a_single_group():
+    cohort = pd.DataFrame(
+        {
+            "asthma": [1] * 3 + [0] * 17 + [1] * 10 + [0] * 20 + [1] * 12 + [0] * 8,
+            "ethnicity": ["Asian"] * 20 + ["Black"] * 30 + ["White"] * 20,
+        }
+    )
+
+    table = calculate_measures(cohort, MEASURES[2:3], "2019-03-01")[
+        "ast_reg_ethnicity_rate"
+    ].set_index("ethnicity")
+
+    assert np.isnan(table.asthma["Asian"])
+    assert np.isnan(table.asthma["Black"])
+    assert table.asthma["White"] == 12
+
+
+def test_chunked_measures_match_whole_month(tmp_path):
+    rng = np.random.default_rng(2)
+    cohort = pd.DataFrame(
+        {
+            "patient_id": range(1000),
+            "asthma": rng.integers(0, 2, 1000),
+            "population": 1,
+            "sex": rng.choice(["F", "M"], 1000),
+            "ethnicity": rng.choice(["White", "Black", None], 1000),
+            "imd": rng.integers(1, 6, 1000),
+        }
+    )
+    cohort.to_csv(tmp_path / "input_ast_reg_2019-03-01.csv", index=False)
+
+    measures = [*MEASURES, _measure("ast_reg_imd_rate", ["imd"])]
+
+    whole = generate_measures(measures, tmp_path)
+    chunked = generate_measures(measures, tmp_path, chunksize=150)
+
+    for measure in measures:
+        pd.testing.assert_frame_equal(chunked[measure.id], whole[measure.id])
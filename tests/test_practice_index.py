@@ -0,0 +1,25 @@
+import pandas as pd
+
+from practice_index import INDEX_NAME, refresh_practice_index
+
+
+def test_refresh_only_reads_new_files(tmp_path):
+    pd.DataFrame({"practice": [3, 1, 3]}).to_csv(
+        tmp_path / "input_practice_count_2019-03-01.csv", index=False
+    )
+    index = refresh_practice_index(tmp_path)
+    assert index.all_practices.tolist() == [1, 3]
+
+    pd.DataFrame({"practice": [2, 1]}).to_csv(
+        tmp_path / "input_practice_count_2019-04-01.csv", index=False
+    )
+    index = refresh_practice_index(tmp_path)
+
+    assert index.names.tolist() == [
+        "input_practice_count_2019-03-01.csv",
+        "input_practice_count_2019-04-01.csv",
+    ]
+    assert index.offsets.tolist() == [0, 2, 4]
+    assert index.all_practices.tolist() == [1, 2, 3]
+    assert (tmp_path / INDEX_NAME).exists()
+    assert refresh_practice_index(tmp_path).all_practices.tolist() == [1, 2, 3]
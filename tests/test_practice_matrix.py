@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+import practice_matrix
+from deciles import PERCENTILES
+from utilities import drop_irrelevant_practices
+
+
+def get_measure_table():
+    dates = pd.date_range("2019-03-01", periods=3, freq="MS")
+    table = pd.DataFrame(
+        {
+            "practice": np.tile([3, 1, 2], 3),
+            "asthma": [0, 6, 0, np.nan, 8, 0, 7, 10, 0],
+            "population": [10, 20, 30, 10, 20, 30, 10, 20, 30],
+            "date": np.repeat(dates, 3),
+        }
+    )
+    table["value"] = table.asthma / table.population
+    # Practice 2 has no row in the last month
+    return table.drop(index=8).reset_index(drop=True)
+
+
+def test_round_trip_and_relevance():
+    table = get_measure_table()
+
+    matrix = practice_matrix.from_measure_table(table)
+    relevant = practice_matrix.get_relevant_practices(matrix)
+
+    assert matrix.numerator.dtype == np.int32
+    assert matrix.practices[relevant].tolist() == [1, 3]
+    assert sorted(drop_irrelevant_practices(table, "practice").practice.unique()) == [1, 3]
+    pd.testing.assert_frame_equal(
+        practice_matrix.to_measure_table(matrix)[table.columns],
+        table.sort_values(["date", "practice"], ignore_index=True),
+        check_dtype=False,
+    )
+
+
+def test_totals_and_trends():
+    matrix = practice_matrix.from_measure_table(get_measure_table())
+
+    totals = practice_matrix.get_totals(matrix)
+    trends = practice_matrix.get_trends(matrix)
+
+    assert totals.asthma.tolist() == [6, 8, 17]
+    assert totals.population.tolist() == [60, 60, 30]
+    assert np.isclose(trends[1], 0.1)
+    assert np.isclose(trends[3], 0.35)
+
+
+def test_deciles_match_long_table():
+    table = get_measure_table()
+
+    deciles_table = practice_matrix.get_deciles(
+        practice_matrix.from_measure_table(table)
+    )
+
+    expected = (
+        table.groupby("date")["value"]
+        .quantile([p / 100 for p in PERCENTILES])
+        .unstack()
+        .values
+    )
+    actual = deciles_table.pivot(index="date", columns="percentile", values="value")
+    np.testing.assert_allclose(actual.values, expected)
+
+
+def test_write_and_read(tmp_path):
+    matrix = practice_matrix.from_measure_table(get_measure_table())
+
+    practice_matrix.write_practice_matrix(matrix, tmp_path / "matrix.npz")
+    read = practice_matrix.read_practice_matrix(tmp_path / "matrix.npz")
+
+    assert read.dates.equals(matrix.dates)
+    np.testing.assert_array_equal(read.numerator, matrix.numerator)
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from rate_calculations import get_practice_tables
+from utilities import calculate_rate
+
+
+def test_practice_deciles_include_suppressed_practices():
+    dates = pd.date_range("2021-01-01", periods=2, freq="MS")
+    practices = np.arange(20)
+    df = pd.DataFrame(
+        {
+            "date": np.repeat(dates, len(practices)),
+            "practice": np.tile(practices, len(dates)),
+            # The smallest practices have counts that are suppressed
+            "asthma": np.tile(np.arange(1, 21) * 3, len(dates)),
+            "population": np.tile(np.arange(1, 21) * 10 + 50, len(dates)),
+        }
+    )
+    df["value"] = df.asthma / df.population
+    df = calculate_rate(df, "asthma", "population", rate_per=100)
+
+    rate_table, totals, deciles_table = get_practice_tables(
+        df, "asthma", "population"
+    )
+
+    assert rate_table.value.isnull().any()
+    median = deciles_table[deciles_table.percentile == 50].value
+    assert np.allclose(median, np.median(df.value[df.date == dates[0]]))
+    assert totals.asthma.tolist() == [df.asthma.sum() // 2] * 2
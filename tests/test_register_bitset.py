@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+import register_bitset
+from cohort_store import write_cohort
+
+
+def test_flows_from_cohorts(tmp_path):
+    # Patient 3 leaves the register, patient 4 joins it and patient 2 leaves
+    # the population
+    months = {
+        "2019-03-01": pd.DataFrame(
+            {"patient_id": [1, 2, 3], "asthma": [1, 1, 1], "sex": ["F", "M", "F"]}
+        ),
+        "2019-04-01": pd.DataFrame(
+            {"patient_id": [1, 3, 4], "asthma": [1, 0, 1], "sex": ["F", "F", "M"]}
+        ),
+    }
+    for index_date, cohort in months.items():
+        write_cohort(cohort, tmp_path, index_date)
+
+    membership = register_bitset.from_cohorts(tmp_path)
+    flows = register_bitset.get_flows(membership)
+
+    np.testing.assert_array_equal(membership.patient_ids, [1, 2, 3, 4])
+    assert flows.iloc[0][register_bitset.FLOW_COLUMNS].tolist() == [2, 1, 2, 1, 1, 3]
+
+    groups = months["2019-04-01"].set_index("patient_id").sex
+    by_sex = register_bitset.get_flows(membership, groups).set_index("group")
+    assert by_sex.loc["F", "exits"] == 1
+    assert by_sex.loc["M", "entries"] == 1
+    # Patient 2 is not in the last month, so has no group
+    assert by_sex.loc[np.nan, "left_population"] == 1
+
+
+def test_suppressed_flows_cannot_be_recovered(tmp_path):
+    flows = pd.DataFrame(
+        {
+            "date": pd.date_range("2019-04-01", periods=3, freq="MS"),
+            "on_register": [100, 103, 103],
+            "entries": [10, 3, 0],
+            "exits": [20, 0, 3],
+            "left_population": [8, 0, 2],
+            "persisted": [90, 100, 103],
+        }
+    )
+    flows["churn"] = flows.entries + flows.exits
+
+    register_bitset.write_flows(flows, tmp_path / "flows.csv")
+    written = pd.read_csv(tmp_path / "flows.csv")
+    suppressed = written[register_bitset.FLOW_COLUMNS].isnull()
+
+    assert suppressed.entries[1] and suppressed.exits[2]
+    assert suppressed.left_population[2]
+    # No identity between the flows has exactly one redacted count
+    for total, parts in [
+        ("on_register", ["entries", "persisted"]),
+        ("churn", ["entries", "exits"]),
+    ]:
+        assert (suppressed[[total, *parts]].sum(axis=1) != 1).all()
+    between_months = pd.concat(
+        [
+            suppressed.on_register.shift(1).iloc[1:].astype(bool),
+            suppressed.persisted.iloc[1:],
+            suppressed.exits.iloc[1:],
+        ],
+        axis=1,
+    )
+    assert (between_months.sum(axis=1) != 1).all()
+
+
+def test_membership_round_trips(tmp_path):
+    register = {
+        "patient_id": np.arange(10),
+        "index_date": pd.date_range("2019-03-01", periods=3, freq="MS"),
+        "asthma": np.random.default_rng(0).integers(0, 2, (10, 3)),
+    }
+    membership = register_bitset.from_register(register)
+
+    register_bitset.write_membership(membership, tmp_path / "membership.npz")
+    read = register_bitset.read_membership(tmp_path / "membership.npz")
+
+    np.testing.assert_array_equal(
+        np.unpackbits(read.asthma, axis=1, count=10).T, register["asthma"]
+    )
+    assert list(read.dates) == list(register["index_date"])
+
+
+def test_count_without_bitwise_count(monkeypatch):
+    rng = np.random.default_rng(0)
+    flags = rng.integers(0, 2, (3, 1001)).astype(bool)
+    bits = register_bitset._pack(flags)
+    monkeypatch.delattr(np, "bitwise_count", raising=False)
+
+    counts = register_bitset._count(bits)
+
+    np.testing.assert_array_equal(counts, flags.sum(axis=-1))
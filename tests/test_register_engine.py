@@ -0,0 +1,101 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import register_engine
+
+EXAMPLE_DATA = register_engine.BASE_DIR / "example-data"
+
+
+@pytest.fixture(scope="module")
+def register():
+    tables = register_engine.load_tables(EXAMPLE_DATA)
+    index_dates = register_engine.get_index_dates("2019-03-01", "2020-09-30")
+    return register_engine.build_register(tables, index_dates)
+
+
+def _month(register, date):
+    return list(register["index_date"]).index(pd.Timestamp(date))
+
+
+def test_drug_treatment_window_slides_with_index_date(register):
+    # Patient 1 was diagnosed in 2015 with last treatment on 2018-09-21
+    patient = list(register["patient_id"]).index(1)
+    assert register["asthma"][patient, _month(register, "2019-08-01")] == 1
+    assert register["asthma"][patient, _month(register, "2019-09-01")] == 0
+
+
+def test_diagnosis_must_precede_month_end(register):
+    # Patient 5 was diagnosed and treated on 2019-07-06
+    patient = list(register["patient_id"]).index(5)
+    assert register["had_asthma"][patient, _month(register, "2019-06-01")] == 0
+    assert register["asthma"][patient, _month(register, "2019-07-01")] == 1
+
+
+def test_monthly_tables_cover_every_index_date(register):
+    tables = list(register_engine.get_monthly_tables(register))
+    assert len(tables) == 19
+    index_date, table = tables[0]
+    assert index_date == pd.Timestamp("2019-03-01")
+    assert list(table.columns) == [
+        "patient_id",
+        *register_engine.REGISTER_VARIABLES,
+        *register_engine.DEMOGRAPHIC_VARIABLES,
+    ]
+    # Only the population is written: patients 0, 4 and 8 died before 2019,
+    # and patient 5 and 7 were not yet registered
+    assert list(table.patient_id) == [1, 2, 3, 6, 9]
+
+
+def test_demographics_as_of_month_end(register):
+    patient = list(register["patient_id"]).index(3)
+    month = _month(register, "2019-03-01")
+    assert register["sex"][patient] == "F"
+    assert register["region"][patient, month] == "East"
+    assert register["imd"][patient, month] == "5"
+    assert register["age_band"][patient, month] == "6-19"
+
+    # Patient 6 has two open registrations; the later one is used
+    patient = list(register["patient_id"]).index(6)
+    assert register["practice"][patient, month] == 5121
+
+    # Patient 7 registered on 2020-01-19
+    patient = list(register["patient_id"]).index(7)
+    assert register["gms_reg_status"][patient, _month(register, "2019-12-01")] == 0
+    assert register["population"][patient, _month(register, "2020-01-01")]
+
+
+def test_death_after_month_end_is_not_counted():
+    tables = register_engine.load_tables(EXAMPLE_DATA)
+    # Patient 1 dies on the first day of April 2019
+    tables["ons_deaths"] = pd.concat(
+        [
+            tables["ons_deaths"],
+            pd.DataFrame({"patient_id": [1], "date": ["2019-04-01"]}),
+        ],
+        ignore_index=True,
+    )
+    index_dates = register_engine.get_index_dates("2019-03-01", "2019-04-30")
+    register = register_engine.build_register(tables, index_dates)
+
+    patient = list(register["patient_id"]).index(1)
+    assert register["died"][patient].tolist() == [0, 1]
+    assert register["population"][patient].tolist() == [True, False]
+
+
+def test_missing_codes_do_not_change_other_codes(register, tmp_path):
+    shutil.copytree(EXAMPLE_DATA, tmp_path, dirs_exist_ok=True)
+    # An event with no code for patient 1
+    with open(tmp_path / "clinical_events.csv", "a") as f:
+        f.write("1,2019-01-01,,,\n")
+    with open(tmp_path / "medications.csv", "a") as f:
+        f.write("1,2019-01-01,\n")
+
+    tables = register_engine.load_tables(tmp_path)
+    index_dates = register_engine.get_index_dates("2019-03-01", "2020-09-30")
+    with_missing = register_engine.build_register(tables, index_dates)
+
+    assert tables["medications"].dmd_code.iloc[0] == "39113611000001102"
+    assert np.array_equal(with_missing["asthma"], register["asthma"])
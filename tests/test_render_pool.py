@@ -0,0 +1,21 @@
+import matplotlib.pyplot as plt
+
+from render_pool import render_charts, save_figure
+
+
+def draw_line(path, values):
+    plt.plot(values)
+    save_figure(plt, path)
+    return path.name
+
+
+def test_render_charts_writes_every_chart(tmp_path):
+    jobs = [
+        (draw_line, dict(path=tmp_path / f"chart_{i}.png", values=[0, i]))
+        for i in range(3)
+    ]
+
+    names = render_charts(jobs, processes=2)
+
+    assert names == ["chart_0.png", "chart_1.png", "chart_2.png"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == names
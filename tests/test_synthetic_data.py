@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+import synthetic_data
+
+
+def test_parse_study_definition_reads_expectations():
+    variables, default_expectations = synthetic_data.parse_study_definition(
+        synthetic_data.STUDY_DEFINITION_FILES
+    )
+
+    assert default_expectations["incidence"] == 0.5
+    assert variables["had_asthma"].expectations == {"incidence": 0.9}
+    assert variables["had_asthma"].codelist == "ast_cod"
+    assert variables["imd"].default_category == "missing"
+    assert "age >= 6" in variables["population"].expression
+
+
+def test_sample_cohort_applies_population_and_asthma_rules():
+    variables, default_expectations = synthetic_data.parse_study_definition(
+        synthetic_data.STUDY_DEFINITION_FILES
+    )
+    rng = np.random.default_rng(0)
+
+    cohort = synthetic_data.sample_cohort(rng, variables, 5000, default_expectations)
+
+    assert 0 < len(cohort) < 5000
+    assert (cohort.age >= 6).all()
+    assert (cohort.died == 0).all()
+    assert set(cohort.sex) <= {"M", "F"}
+    expected = (
+        cohort.had_asthma.astype(bool)
+        & cohort.had_asthma_drug_treatment.astype(bool)
+        & ~cohort.had_asthma_resolve.astype(bool)
+        & (cohort.age_ast_reg >= 6)
+    )
+    assert (cohort.asthma.astype(bool) == expected).all()
+
+
+def test_event_tables_spread_patients_over_practices(tmp_path):
+    synthetic_data.generate_event_tables(2000, tmp_path)
+
+    registrations = pd.read_csv(tmp_path / "practice_registrations.csv")
+    counts = registrations.practice_pseudo_id.value_counts()
+    assert counts.index.min() == 1
+    # Uniform over 40 practices, so about 50 patients each
+    assert counts.max() < 2 * len(registrations) / len(counts)
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+from utilities import events_in_windows, redact_small_numbers
+
+
+def test_events_in_windows_slides_with_window_end():
+    # Patient 0 has three events, patient 1 has none, patient 2 has one
+    dates = np.array(
+        ["2019-01-10", "2019-06-01", "2020-02-01", "2019-12-31"],
+        dtype="datetime64[D]",
+    )
+    offsets = np.array([0, 3, 3, 4])
+    window_ends = np.array(["2019-12-31", "2020-03-31"], dtype="datetime64[D]")
+
+    windows = events_in_windows(dates, offsets, window_ends, window_days=365)
+
+    np.testing.assert_array_equal(windows["count"], [[2, 2], [0, 0], [1, 1]])
+    np.testing.assert_array_equal(
+        windows["first"][0], np.array(["2019-01-10", "2019-06-01"], dtype="datetime64[D]")
+    )
+    np.testing.assert_array_equal(
+        windows["last"][0], np.array(["2019-06-01", "2020-02-01"], dtype="datetime64[D]")
+    )
+    assert np.isnat(windows["first"][1]).all()
+
+
+def test_events_in_windows_without_start_counts_all_earlier_events():
+    days = np.array([1, 5, 9, 2])
+    offsets = np.array([0, 3, 4])
+
+    windows = events_in_windows(days, offsets, np.array([0, 5, 10]))
+
+    np.testing.assert_array_equal(windows["count"], [[0, 2, 3], [0, 1, 1]])
+    np.testing.assert_array_equal(windows["last"], [[-1, 5, 9], [-1, 2, 2]])
+
+
+def test_events_in_windows_matches_naive_loop():
+    rng = np.random.default_rng(0)
+    sizes = rng.integers(0, 8, 50)
+    offsets = np.r_[0, np.cumsum(sizes)]
+    days = np.concatenate([np.sort(rng.integers(0, 400, size)) for size in sizes])
+    window_ends = np.arange(30, 400, 30)
+
+    for window_days in [None, 0, 90]:
+        windows = events_in_windows(days, offsets, window_ends, window_days)
+        for patient in range(len(sizes)):
+            events = days[offsets[patient] : offsets[patient + 1]]
+            for window, end in enumerate(window_ends):
+                start = -np.inf if window_days is None else end - window_days
+                in_window = events[(events >= start) & (events <= end)]
+                assert windows["count"][patient, window] == len(in_window)
+                assert windows["exists"][patient, window] == bool(len(in_window))
+                if len(in_window):
+                    assert windows["first"][patient, window] == in_window[0]
+                    assert windows["last"][patient, window] == in_window[-1]
+                else:
+                    assert windows["last"][patient, window] == -1
+
+
+def test_redact_small_numbers_is_applied_within_each_date():
+    df = pd.DataFrame(
+        {
+            "date": ["2019-03-01"] * 3 + ["2019-04-01"] * 3,
+            "numerator": [3, 10, 20, 30, 40, 50],
+            "denominator": [100] * 6,
+        }
+    )
+    df["rate"] = df.numerator / df.denominator
+
+    redacted = redact_small_numbers(df, 5, "numerator", "denominator", "rate")
+
+    # 3 is redacted, then 10 so that the redacted total is more than 5
+    assert redacted.numerator.isna().tolist() == [True, True] + [False] * 4
+    assert redacted.rate.isna().tolist() == [True, True] + [False] * 4
+    assert redacted.denominator.notna().all()
+
+
+def test_redact_small_numbers_leaves_groups_without_small_numbers():
+    df = pd.DataFrame({"numerator": [0, 10, 20], "denominator": [50, 60, 70]})
+    df["rate"] = df.numerator / df.denominator
+
+    redacted = redact_small_numbers(df, 5, "numerator", "denominator", "rate")
+
+    assert redacted.numerator.tolist() == [0, 10, 20]